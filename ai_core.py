@@ -1,18 +1,42 @@
+import json
 import os
+import queue
+import re
+import threading
+import time
 import yaml
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any
+from typing import TYPE_CHECKING, Any
 
-import chromadb
+import anthropic
 import google.generativeai as genai
+import openai
 from anthropic import Anthropic
-from chromadb.api.models.Collection import Collection
-from chromadb.utils import embedding_functions
+from google.api_core import exceptions as google_exceptions
 from openai import OpenAI
 
+import index_versions
+import lexical_index
+import local_embeddings
+import profiling
+import provider_pool
+import schema_hierarchy
+import vector_index
+
+if TYPE_CHECKING:
+    from chromadb.api.models.Collection import Collection
+
 # --- Funzioni di Caricamento Risorse ---
 
+def get_knowledge_base_files() -> list[Path]:
+    """Restituisce i file testuali della knowledge base (escludendo schema.org) in ordine di nome."""
+    kb_path = Path(__file__).resolve().parent / "knowledge_base"
+    if not kb_path.is_dir():
+        return []
+    return sorted(file_path for file_path in kb_path.glob('*.*') if 'schemaorg' not in file_path.name)
+
+
 def load_prompt_and_knowledge_base() -> tuple[str, str]:
     """
     Carica il prompt master e la knowledge base testuale (escludendo schema.org).
@@ -25,12 +49,9 @@ def load_prompt_and_knowledge_base() -> tuple[str, str]:
             prompt_template = f.read()
         
         knowledge_base_content = ""
-        kb_path = script_dir / "knowledge_base"
-        if kb_path.is_dir():
-            for file_path in kb_path.glob('*.*'):
-                if 'schemaorg' not in file_path.name:
-                    with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-                        knowledge_base_content += f.read() + "\n\n"
+        for file_path in get_knowledge_base_files():
+            with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+                knowledge_base_content += f.read() + "\n\n"
 
         return prompt_template, knowledge_base_content.strip()
     except FileNotFoundError as e:
@@ -44,6 +65,21 @@ class LLMConfig:
     client: Any
     model: str
     embedding_provider: str
+    cascade: "CascadeConfig | None" = None
+    pool: "provider_pool.ProviderPool | None" = None
+
+    @property
+    def label(self) -> str:
+        """Identificativo del backend (`provider:modello`) usato nei log e nel riepilogo."""
+        return f"{self.provider}:{self.model}"
+
+
+@dataclass
+class CascadeConfig:
+    """Livello economico della cascata e soglie oltre le quali si usa direttamente il modello principale."""
+    fast: LLMConfig
+    max_chars: int
+    max_headings: int
 
 
 def get_chroma_persist_directory() -> str:
@@ -54,30 +90,86 @@ def get_chroma_persist_directory() -> str:
     return str(Path(__file__).resolve().parent / "chroma_db")
 
 
+# Provider di embedding predefinito per ogni provider di generazione
+_DEFAULT_EMBEDDING_PROVIDERS = {
+    "gemini": "google",
+    "openai": "openai",
+    "openrouter": "sentence-transformers",
+    "claude": "google",
+}
+
+
+def resolve_primary_provider() -> tuple[str, str | None]:
+    """
+    Determina il provider di generazione principale e l'eventuale modello esplicito.
+
+    Con `LLM_POOL` il principale è il primo backend del pool, altrimenti `LLM_PROVIDER`.
+    Indicizzazione, stima dei costi e generazione passano tutte da qui, così l'indice
+    viene costruito e interrogato con gli stessi embeddings.
+
+    Ritorna:
+        tuple: (provider, modello indicato nel pool oppure None)
+    """
+    pool_spec = provider_pool.parse_pool_spec(os.getenv("LLM_POOL") or "")
+    if pool_spec:
+        provider, model_override, _ = pool_spec[0]
+        return provider, model_override
+    return (os.getenv("LLM_PROVIDER") or "gemini").strip().lower(), None
+
+
 def resolve_embedding_provider() -> str:
-    """Determina il provider degli embeddings basandosi sulla configurazione."""
+    """Determina il provider degli embeddings: `EMBEDDING_PROVIDER` o il predefinito del provider principale."""
     override = os.getenv("EMBEDDING_PROVIDER")
     if override:
         return override.strip().lower()
 
-    llm_provider = (os.getenv("LLM_PROVIDER") or "gemini").strip().lower()
-    if llm_provider == "openai":
-        return "openai"
-    if llm_provider == "openrouter":
-        return "sentence-transformers"
-    return "google"
+    provider, _ = resolve_primary_provider()
+    return _DEFAULT_EMBEDDING_PROVIDERS.get(provider, "google")
+
+
+_embedding_functions: dict[str, Any] = {}
 
 
 def configure_embedding_function(provider: str | None = None):
-    """Configura la funzione di embedding da usare con ChromaDB."""
+    """
+    Configura la funzione di embedding da usare con ChromaDB.
+
+    La funzione viene creata una sola volta per provider, così gli indici degli schemi
+    e della knowledge base condividono lo stesso client (o modello locale).
+    """
     provider_name = (provider or resolve_embedding_provider()).strip().lower()
+    if provider_name not in _embedding_functions:
+        _embedding_functions[provider_name] = _create_embedding_function(provider_name)
+    return _embedding_functions[provider_name]
+
+
+# Variabile d'ambiente e modello di embedding predefinito per ciascun provider
+_EMBEDDING_MODELS = {
+    "google": ("GEMINI_EMBEDDING_MODEL", "models/embedding-001"),
+    "openai": ("OPENAI_EMBEDDING_MODEL", "text-embedding-3-large"),
+    "sentence-transformers": ("SENTENCE_TRANSFORMER_MODEL", "all-MiniLM-L6-v2"),
+}
+
+
+def resolve_embedding_model(provider: str) -> str:
+    """Restituisce il modello di embedding configurato per il provider."""
+    provider_name = index_versions.canonical_embedding_provider(provider)
+    if provider_name not in _EMBEDDING_MODELS:
+        raise SystemExit(f"Errore: Provider di embedding '{provider_name}' non supportato.")
+    env_name, default_model = _EMBEDDING_MODELS[provider_name]
+    return os.getenv(env_name, default_model)
+
+
+def _create_embedding_function(provider_name: str):
 
     if provider_name in {"google", "gemini"}:
         api_key = os.getenv("GEMINI_API_KEY")
         if not api_key:
             raise SystemExit("Errore: La chiave API 'GEMINI_API_KEY' è necessaria per gli embeddings di Google.")
         genai.configure(api_key=api_key)
-        model_name = os.getenv("GEMINI_EMBEDDING_MODEL", "models/embedding-001")
+        model_name = resolve_embedding_model(provider_name)
+
+        from chromadb.utils import embedding_functions
 
         embedding_cls = getattr(
             embedding_functions,
@@ -97,45 +189,66 @@ def configure_embedding_function(provider: str | None = None):
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
             raise SystemExit("Errore: La chiave API 'OPENAI_API_KEY' è necessaria per gli embeddings di OpenAI.")
-        model_name = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-large")
+        model_name = resolve_embedding_model(provider_name)
+
+        from chromadb.utils import embedding_functions
         return embedding_functions.OpenAIEmbeddingFunction(api_key=api_key, model_name=model_name)
 
     if provider_name in {"sentence-transformers", "sentence_transformers", "local"}:
-        model_name = os.getenv("SENTENCE_TRANSFORMER_MODEL", "all-MiniLM-L6-v2")
-        return embedding_functions.SentenceTransformerEmbeddingFunction(model_name=model_name)
+        model_name = resolve_embedding_model(provider_name)
+        return local_embeddings.create_local_embedding_function(model_name)
 
     raise SystemExit(f"Errore: Provider di embedding '{provider_name}' non supportato.")
 
 
-def configure_ai_models() -> tuple[LLMConfig, Collection]:
-    """Configura e restituisce il modello generativo selezionato e la collection ChromaDB."""
+# Variabile d'ambiente e modello predefinito per ciascun provider
+_DEFAULT_MODELS = {
+    "gemini": ("GEMINI_MODEL", "gemini-2.5-pro"),
+    "openai": ("OPENAI_MODEL", "gpt-4o-mini"),
+    "openrouter": ("OPENROUTER_MODEL", "openrouter/auto"),
+    "claude": ("CLAUDE_MODEL", "claude-3-5-sonnet-20240620"),
+}
+
 
-    provider = (os.getenv("LLM_PROVIDER") or "gemini").strip().lower()
-    embedding_override = os.getenv("EMBEDDING_PROVIDER")
-    model_name: str
+def resolve_model_name(provider: str, model_override: str | None = None) -> str:
+    """Restituisce il modello configurato per il provider, senza creare il client."""
+    env_name, default_model = _DEFAULT_MODELS.get(provider.strip().lower(), (None, None))
+    if env_name is None:
+        raise SystemExit(
+            f"Errore: Provider LLM '{provider}' non supportato. Usare 'gemini', 'openai', 'openrouter' o 'claude'."
+        )
+    return model_override or os.getenv(env_name, default_model)
+
+
+def create_llm_client(provider: str, model_override: str | None = None) -> tuple[Any, str, str]:
+    """
+    Crea il client del provider LLM indicato.
+
+    Ritorna:
+        tuple: (client, nome del modello, provider di embedding predefinito)
+    """
+    provider = provider.strip().lower()
 
     if provider == "gemini":
         api_key = os.getenv("GEMINI_API_KEY")
         if not api_key:
             raise SystemExit("Errore: La chiave API 'GEMINI_API_KEY' non è stata trovata.")
         genai.configure(api_key=api_key)
-        model_name = os.getenv("GEMINI_MODEL", "gemini-2.5-pro")
-        llm_client = genai.GenerativeModel(model_name)
-        default_embedding = "google"
+        model_name = resolve_model_name(provider, model_override)
+        return genai.GenerativeModel(model_name), model_name, "google"
 
-    elif provider == "openai":
+    if provider == "openai":
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
             raise SystemExit("Errore: La chiave API 'OPENAI_API_KEY' non è stata trovata.")
-        model_name = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-        llm_client = OpenAI(api_key=api_key)
-        default_embedding = "openai"
+        model_name = resolve_model_name(provider, model_override)
+        return OpenAI(api_key=api_key, timeout=get_stream_timeout()), model_name, "openai"
 
-    elif provider == "openrouter":
+    if provider == "openrouter":
         api_key = os.getenv("OPENROUTER_API_KEY")
         if not api_key:
             raise SystemExit("Errore: La chiave API 'OPENROUTER_API_KEY' non è stata trovata.")
-        model_name = os.getenv("OPENROUTER_MODEL", "openrouter/auto")
+        model_name = resolve_model_name(provider, model_override)
 
         default_headers = {}
         referer = os.getenv("OPENROUTER_APP_URL")
@@ -148,43 +261,252 @@ def configure_ai_models() -> tuple[LLMConfig, Collection]:
         client_kwargs = {
             "api_key": api_key,
             "base_url": "https://openrouter.ai/api/v1",
+            "timeout": get_stream_timeout(),
         }
         if default_headers:
             client_kwargs["default_headers"] = default_headers
 
-        llm_client = OpenAI(**client_kwargs)
-        default_embedding = "sentence-transformers"
+        return OpenAI(**client_kwargs), model_name, "sentence-transformers"
 
-    elif provider == "claude":
+    if provider == "claude":
         api_key = os.getenv("ANTHROPIC_API_KEY")
         if not api_key:
             raise SystemExit("Errore: La chiave API 'ANTHROPIC_API_KEY' non è stata trovata.")
-        model_name = os.getenv("CLAUDE_MODEL", "claude-3-5-sonnet-20240620")
-        llm_client = Anthropic(api_key=api_key)
-        default_embedding = "google"
+        model_name = resolve_model_name(provider, model_override)
+        return Anthropic(api_key=api_key, timeout=get_stream_timeout()), model_name, "google"
+
+    raise SystemExit(
+        f"Errore: Provider LLM '{provider}' non supportato. Usare 'gemini', 'openai', 'openrouter' o 'claude'."
+    )
+
+
+def configure_cascade(embedding_provider: str) -> CascadeConfig | None:
+    """
+    Configura il livello economico della cascata, se richiesto.
+
+    La cascata si attiva impostando `LLM_CASCADE_MODEL`; il provider del livello
+    economico è `LLM_CASCADE_PROVIDER` (default: il provider principale).
+    """
+    cascade_backend = resolve_cascade_backend()
+    if cascade_backend is None:
+        return None
+
+    cascade_provider, cascade_model = cascade_backend
+    fast_client, fast_model, _ = create_llm_client(cascade_provider, cascade_model)
+    fast_config = LLMConfig(
+        provider=cascade_provider,
+        client=fast_client,
+        model=fast_model,
+        embedding_provider=embedding_provider,
+    )
+    max_chars, max_headings = resolve_cascade_thresholds()
+    return CascadeConfig(fast=fast_config, max_chars=max_chars, max_headings=max_headings)
+
+
+def resolve_cascade_backend() -> tuple[str, str] | None:
+    """Restituisce (provider, modello) del livello economico della cascata, o None se disattivata."""
+    cascade_model = os.getenv("LLM_CASCADE_MODEL")
+    if not cascade_model:
+        return None
+    return (os.getenv("LLM_CASCADE_PROVIDER") or resolve_primary_provider()[0]).strip().lower(), cascade_model
+
+
+def resolve_cascade_thresholds() -> tuple[int, int]:
+    """Restituisce le soglie (caratteri, titoli) oltre le quali si salta il livello economico."""
+    try:
+        max_chars = int(os.getenv("LLM_CASCADE_MAX_CHARS", "15000"))
+        max_headings = int(os.getenv("LLM_CASCADE_MAX_HEADINGS", "30"))
+    except ValueError as e:
+        raise SystemExit(f"Errore: Soglie della cascata non valide. Dettagli: {e}")
+    return max_chars, max_headings
+
 
+def resolve_vector_backend() -> str:
+    """Restituisce il backend dell'indice vettoriale: 'chroma' (default) o 'numpy'."""
+    backend = (os.getenv("VECTOR_BACKEND") or "chroma").strip().lower()
+    if backend not in {"chroma", "numpy"}:
+        raise SystemExit(f"Errore: Backend vettoriale '{backend}' non supportato. Usare 'chroma' o 'numpy'.")
+    return backend
+
+
+def resolve_retrieval_mode() -> str:
+    """Restituisce la modalità di ricerca degli schemi: 'vector' (default), 'lexical' o 'hybrid'."""
+    mode = (os.getenv("RETRIEVAL_MODE") or "vector").strip().lower()
+    if mode not in {"vector", "lexical", "hybrid"}:
+        raise SystemExit(f"Errore: Modalità di ricerca '{mode}' non supportata. Usare 'vector', 'lexical' o 'hybrid'.")
+    return mode
+
+
+def describe_schema_store() -> str:
+    """Descrive l'indice degli schemi in uso, per i messaggi di avvio."""
+    mode = resolve_retrieval_mode()
+    if mode == "lexical":
+        return f"BM25 ({lexical_index.get_lexical_index_path()})"
+
+    if resolve_vector_backend() == "numpy":
+        store_dir = vector_index.get_numpy_index_directory().parent
+        description = "NumPy"
     else:
-        raise SystemExit(
-            f"Errore: Provider LLM '{provider}' non supportato. Usare 'gemini', 'openai', 'openrouter' o 'claude'."
+        store_dir = get_chroma_persist_directory()
+        description = "ChromaDB"
+    alias = index_versions.get_alias(store_dir, "schema_embeddings")
+    description += f" ({store_dir}, versione {alias['version'] if alias else 'schema_embeddings'})"
+    if mode == "hybrid":
+        description += f" + BM25 ({lexical_index.get_lexical_index_path()})"
+    return description
+
+
+def open_vector_store(embedding_function, collection_name: str = "schema_embeddings", embedding_provider: str | None = None):
+    """
+    Apre l'indice vettoriale configurato con `VECTOR_BACKEND`.
+
+    Con 'numpy' viene caricato l'indice esportato da `indexer.py` in memoria (memory-mapped),
+    senza avviare ChromaDB. Entrambi i backend espongono lo stesso metodo `query`.
+
+    Viene aperta la versione indicata dall'alias scritto da `indexer.py`, dopo aver
+    verificato che sia stata costruita con il provider e il modello di embedding correnti.
+    """
+    embedding_provider = embedding_provider or resolve_embedding_provider()
+    embedding_model = resolve_embedding_model(embedding_provider)
+
+    if resolve_vector_backend() == "numpy":
+        store_dir = vector_index.get_numpy_index_directory(collection_name).parent
+        version = index_versions.resolve_version(store_dir, collection_name, embedding_provider, embedding_model)
+        return vector_index.NumpyVectorIndex(vector_index.get_numpy_index_directory(version), embedding_function)
+
+    import chromadb
+
+    store_dir = get_chroma_persist_directory()
+    version = index_versions.resolve_version(store_dir, collection_name, embedding_provider, embedding_model)
+    chroma_client = chromadb.PersistentClient(path=store_dir)
+    if version == collection_name:
+        return chroma_client.get_or_create_collection(
+            name=collection_name,
+            embedding_function=embedding_function,
         )
+    try:
+        return chroma_client.get_collection(name=version, embedding_function=embedding_function)
+    except Exception as e:
+        raise SystemExit(f"Errore: Versione '{version}' dell'indice '{collection_name}' non trovata ({e}). Rieseguire 'python indexer.py'.")
 
-    embedding_provider = (embedding_override or default_embedding).strip().lower()
-    embedding_function = configure_embedding_function(embedding_provider)
 
-    chroma_client = chromadb.PersistentClient(path=get_chroma_persist_directory())
-    collection = chroma_client.get_or_create_collection(
-        name="schema_embeddings",
-        embedding_function=embedding_function,
+def open_schema_store(embedding_provider: str, collection_name: str = "schema_embeddings"):
+    """
+    Apre l'indice usato da `retrieve_relevant_schemas` secondo `RETRIEVAL_MODE`.
+
+    In modalità 'lexical' non viene configurata alcuna funzione di embedding, quindi la
+    ricerca non effettua chiamate API; 'hybrid' fonde i risultati vettoriali e BM25.
+    """
+    mode = resolve_retrieval_mode()
+    if mode == "lexical":
+        return lexical_index.LexicalIndex(lexical_index.get_lexical_index_path(collection_name))
+
+    vector_store = open_vector_store(configure_embedding_function(embedding_provider), collection_name, embedding_provider)
+    if mode == "hybrid":
+        return lexical_index.HybridRetriever(
+            vector_store,
+            lexical_index.LexicalIndex(lexical_index.get_lexical_index_path(collection_name)),
+        )
+    return vector_store
+
+
+def configure_pool(primary: LLMConfig) -> provider_pool.ProviderPool | None:
+    """
+    Configura il pool di backend di generazione, se richiesto con `LLM_POOL`.
+
+    Esempio: `LLM_POOL=gemini:gemini-2.5-flash:2,openai:gpt-4o-mini:1,claude`. Ogni
+    provider richiede la propria chiave API; il modello omesso è quello della variabile
+    `*_MODEL` del provider. Il primo backend è quello principale, di cui si riusa il client.
+    """
+    spec = os.getenv("LLM_POOL")
+    if not spec or not spec.strip():
+        return None
+
+    members = []
+    for index, (provider, model_override, weight) in enumerate(provider_pool.parse_pool_spec(spec)):
+        if index == 0:
+            client, model_name = primary.client, primary.model
+        else:
+            client, model_name, _ = create_llm_client(provider, model_override)
+        config = LLMConfig(provider=provider, client=client, model=model_name, embedding_provider=primary.embedding_provider)
+        members.append(provider_pool.PoolMember(config=config, label=config.label, weight=weight))
+
+    try:
+        cooldown = float(os.getenv("LLM_POOL_COOLDOWN", "30"))
+    except ValueError:
+        raise SystemExit("Errore: LLM_POOL_COOLDOWN deve essere un numero di secondi.")
+    return provider_pool.ProviderPool(members, cooldown=cooldown)
+
+
+def describe_llm_config() -> LLMConfig:
+    """
+    Descrive modello principale, cascata e pool configurati senza creare client né
+    contattare i provider: serve alle stime di costo di `--plan`.
+    """
+    provider, model_override = resolve_primary_provider()
+    embedding_provider = resolve_embedding_provider()
+    primary = LLMConfig(
+        provider=provider,
+        client=None,
+        model=resolve_model_name(provider, model_override),
+        embedding_provider=embedding_provider,
     )
 
-    llm_config = LLMConfig(provider=provider, client=llm_client, model=model_name, embedding_provider=embedding_provider)
+    cascade_backend = resolve_cascade_backend()
+    if cascade_backend is not None:
+        cascade_provider, cascade_model = cascade_backend
+        fast = LLMConfig(
+            provider=cascade_provider,
+            client=None,
+            model=resolve_model_name(cascade_provider, cascade_model),
+            embedding_provider=embedding_provider,
+        )
+        max_chars, max_headings = resolve_cascade_thresholds()
+        primary.cascade = CascadeConfig(fast=fast, max_chars=max_chars, max_headings=max_headings)
+
+    pool_spec = provider_pool.parse_pool_spec(os.getenv("LLM_POOL") or "")
+    if pool_spec:
+        members = []
+        for pool_provider, pool_model, weight in pool_spec:
+            config = LLMConfig(
+                provider=pool_provider,
+                client=None,
+                model=resolve_model_name(pool_provider, pool_model),
+                embedding_provider=embedding_provider,
+            )
+            members.append(provider_pool.PoolMember(config=config, label=config.label, weight=weight))
+        primary.pool = provider_pool.ProviderPool(members)
+    return primary
+
+
+def configure_ai_models() -> tuple[LLMConfig, "Collection"]:
+    """
+    Configura e restituisce il modello generativo selezionato e l'indice degli schemi (vettoriale, BM25 o ibrido).
+
+    Con `LLM_POOL` il modello principale è il primo backend del pool, che viene usato
+    per bilanciare le generazioni tra tutti i backend configurati.
+    """
+    provider, model_override = resolve_primary_provider()
+    llm_client, model_name, _ = create_llm_client(provider, model_override)
+
+    embedding_provider = resolve_embedding_provider()
+    collection = open_schema_store(embedding_provider)
+
+    llm_config = LLMConfig(
+        provider=provider,
+        client=llm_client,
+        model=model_name,
+        embedding_provider=embedding_provider,
+        cascade=configure_cascade(embedding_provider),
+    )
+    llm_config.pool = configure_pool(llm_config)
 
     return llm_config, collection
 
 
 # --- Funzione di Ricerca Vettoriale ---
-def retrieve_relevant_schemas(collection: Collection, query_text: str) -> str:
-    """Esegue una ricerca vettoriale su ChromaDB per ottenere gli schemi più pertinenti."""
+def retrieve_relevant_schemas(collection: "Collection", query_text: str) -> str:
+    """Esegue una ricerca (vettoriale, BM25 o ibrida) per ottenere gli schemi più pertinenti."""
     if not query_text:
         return "Nessun contenuto da analizzare."
 
@@ -192,13 +514,534 @@ def retrieve_relevant_schemas(collection: Collection, query_text: str) -> str:
         results = collection.query(query_texts=[query_text], n_results=3)
         documents = results.get("documents", [])
         if documents and documents[0]:
-            return "\n".join(documents[0])
+            ids = (results.get("ids") or [[]])[0]
+            return "\n".join(
+                _with_inherited_properties(document, ids[i] if i < len(ids) else None)
+                for i, document in enumerate(documents[0])
+            )
         return "Nessuno schema pertinente trovato."
     except Exception as e:
-        print(f"  -> Errore durante la ricerca su ChromaDB: {e}")
+        print(f"  -> Errore durante la ricerca degli schemi: {e}")
         return "Errore durante il recupero degli schemi."
 
 
+def _with_inherited_properties(document: str, schema_id: str | None) -> str:
+    """Aggiunge allo snippet dello schema le proprietà ereditate, lette dall'indice della gerarchia."""
+    hierarchy = schema_hierarchy.get_hierarchy()
+    if hierarchy is None or not schema_id or not schema_hierarchy.is_inheritance_enabled():
+        return document
+    inherited = hierarchy.inherited_properties_by_ancestor(schema_id)
+    if not inherited:
+        return document
+    groups = "; ".join(f"da {ancestor}: {', '.join(properties)}" for ancestor, properties in inherited)
+    return f"{document} Proprietà ereditate ({groups})."
+
+
+# --- Funzioni di Generazione in Streaming ---
+# Margine aggiuntivo di token in uscita per provider: i modelli Gemini 2.5 contano
+# anche i token di "thinking" nel limite `max_output_tokens`.
+_OUTPUT_TOKEN_HEADROOM = {"gemini": 2048, "openai": 0, "openrouter": 0, "claude": 0}
+_SCHEMA_KEY_PATTERN = re.compile(r"^schema\s*:")
+_TOP_LEVEL_KEY_PATTERN = re.compile(r"^['\"]?([^\s'\":#][^'\":]*?)['\"]?\s*:(?:\s|$)")
+_QUOTED_STRING_PATTERN = re.compile(r'"(?:[^"\\]|\\.)*"|\'[^\']*\'')
+_CHARS_PER_TOKEN = 4
+
+
+def get_output_token_limit(provider: str, kb_content: str) -> int:
+    """
+    Calcola il limite di token in uscita per il provider.
+
+    Il limite è proporzionale al numero di campi del blueprint (più l'oggetto `schema`)
+    e può essere forzato con `LLM_MAX_OUTPUT_TOKENS`.
+    """
+    override = os.getenv("LLM_MAX_OUTPUT_TOKENS")
+    if override:
+        try:
+            return int(override)
+        except ValueError:
+            raise SystemExit(f"Errore: LLM_MAX_OUTPUT_TOKENS non valido: '{override}'.")
+
+    field_count = _count_blueprint_fields(parse_frontmatter_blueprint(kb_content))
+    base_limit = max(512, 384 + 48 * field_count)
+    return base_limit + _OUTPUT_TOKEN_HEADROOM.get(provider, 0)
+
+
+class YamlBlockTerminator:
+    """
+    Accumula l'output in streaming e riconosce la fine del blocco YAML.
+
+    Il blocco termina alla prima riga non indentata successiva all'oggetto `schema`
+    (o a una chiusura di code fence), purché non ci siano parentesi di flow style aperte
+    e siano già comparse tutte le chiavi di primo livello in `required_keys`: se il
+    modello scrive `schema` prima di un campo obbligatorio lo stream prosegue.
+    """
+
+    def __init__(self, required_keys=None):
+        self.lines: list[str] = []
+        self.complete = False
+        self.required_keys = set(required_keys or ())
+        self._seen_keys: set[str] = set()
+        self._pending = ""
+        self._in_schema = False
+        self._depth = 0
+
+    def feed(self, text: str) -> bool:
+        """Aggiunge un frammento di testo e restituisce True quando il blocco è completo."""
+        if self.complete:
+            return True
+        self._pending += text
+        while "\n" in self._pending and not self.complete:
+            line, self._pending = self._pending.split("\n", 1)
+            self._consume_line(line)
+        return self.complete
+
+    def result(self) -> str:
+        """Restituisce il testo del blocco YAML accumulato finora."""
+        lines = list(self.lines)
+        if not self.complete and self._pending:
+            lines.append(self._pending)
+        return "\n".join(lines)
+
+    def _consume_line(self, line: str) -> None:
+        stripped = line.strip()
+        if stripped.startswith("```"):
+            if any(existing.strip() for existing in self.lines):
+                self.complete = True
+            return
+
+        if self._in_schema and self._depth <= 0 and stripped and not line[0].isspace() and stripped[0] not in "}]":
+            if self.required_keys <= self._seen_keys:
+                self.complete = True
+                return
+            # Mancano campi obbligatori dopo `schema`: si continua a leggere fino alla fine dello stream
+            self._in_schema = False
+
+        top_level_key = _TOP_LEVEL_KEY_PATTERN.match(line)
+        if top_level_key:
+            self._seen_keys.add(top_level_key.group(1))
+        if _SCHEMA_KEY_PATTERN.match(line):
+            self._in_schema = True
+        if self._in_schema:
+            unquoted = _QUOTED_STRING_PATTERN.sub("", line)
+            self._depth += unquoted.count("{") + unquoted.count("[") - unquoted.count("}") - unquoted.count("]")
+        self.lines.append(line)
+
+
+@profiling.staged("prompt_assembly")
+def build_prompt(prompt_template: str, schema_context: str, kb_content: str, content: str) -> str:
+    """Sostituisce i placeholder del prompt master con i contenuti del documento."""
+    final_prompt = prompt_template.replace("{{KNOWLEDGE_BASE_CONTENT}}", kb_content)
+    final_prompt = final_prompt.replace("{{SCHEMA_DEFINITIONS}}", schema_context)
+    return final_prompt.replace("{{MARKDOWN_CONTENT}}", content)
+
+
+def _stream_text_chunks(llm_config: LLMConfig, prompt: str, max_output_tokens: int, json_schema: dict | None = None):
+    """
+    Genera i frammenti di testo prodotti in streaming dal provider selezionato.
+
+    Con `json_schema` l'output è vincolato a un oggetto JSON: `response_format` per
+    OpenAI/OpenRouter (in modalità strict quando lo schema lo consente), `response_schema`
+    per Gemini e una chiamata forzata a uno strumento per Claude (il cui input viene
+    restituito come testo JSON).
+    """
+    if llm_config.provider == "gemini":
+        schema_kwargs = {"response_schema": _encode_jsonld_as_string(json_schema)} if json_schema else {}
+        generation_config = genai.types.GenerationConfig(
+            response_mime_type="application/json" if json_schema else "text/plain",
+            max_output_tokens=max_output_tokens,
+            **schema_kwargs,
+        )
+        response = llm_config.client.generate_content(
+            prompt,
+            generation_config=generation_config,
+            stream=True,
+            request_options={"timeout": get_stream_timeout()},
+        )
+        try:
+            for chunk in response:
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # Frammenti senza parti testuali (es. motivo di terminazione)
+                    continue
+                if text:
+                    yield text
+        finally:
+            _close_gemini_stream(response)
+
+    elif llm_config.provider in {"openai", "openrouter"}:
+        request_kwargs = {}
+        if json_schema:
+            strict_schema = _strict_json_schema(json_schema)
+            request_kwargs["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {
+                    "name": _FRONTMATTER_TOOL_NAME,
+                    "schema": strict_schema or json_schema,
+                    "strict": strict_schema is not None,
+                },
+            }
+        stream = llm_config.client.chat.completions.create(
+            model=llm_config.model,
+            temperature=0.1,
+            max_tokens=max_output_tokens,
+            stream=True,
+            messages=[
+                {"role": "system", "content": "Sei un assistente che produce frontmatter YAML valido."},
+                {"role": "user", "content": prompt},
+            ],
+            **request_kwargs,
+        )
+        try:
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            stream.close()
+
+    elif llm_config.provider == "claude" and json_schema:
+        response = llm_config.client.messages.create(
+            model=llm_config.model,
+            max_tokens=max_output_tokens,
+            temperature=0,
+            tools=[{
+                "name": _FRONTMATTER_TOOL_NAME,
+                "description": "Registra il frontmatter generato per il documento.",
+                "input_schema": json_schema,
+            }],
+            tool_choice={"type": "tool", "name": _FRONTMATTER_TOOL_NAME},
+            messages=[{"role": "user", "content": prompt}],
+        )
+        for block in response.content:
+            if getattr(block, "type", None) == "tool_use":
+                yield json.dumps(block.input, ensure_ascii=False)
+                break
+
+    elif llm_config.provider == "claude":
+        with llm_config.client.messages.stream(
+            model=llm_config.model,
+            max_tokens=max_output_tokens,
+            temperature=0,
+            messages=[{"role": "user", "content": prompt}],
+        ) as stream:
+            for text in stream.text_stream:
+                yield text
+
+    else:
+        raise ValueError(f"Provider LLM non gestito: {llm_config.provider}")
+
+
+def _close_gemini_stream(response) -> None:
+    """Chiude la chiamata in streaming sottostante: la risposta di Gemini non espone un `close()`."""
+    iterator = getattr(response, "_iterator", None)
+    for method_name in ("cancel", "close"):
+        method = getattr(iterator, method_name, None)
+        if callable(method):
+            method()
+            return
+
+
+def get_stream_timeout() -> float:
+    """Secondi massimi per una generazione (`LLM_STREAM_TIMEOUT`, default 180), usati anche come timeout dei client."""
+    try:
+        return float(os.getenv("LLM_STREAM_TIMEOUT", "180"))
+    except ValueError:
+        raise SystemExit("Errore: LLM_STREAM_TIMEOUT deve essere un numero di secondi.")
+
+
+class JsonObjectTerminator:
+    """
+    Accumula l'output strutturato e riconosce la chiusura dell'oggetto JSON di primo
+    livello (parentesi contate fuori dalle stringhe), per interrompere lo stream anche
+    con l'output strutturato.
+    """
+
+    def __init__(self):
+        self._parts: list[str] = []
+        self.complete = False
+        self._depth = 0
+        self._started = False
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, text: str) -> bool:
+        if self.complete:
+            return True
+        for index, char in enumerate(text):
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+                self._started = True
+            elif char in "}]":
+                self._depth -= 1
+                if self._started and self._depth == 0:
+                    self._parts.append(text[:index + 1])
+                    self.complete = True
+                    return True
+        self._parts.append(text)
+        return False
+
+    def result(self) -> str:
+        return "".join(self._parts)
+
+
+class TextAccumulator:
+    """Accumula l'output in streaming senza interromperlo (stessa interfaccia di YamlBlockTerminator)."""
+
+    def __init__(self):
+        self._parts: list[str] = []
+
+    def feed(self, text: str) -> bool:
+        self._parts.append(text)
+        return False
+
+    def result(self) -> str:
+        return "".join(self._parts)
+
+
+_END_OF_STREAM = object()
+
+
+@profiling.staged("llm_wait")
+def _collect_streamed_output(llm_config: LLMConfig, prompt: str, max_output_tokens: int, terminator=None, json_schema: dict | None = None) -> str:
+    """
+    Legge lo stream fino alla fine del blocco YAML, interrompendolo in anticipo.
+
+    Lo stream viene annullato anche quando supera `LLM_STREAM_TIMEOUT` secondi o una
+    lunghezza incompatibile con il limite di token in uscita. Con un `terminator`
+    diverso (es. `TextAccumulator`) lo stream viene letto fino alla fine.
+
+    Lo stream è letto da un thread separato, così la scadenza vale anche quando il
+    provider smette di inviare frammenti; il thread si chiude al frammento successivo
+    o, se lo stream resta bloccato, al timeout del client (lo stesso `LLM_STREAM_TIMEOUT`).
+    """
+    timeout = get_stream_timeout()
+    max_chars = max_output_tokens * _CHARS_PER_TOKEN * 2
+    started_at = time.monotonic()
+    terminator = terminator or YamlBlockTerminator()
+    received_chars = 0
+
+    chunks = _stream_text_chunks(llm_config, prompt, max_output_tokens, json_schema=json_schema)
+    pending = queue.Queue()
+    cancelled = threading.Event()
+
+    def read_stream():
+        try:
+            for text in chunks:
+                if cancelled.is_set():
+                    break
+                pending.put(text)
+        except Exception as e:
+            pending.put(e)
+        finally:
+            chunks.close()
+            pending.put(_END_OF_STREAM)
+
+    threading.Thread(target=read_stream, name="llm-stream", daemon=True).start()
+    try:
+        while True:
+            try:
+                item = pending.get(timeout=max(timeout - (time.monotonic() - started_at), 0))
+            except queue.Empty:
+                print(f"  -> Generazione annullata: superati {timeout:g} secondi.")
+                break
+            if item is _END_OF_STREAM:
+                break
+            if isinstance(item, Exception):
+                raise item
+            received_chars += len(item)
+            if terminator.feed(item):
+                print("  -> Fine dell'output rilevata: generazione interrotta.")
+                break
+            if received_chars > max_chars:
+                print("  -> Generazione annullata: output fuori controllo.")
+                break
+    finally:
+        cancelled.set()
+
+    return terminator.result()
+
+
+# --- Output Strutturato ---
+_FRONTMATTER_TOOL_NAME = "frontmatter"
+_STRUCTURED_OUTPUT_PROVIDERS = {"gemini", "openai", "claude"}
+_STRUCTURED_OUTPUT_INSTRUCTIONS = (
+    "\n\nOUTPUT FORMAT OVERRIDE\n"
+    "Ignore the YAML output rules above: return the same frontmatter hierarchy, including the "
+    "`schema` object, as a single JSON object. If the response schema declares `schema` as a "
+    "string, put the JSON-LD object in it serialized as JSON."
+)
+# Limiti della modalità strict di OpenAI (proprietà totali e livelli di annidamento)
+_STRICT_MAX_PROPERTIES = 100
+_STRICT_MAX_DEPTH = 5
+# Errori con cui il provider rifiuta la richiesta strutturata in sé; limiti di
+# frequenza, timeout ed errori del server non giustificano una seconda chiamata
+_STRUCTURED_REJECTION_ERRORS = (
+    openai.BadRequestError,
+    openai.UnprocessableEntityError,
+    anthropic.BadRequestError,
+    anthropic.UnprocessableEntityError,
+    google_exceptions.InvalidArgument,
+)
+
+
+def use_structured_output(provider: str) -> bool:
+    """
+    Indica se usare l'output strutturato per il provider (`STRUCTURED_OUTPUT`).
+
+    `auto` (default) lo attiva per Gemini, OpenAI e Claude; con OpenRouter il supporto
+    dipende dal modello instradato, quindi va attivato esplicitamente con `on`. Anche
+    l'output JSON viene interrotto in anticipo, alla chiusura dell'oggetto di primo livello.
+    """
+    mode = (os.getenv("STRUCTURED_OUTPUT") or "auto").strip().lower()
+    if mode not in {"auto", "on", "off"}:
+        raise SystemExit(f"Errore: STRUCTURED_OUTPUT non valido: '{mode}'. Usare 'auto', 'on' o 'off'.")
+    if mode == "auto":
+        return provider in _STRUCTURED_OUTPUT_PROVIDERS
+    return mode == "on"
+
+
+def _blueprint_node_schema(spec) -> dict:
+    if isinstance(spec, dict):
+        return {
+            "type": "object",
+            "properties": {key: _blueprint_node_schema(value) for key, value in spec.items()},
+            "required": [key for key, value in spec.items() if _contains_required(value)],
+        }
+    if str(spec).strip().lower().endswith("list"):
+        return {"type": "array", "items": {"type": "string"}}
+    return {"type": "string"}
+
+
+def _contains_required(spec) -> bool:
+    if isinstance(spec, dict):
+        return any(_contains_required(value) for value in spec.values())
+    return str(spec).strip().lower() == "required"
+
+
+def build_frontmatter_json_schema(blueprint: dict) -> dict:
+    """
+    Deriva dal `frontmatter_blueprint` lo JSON Schema dell'output.
+
+    I campi `required` (e le sezioni che li contengono) sono obbligatori, quelli che
+    terminano in `list` diventano array di stringhe; l'oggetto JSON-LD `schema` è
+    libero, salvo `@type` obbligatorio.
+    """
+    json_schema = _blueprint_node_schema(blueprint)
+    json_schema["properties"]["schema"] = {
+        "type": "object",
+        "properties": {"@context": {"type": "string"}, "@type": {"type": "string"}},
+        "required": ["@type"],
+    }
+    json_schema["required"].append("schema")
+    return json_schema
+
+
+def _encode_jsonld_as_string(json_schema: dict) -> dict:
+    """
+    Variante dello schema in cui l'oggetto JSON-LD `schema` è una stringa JSON.
+
+    Gemini e la modalità strict di OpenAI non ammettono oggetti con proprietà libere e
+    scarterebbero tutto il JSON-LD tranne `@context` e `@type`; `_decode_structured_output`
+    lo riporta a oggetto.
+    """
+    properties = dict(json_schema["properties"])
+    properties["schema"] = {
+        "type": "string",
+        "description": "Oggetto JSON-LD schema.org serializzato come JSON, con @context e @type.",
+    }
+    return {**json_schema, "properties": properties}
+
+
+def _schema_size(node: dict, depth: int = 1) -> tuple[int, int]:
+    """Ritorna (livelli di annidamento, numero di proprietà) di uno schema derivato dal blueprint."""
+    if node.get("type") == "array":
+        return _schema_size(node["items"], depth)
+    if node.get("type") != "object":
+        return 0, 0
+    max_depth, count = depth, len(node["properties"])
+    for child in node["properties"].values():
+        child_depth, child_count = _schema_size(child, depth + 1)
+        max_depth, count = max(max_depth, child_depth), count + child_count
+    return max_depth, count
+
+
+def _close_schema(node: dict, optional: bool = False) -> dict:
+    if node["type"] == "object":
+        closed = {
+            "type": "object",
+            "properties": {
+                key: _close_schema(value, key not in node["required"])
+                for key, value in node["properties"].items()
+            },
+            "required": list(node["properties"]),
+            "additionalProperties": False,
+        }
+    elif node["type"] == "array":
+        closed = {"type": "array", "items": _close_schema(node["items"])}
+    else:
+        closed = dict(node)
+    if optional:
+        # In modalità strict ogni proprietà è obbligatoria: quelle facoltative ammettono null
+        closed["type"] = [closed["type"], "null"]
+    return closed
+
+
+def _strict_json_schema(json_schema: dict) -> dict | None:
+    """
+    Variante dello schema per la modalità strict di OpenAI, o None se lo schema la esclude.
+
+    Ogni oggetto è chiuso (`additionalProperties: false`) e tutte le proprietà sono
+    obbligatorie; i campi facoltativi del blueprint diventano nullable e il JSON-LD
+    viaggia come stringa.
+    """
+    encoded = _encode_jsonld_as_string(json_schema)
+    depth, count = _schema_size(encoded)
+    if depth > _STRICT_MAX_DEPTH or count > _STRICT_MAX_PROPERTIES:
+        return None
+    return _close_schema(encoded)
+
+
+def _drop_null_fields(data):
+    if isinstance(data, dict):
+        return {key: _drop_null_fields(value) for key, value in data.items() if value is not None}
+    if isinstance(data, list):
+        return [_drop_null_fields(value) for value in data]
+    return data
+
+
+def _decode_structured_output(raw_output: str) -> str:
+    """
+    Riporta l'output strutturato alla forma del frontmatter: il JSON-LD serializzato come
+    stringa torna un oggetto e i campi facoltativi nulli (modalità strict) vengono rimossi.
+
+    Un output non decodificabile resta invariato: se `schema` rimane una stringa,
+    `parse_yaml_with_error` lo segnala come errore e parte la riparazione.
+    """
+    try:
+        data = json.loads(_strip_code_fence(raw_output))
+        if isinstance(data, dict) and isinstance(data.get("schema"), str):
+            data["schema"] = json.loads(data["schema"])
+    except json.JSONDecodeError:
+        return raw_output
+    if not isinstance(data, dict):
+        return raw_output
+    return json.dumps(_drop_null_fields(data), ensure_ascii=False)
+
+
+def _is_structured_output_rejection(error: Exception) -> bool:
+    """Indica se l'errore è il rifiuto della richiesta strutturata (schema o parametri non supportati)."""
+    return isinstance(error, _STRUCTURED_REJECTION_ERRORS)
+
+
 # --- Funzione di Generazione ---
 def generate_frontmatter(
     llm_config: LLMConfig,
@@ -207,65 +1050,231 @@ def generate_frontmatter(
     kb_content: str,
     content: str,
 ) -> str | None:
-    """Genera il frontmatter usando il provider LLM selezionato."""
-    final_prompt = prompt_template.replace("{{KNOWLEDGE_BASE_CONTENT}}", kb_content)
-    final_prompt = final_prompt.replace("{{SCHEMA_DEFINITIONS}}", schema_context)
-    final_prompt = final_prompt.replace("{{MARKDOWN_CONTENT}}", content)
+    """
+    Genera il frontmatter usando il provider LLM selezionato.
 
-    try:
-        if llm_config.provider == "gemini":
-            generation_config = genai.types.GenerationConfig(response_mime_type="text/plain")
-            response = llm_config.client.generate_content(final_prompt, generation_config=generation_config)
-            raw_output = response.text
-
-        elif llm_config.provider in {"openai", "openrouter"}:
-            response = llm_config.client.chat.completions.create(
-                model=llm_config.model,
-                temperature=0.1,
-                messages=[
-                    {"role": "system", "content": "Sei un assistente che produce frontmatter YAML valido."},
-                    {"role": "user", "content": final_prompt},
-                ],
-            )
-            raw_output = response.choices[0].message.content
-
-        elif llm_config.provider == "claude":
-            response = llm_config.client.messages.create(
-                model=llm_config.model,
-                max_tokens=1024,
-                temperature=0,
-                messages=[{"role": "user", "content": final_prompt}],
-            )
-            raw_output = "".join(block.text for block in response.content if getattr(block, "type", "text") == "text")
+    Se l'output strutturato è attivo il modello restituisce un oggetto JSON vincolato
+    allo schema derivato dal blueprint (il JSON è YAML valido, quindi il parsing resta
+    invariato). Solo se il provider rifiuta la richiesta strutturata si ripiega sullo
+    streaming YAML; limiti di frequenza e timeout non provocano una seconda chiamata.
+    """
+    final_prompt = build_prompt(prompt_template, schema_context, kb_content, content)
+    max_output_tokens = get_output_token_limit(llm_config.provider, kb_content)
+
+    blueprint = parse_frontmatter_blueprint(kb_content)
+    json_schema = None
+    if use_structured_output(llm_config.provider) and blueprint:
+        json_schema = build_frontmatter_json_schema(blueprint)
+    # L'interruzione anticipata dello YAML attende le sezioni con campi obbligatori
+    required_keys = {path.split(".", 1)[0] for path in get_required_fields(blueprint)}
 
+    try:
+        if json_schema:
+            try:
+                raw_output = _collect_streamed_output(
+                    llm_config,
+                    final_prompt + _STRUCTURED_OUTPUT_INSTRUCTIONS,
+                    # Il JSON richiede più token dell'equivalente YAML (virgolette e parentesi)
+                    max_output_tokens + max_output_tokens // 4,
+                    terminator=JsonObjectTerminator(),
+                    json_schema=json_schema,
+                )
+                raw_output = _decode_structured_output(raw_output) if raw_output else raw_output
+            except Exception as e:
+                if not _is_structured_output_rejection(e):
+                    raise
+                print(f"  -> Output strutturato rifiutato dal provider ({e}). Uso dello streaming YAML.")
+                raw_output = _collect_streamed_output(
+                    llm_config, final_prompt, max_output_tokens, terminator=YamlBlockTerminator(required_keys)
+                )
         else:
-            raise ValueError(f"Provider LLM non gestito: {llm_config.provider}")
+            raw_output = _collect_streamed_output(
+                llm_config, final_prompt, max_output_tokens, terminator=YamlBlockTerminator(required_keys)
+            )
 
         if not raw_output:
             return None
 
-        cleaned_response = raw_output.strip().removeprefix("```yaml").removeprefix("```").removesuffix("```").strip()
-        return cleaned_response
+        return _strip_code_fence(raw_output)
     except Exception as e:
         print(f"  -> Errore durante la chiamata all'API AI ({llm_config.provider}): {e}")
         return None
 
+
+def run_generation(
+    llm_config: LLMConfig,
+    prompt_template: str,
+    schema_context: str,
+    kb_content: str,
+    content: str,
+) -> tuple[str | None, LLMConfig]:
+    """
+    Genera il frontmatter con il backend configurato o, se presente, con il pool.
+
+    Ritorna:
+        tuple: (output del modello o None, configurazione del backend che l'ha prodotto)
+    """
+    if llm_config.pool is None:
+        return generate_frontmatter(llm_config, prompt_template, schema_context, kb_content, content), llm_config
+
+    output, member = llm_config.pool.run(
+        lambda config: generate_frontmatter(config, prompt_template, schema_context, kb_content, content)
+    )
+    return output, member.config
+
+
+def repair_yaml(llm_config: LLMConfig, broken_yaml: str, parser_error: str) -> str | None:
+    """
+    Chiede al modello una correzione mirata di un output YAML non valido.
+
+    Il prompt contiene solo l'output da correggere e l'errore del parser, quindi costa
+    una frazione della generazione completa.
+    """
+    prompt = (
+        "Il seguente frontmatter YAML non è valido. Correggi solo la sintassi senza modificare "
+        "struttura, chiavi o contenuti. Metti tra virgolette doppie le stringhe con caratteri "
+        "speciali e non usare backslash per gli apostrofi.\n\n"
+        f"Errore del parser:\n{parser_error}\n\n"
+        f"YAML da correggere:\n{broken_yaml}\n\n"
+        "Rispondi solo con lo YAML corretto, senza code fence né testo aggiuntivo."
+    )
+    max_output_tokens = len(broken_yaml) // _CHARS_PER_TOKEN + 256 + _OUTPUT_TOKEN_HEADROOM.get(llm_config.provider, 0)
+
+    try:
+        raw_output = _collect_streamed_output(llm_config, prompt, max_output_tokens, terminator=TextAccumulator())
+        return _strip_code_fence(raw_output) if raw_output else None
+    except Exception as e:
+        print(f"  -> Errore durante la correzione dello YAML ({llm_config.provider}): {e}")
+        return None
+
+
+def _strip_code_fence(text: str) -> str:
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+    return text.removesuffix("```").strip()
+
+
+def repair_schema_object(llm_config: LLMConfig, schema_obj: dict, issues: list[str], hierarchy: "schema_hierarchy.SchemaHierarchy") -> dict | None:
+    """
+    Chiede al modello di correggere solo l'oggetto JSON-LD `schema`.
+
+    Il prompt contiene l'oggetto, i problemi trovati dal validatore e le proprietà
+    ammesse per i tipi dichiarati; non include né il documento né la knowledge base.
+    """
+    type_names = sorted({
+        schema_hierarchy.normalize_type_name(t)
+        for t in _collect_declared_types(schema_obj)
+        if hierarchy.is_type(schema_hierarchy.normalize_type_name(t))
+    })
+    allowed = "\n".join(f"- {t}: {', '.join(sorted(hierarchy.all_properties(t)))}" for t in type_names)
+    prompt = (
+        "Correggi il seguente oggetto JSON-LD Schema.org. Usa solo tipi esistenti in Schema.org "
+        "e solo proprietà ammesse per il `@type` di ciascun oggetto; rinomina le proprietà errate "
+        "con l'equivalente corretto oppure rimuovile. Non modificare i valori corretti.\n\n"
+        f"Problemi rilevati:\n" + "\n".join(f"- {issue}" for issue in issues) + "\n\n"
+        + (f"Proprietà ammesse per tipo:\n{allowed}\n\n" if allowed else "")
+        + f"Oggetto da correggere:\n{json.dumps(schema_obj, ensure_ascii=False, indent=2, default=str)}\n\n"
+        "Rispondi solo con l'oggetto JSON corretto, senza testo aggiuntivo."
+    )
+
+    try:
+        max_output_tokens = max(512, len(prompt) // _CHARS_PER_TOKEN) + _OUTPUT_TOKEN_HEADROOM.get(llm_config.provider, 0)
+        raw_output = _collect_streamed_output(llm_config, prompt, max_output_tokens, terminator=TextAccumulator())
+        repaired = yaml.safe_load(_strip_code_fence(raw_output)) if raw_output else None
+        return repaired if isinstance(repaired, dict) else None
+    except Exception as e:
+        print(f"  -> Errore durante la correzione dello schema ({llm_config.provider}): {e}")
+        return None
+
+
+def _collect_declared_types(node) -> list[str]:
+    if isinstance(node, list):
+        return [t for item in node for t in _collect_declared_types(item)]
+    if not isinstance(node, dict):
+        return []
+    declared = node.get("@type")
+    types = declared if isinstance(declared, list) else [declared] if declared else []
+    return [str(t) for t in types] + [t for value in node.values() for t in _collect_declared_types(value)]
+
+
 # --- Funzione di Validazione ---
-def validate_and_parse_yaml(yaml_string: str) -> dict | None:
-    """Tenta di fare il parsing di una stringa YAML e la restituisce come dizionario."""
+@profiling.staged("yaml_parse")
+def parse_yaml_with_error(yaml_string: str) -> tuple[dict | None, str | None]:
+    """
+    Tenta il parsing della stringa YAML.
+
+    Un campo `schema` che non è una mappa (ad esempio JSON-LD rimasto serializzato come
+    stringa) è trattato come errore, così non viene scritto senza validazione.
+
+    Ritorna:
+        tuple: (dizionario o None, messaggio d'errore del parser o None)
+    """
     try:
         data = yaml.safe_load(yaml_string)
-        if isinstance(data, dict):
-            return data
-        else:
-            # print("--- INIZIO OUTPUT AI NON VALIDO (Tipo non dizionario) ---")
-            # print(yaml_string)
-            # print("--- FINE OUTPUT AI NON VALIDO ---")
-            return None
     except yaml.YAMLError as e:
-        # print("--- INIZIO OUTPUT AI NON VALIDO (Errore di parsing) ---")
-        # print(yaml_string)
-        # print(f"Dettagli errore parser YAML: {e}")
-        # print("--- FINE OUTPUT AI NON VALIDO ---")
-        return None
+        return None, str(e)
+    if isinstance(data, dict):
+        if "schema" in data and not isinstance(data["schema"], dict):
+            return None, f"Il campo 'schema' deve essere un oggetto JSON-LD (mappa), ottenuto: {type(data['schema']).__name__}."
+        return data, None
+    return None, f"Il documento YAML non è una mappa (tipo ottenuto: {type(data).__name__})."
+
+
+def validate_and_parse_yaml(yaml_string: str) -> dict | None:
+    """Tenta di fare il parsing di una stringa YAML e la restituisce come dizionario."""
+    data, _ = parse_yaml_with_error(yaml_string)
+    return data
+
+
+# --- Funzioni del Blueprint e della Cascata ---
+_YAML_BLOCK_PATTERN = re.compile(r"```ya?ml\s*\n(.*?)```", re.DOTALL)
+_HEADING_PATTERN = re.compile(r"^#{1,6}\s", re.MULTILINE)
+
+
+def parse_frontmatter_blueprint(kb_content: str) -> dict:
+    """Estrae il `frontmatter_blueprint` dai blocchi YAML della knowledge base."""
+    for block in _YAML_BLOCK_PATTERN.findall(kb_content or ""):
+        try:
+            data = yaml.safe_load(block)
+        except yaml.YAMLError:
+            continue
+        if isinstance(data, dict) and isinstance(data.get("frontmatter_blueprint"), dict):
+            return data["frontmatter_blueprint"]
+    return {}
+
+
+def _count_blueprint_fields(blueprint: dict) -> int:
+    """Conta i campi foglia del blueprint."""
+    return sum(_count_blueprint_fields(value) if isinstance(value, dict) else 1 for value in blueprint.values())
+
+
+def get_required_fields(blueprint: dict, prefix: str = "") -> list[str]:
+    """Restituisce i percorsi puntati (es. `document.title`) dei campi marcati `required`."""
+    required = []
+    for key, value in blueprint.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            required.extend(get_required_fields(value, prefix=f"{path}."))
+        elif str(value).strip().lower() == "required":
+            required.append(path)
+    return required
+
+
+def find_missing_required_fields(data: dict, required_fields: list[str]) -> list[str]:
+    """Restituisce i campi obbligatori assenti o vuoti nel frontmatter generato."""
+    missing = []
+    for path in required_fields:
+        node: Any = data
+        for part in path.split("."):
+            node = node.get(part) if isinstance(node, dict) else None
+        if node is None or node == "" or node == [] or node == {}:
+            missing.append(path)
+    return missing
+
 
+def exceeds_cascade_threshold(content: str, cascade: CascadeConfig) -> bool:
+    """Indica se il documento è troppo lungo o articolato per il livello economico."""
+    if len(content) > cascade.max_chars:
+        return True
+    return len(_HEADING_PATTERN.findall(content)) > cascade.max_headings
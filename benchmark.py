@@ -0,0 +1,109 @@
+import argparse
+import math
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+import ai_core
+import file_handler
+import planner
+import query_builder
+
+
+def run_query(store, query_text: str, top_k: int) -> tuple[list[str], float]:
+    """Esegue una ricerca e restituisce (id dei risultati, durata in secondi)."""
+    started_at = time.perf_counter()
+    results = store.query(query_texts=[query_text], n_results=top_k)
+    return (results.get("ids") or [[]])[0], time.perf_counter() - started_at
+
+
+def compare_query_modes(markdown_files: list[Path], store, embedding_provider: str, top_k: int = 3) -> list[dict]:
+    """
+    Confronta per ogni file la ricerca con la query completa e con quella compatta.
+
+    Ritorna:
+        list: un dizionario per file con lunghezza delle query, durate e risultati.
+    """
+    rows = []
+    for file_path in markdown_files:
+        with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+            content = f.read()
+        if not content.strip():
+            continue
+
+        row = {"path": file_path}
+        for mode in query_builder.QUERY_MODES:
+            query_text = query_builder.build_retrieval_query(content, embedding_provider, mode=mode)
+            ids, duration = run_query(store, query_text, top_k)
+            row[mode] = {"chars": len(query_text), "seconds": duration, "ids": ids}
+        rows.append(row)
+    return rows
+
+
+def _overlap(a: list[str], b: list[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(set(a) & set(b)) / max(len(set(a) | set(b)), 1)
+
+
+def print_report(rows: list[dict], root_path: Path, top_k: int, verbose: bool = False) -> None:
+    """Stampa le metriche aggregate (e, con verbose, i risultati per file)."""
+    if not rows:
+        print("Nessun file da confrontare.")
+        return
+
+    if verbose:
+        for row in rows:
+            print(f"\n{os.path.relpath(row['path'], root_path)}")
+            for mode in query_builder.QUERY_MODES:
+                data = row[mode]
+                print(f"  {mode:<8} {data['chars']:>7} car. {data['seconds'] * 1000:>8.1f} ms  {', '.join(data['ids'])}")
+
+    print(f"\n--- Confronto query completa / compatta su {len(rows)} file (top-{top_k}) ---")
+    for mode in query_builder.QUERY_MODES:
+        chars = [row[mode]["chars"] for row in rows]
+        seconds = [row[mode]["seconds"] for row in rows]
+        tokens = sum(math.ceil(c / planner.CHARS_PER_TOKEN) for c in chars)
+        print(
+            f"{mode:<8} token stimati: {tokens:>9}  lunghezza media: {statistics.mean(chars):>8.0f} car.  "
+            f"latenza media: {statistics.mean(seconds) * 1000:>7.1f} ms (p95 {_percentile(seconds, 95) * 1000:.1f} ms)"
+        )
+
+    overlaps = [_overlap(row["full"]["ids"], row["compact"]["ids"]) for row in rows]
+    same_top = sum(1 for row in rows if row["full"]["ids"][:1] == row["compact"]["ids"][:1])
+    print(f"Sovrapposizione media dei risultati (Jaccard): {statistics.mean(overlaps):.2f}")
+    print(f"Stesso primo risultato: {same_top} su {len(rows)}")
+
+
+def _percentile(values: list[float], percentile: int) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(percentile / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def main():
+    """Benchmark della ricerca degli schemi: query completa contro query compatta."""
+    sys.stdout.reconfigure(encoding='utf-8')
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Confronta la ricerca degli schemi con query completa e compatta.")
+    parser.add_argument("--path", type=str, required=True, help="Cartella con i file Markdown di prova.")
+    parser.add_argument("--top-k", type=int, default=3, help="Numero di risultati confrontati (default: 3).")
+    parser.add_argument("--verbose", action="store_true", help="Mostra i risultati di ogni file.")
+    args = parser.parse_args()
+
+    root_path = Path(args.path)
+    embedding_provider = ai_core.resolve_embedding_provider()
+    store = ai_core.open_schema_store(embedding_provider)
+    print(f"[+] Indice degli schemi: {ai_core.describe_schema_store()} (embedding: {embedding_provider})")
+
+    rows = compare_query_modes(file_handler.scan_markdown_files(root_path), store, embedding_provider, args.top_k)
+    print_report(rows, root_path, args.top_k, verbose=args.verbose)
+
+
+if __name__ == "__main__":
+    main()
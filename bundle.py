@@ -0,0 +1,180 @@
+import datetime
+import gzip
+import json
+import threading
+from pathlib import Path, PurePosixPath, PureWindowsPath
+
+import file_handler
+import work_queue
+
+BUNDLE_FORMAT = "frontmatter-bundle"
+BUNDLE_VERSION = 1
+
+
+def _open_bundle(bundle_path: Path, mode: str):
+    # I bundle con estensione .gz vengono compressi in modo trasparente
+    if bundle_path.suffix == ".gz":
+        return gzip.open(bundle_path, mode + "t", encoding="utf-8")
+    return open(bundle_path, mode, encoding="utf-8")
+
+
+class BundleWriter:
+    """
+    Scrive i frontmatter validati in un bundle JSONL portabile.
+
+    La prima riga è un'intestazione con formato e versione; ogni riga successiva
+    contiene percorso relativo (POSIX), hash SHA-256 del contenuto da cui il frontmatter
+    è stato generato, frontmatter, livello e backend. Le righe vengono scritte man mano,
+    così un'interruzione lascia un bundle parziale ma utilizzabile.
+    """
+
+    def __init__(self, bundle_path: str | Path, root_path: str | Path, generator: str | None = None):
+        self.bundle_path = Path(bundle_path)
+        self.root_path = Path(root_path)
+        self.count = 0
+        self._lock = threading.Lock()
+        self.bundle_path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = _open_bundle(self.bundle_path, "w")
+        self._write({
+            "format": BUNDLE_FORMAT,
+            "version": BUNDLE_VERSION,
+            "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "generator": generator,
+        })
+
+    def _write(self, record: dict) -> None:
+        with self._lock:
+            self._file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            self._file.flush()
+
+    def add(self, file_path: str | Path, content: str, frontmatter: dict, tier: str | None = None, backend: str | None = None) -> None:
+        """Aggiunge il frontmatter generato per `content`, il contenuto letto da `file_path`."""
+        self._write({
+            "path": work_queue.relative_key(Path(file_path), self.root_path),
+            "content_sha256": file_handler.content_sha256(content),
+            "frontmatter": frontmatter,
+            "tier": tier,
+            "backend": backend,
+        })
+        self.count += 1
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_bundle(bundle_path: str | Path) -> tuple[dict, list[dict]]:
+    """
+    Legge un bundle e ne verifica l'intestazione.
+
+    Ritorna:
+        tuple: (intestazione, voci per percorso; a parità di percorso vale l'ultima)
+    """
+    bundle_path = Path(bundle_path)
+    if not bundle_path.is_file():
+        raise SystemExit(f"Errore: Bundle '{bundle_path}' non trovato.")
+
+    entries = {}
+    with _open_bundle(bundle_path, "r") as f:
+        try:
+            header = json.loads(f.readline() or "{}")
+        except json.JSONDecodeError:
+            header = {}
+        if header.get("format") != BUNDLE_FORMAT:
+            raise SystemExit(f"Errore: '{bundle_path}' non è un bundle di frontmatter valido.")
+        if header.get("version") != BUNDLE_VERSION:
+            raise SystemExit(f"Errore: Versione del bundle non supportata: {header.get('version')} (attesa {BUNDLE_VERSION}).")
+
+        for line_number, line in enumerate(f, start=2):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                entries[record["path"]] = record
+            except (json.JSONDecodeError, KeyError, TypeError):
+                # Tipicamente l'ultima riga di un bundle interrotto durante la scrittura
+                print(f"  -> Riga {line_number} del bundle non valida: ignorata.")
+    return header, list(entries.values())
+
+
+def _is_unsafe_entry_path(relative_path: str, root_path: Path) -> bool:
+    """Indica se il percorso di una voce esce dalla cartella di destinazione (assoluto, `..` o link simbolico)."""
+    if not isinstance(relative_path, str) or not relative_path.strip():
+        return True
+    posix_path = PurePosixPath(relative_path)
+    if posix_path.is_absolute() or PureWindowsPath(relative_path).anchor or ".." in posix_path.parts:
+        return True
+    return not (root_path / posix_path).resolve().is_relative_to(root_path.resolve())
+
+
+def apply_bundle(bundle_path: str | Path, root_path: str | Path, force: bool = False, dry_run: bool = False) -> tuple[dict, list[str]]:
+    """
+    Scrive nei file di `root_path` il frontmatter contenuto nel bundle, senza chiamate LLM.
+
+    I file il cui contenuto è cambiato dopo la generazione (hash diverso) o che non
+    esistono più non vengono toccati e sono conteggiati in `summary["stale"]`. Un bundle
+    con percorsi esterni a `root_path` viene rifiutato prima di leggere o scrivere file.
+    Con `dry_run` si riportano gli esiti senza modificare i file.
+
+    Ritorna:
+        tuple: (summary dict, list di percorsi file aggiornati)
+    """
+    root_path = Path(root_path)
+    if not root_path.is_dir():
+        raise SystemExit(f"Errore: Il percorso '{root_path}' non è una directory valida.")
+
+    header, entries = read_bundle(bundle_path)
+    unsafe_paths = [str(entry["path"]) for entry in entries if _is_unsafe_entry_path(entry["path"], root_path)]
+    if unsafe_paths:
+        raise SystemExit(
+            f"Errore: Il bundle contiene percorsi esterni alla cartella '{root_path}': {', '.join(unsafe_paths[:5])}"
+        )
+    print(f"[+] Bundle generato il {header.get('created_at')} ({header.get('generator') or 'generatore sconosciuto'}): {len(entries)} file.")
+
+    summary = {
+        "total": len(entries),
+        "processed": 0,
+        "updated": 0,
+        "skipped": 0,
+        "errors": 0,
+        "tier_fast": 0,
+        "tier_primary": 0,
+        "cascade": False,
+        "pool": False,
+        "backends": {},
+        "stale": 0,
+    }
+    updated_files = []
+
+    for entry in entries:
+        summary["processed"] += 1
+        if entry.get("tier") in ("fast", "primary"):
+            summary[f"tier_{entry['tier']}"] += 1
+            summary["cascade"] = summary["cascade"] or entry["tier"] == "fast"
+        if entry.get("backend"):
+            summary["backends"][entry["backend"]] = summary["backends"].get(entry["backend"], 0) + 1
+
+        file_path = root_path / entry["path"]
+        outcome = file_handler.update_file_if_unchanged(
+            file_path, entry["content_sha256"], entry["frontmatter"], force, dry_run=dry_run
+        )
+        if outcome == "applicable":
+            print(f"  -> DRY-RUN: {entry['path']}: frontmatter applicabile.")
+        elif outcome == "stale":
+            print(f"  -> {entry['path']}: file modificato dopo la generazione, non aggiornato.")
+            summary["stale"] += 1
+        elif outcome == "updated":
+            summary["updated"] += 1
+            updated_files.append(str(file_path))
+        else:
+            summary["skipped"] += 1
+
+    summary["pool"] = len(summary["backends"]) > 1
+    return summary, updated_files
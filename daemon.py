@@ -0,0 +1,304 @@
+import argparse
+import hmac
+import json
+import os
+import secrets
+import socketserver
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+import ai_core
+import daemon_client
+import kb_retrieval
+import processing_core
+import schema_hierarchy
+
+# Nomi accettati nell'header Host: rifiutare gli altri blocca il DNS rebinding da pagine web
+_LOOPBACK_HOSTS = {"127.0.0.1", "localhost", "::1"}
+
+
+def _is_loopback(host: str) -> bool:
+    return host.strip().lower() in _LOOPBACK_HOSTS
+
+
+def _host_name(host_header: str) -> str:
+    """Nome host dell'header Host, senza porta né parentesi IPv6."""
+    host = host_header.strip()
+    if host.startswith("["):
+        return host[1:].split("]", 1)[0]
+    return host.rsplit(":", 1)[0] if host.count(":") == 1 else host
+
+
+def write_token_file(token: str, token_path: Path) -> None:
+    """Scrive il token in un file leggibile solo dall'utente (0600), letto da `daemon_client.py`."""
+    token_path.parent.mkdir(parents=True, exist_ok=True)
+    descriptor = os.open(token_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(descriptor, "w", encoding="utf-8") as f:
+        f.write(token)
+    # O_CREAT non cambia i permessi di un file già esistente
+    os.chmod(token_path, 0o600)
+
+
+class FrontmatterService:
+    """
+    Mantiene in memoria le risorse costose (client LLM, collection ChromaDB,
+    modello di embedding, prompt e knowledge base) ed elabora i job ricevuti.
+    """
+
+    def __init__(self, roots: list[Path] | None = None):
+        # I job su percorso sono ammessi solo dentro queste cartelle
+        self.roots = [Path(root).expanduser().resolve() for root in (roots or [Path.cwd()])]
+        self.llm_config, self.schema_collection = ai_core.configure_ai_models()
+        # Protegge lo scambio delle risorse in `reload`; le scritture su disco sono serializzate da file_handler
+        self._resources_lock = threading.Lock()
+        self.reload(reopen_index=False)
+
+    def reload(self, reopen_index: bool = True):
+        """
+        Ricarica prompt master, knowledge base e gerarchia Schema.org senza riavviare il daemon.
+
+        Riapre anche l'indice degli schemi, così una nuova versione costruita da
+        `indexer.py` viene adottata senza attendere la garbage collection di quella in uso.
+        """
+        prompt_template, kb_content = ai_core.load_prompt_and_knowledge_base()
+        kb_retrieval.reset_selectors()
+        schema_hierarchy.reset_hierarchy()
+        required_fields = ai_core.get_required_fields(ai_core.parse_frontmatter_blueprint(kb_content))
+        schema_collection = ai_core.open_schema_store(self.llm_config.embedding_provider) if reopen_index else self.schema_collection
+        with self._resources_lock:
+            self.schema_collection = schema_collection
+            self.prompt_template = prompt_template
+            self.kb_content = kb_content
+            self.required_fields = required_fields
+
+    def warm_up(self):
+        """Esegue una ricerca di prova per caricare modello di embedding e indice vettoriale."""
+        ai_core.retrieve_relevant_schemas(self._resources()[0], "warm-up")
+
+    def _resources(self):
+        """Istantanea coerente delle risorse, così un `reload` concorrente non mescola versioni diverse."""
+        with self._resources_lock:
+            return self.schema_collection, self.prompt_template, self.kb_content, self.required_fields
+
+    def generate_for_content(self, content: str) -> dict:
+        """Genera il frontmatter per un contenuto Markdown grezzo, senza toccare il disco."""
+        if not content.strip():
+            return {"ok": False, "error": "Contenuto vuoto."}
+
+        schema_collection, prompt_template, kb_content, required_fields = self._resources()
+        frontmatter, tier, backend = processing_core.generate_validated_frontmatter(
+            content, self.llm_config, schema_collection, prompt_template, kb_content, required_fields
+        )
+        if not frontmatter:
+            return {"ok": False, "error": "Generazione del frontmatter non riuscita.", "tier": tier, "backend": backend}
+        return {"ok": True, "frontmatter": frontmatter, "tier": tier, "backend": backend}
+
+    def process_path(self, path: str, force: bool = False, dry_run: bool = False) -> dict:
+        """Elabora un file o una cartella con le risorse già caricate (solo dentro le radici del daemon)."""
+        target = Path(path).expanduser().resolve()
+        if not any(target.is_relative_to(root) for root in self.roots):
+            raise PermissionError(f"Il percorso '{target}' è fuori dalle cartelle servite dal daemon.")
+        schema_collection, prompt_template, kb_content, required_fields = self._resources()
+
+        if target.is_file():
+            summary = processing_core.new_summary(self.llm_config, total_files=1)
+            updated_files = []
+            print(f"\n--- Elaborazione di: {target} ---")
+            frontmatter = processing_core.process_file(
+                target, self.llm_config, schema_collection, prompt_template, kb_content,
+                required_fields, summary, updated_files, force=force, dry_run=dry_run,
+            )
+            return {
+                "ok": summary["errors"] == 0,
+                "summary": summary,
+                "updated_files": updated_files,
+                "frontmatter": frontmatter,
+            }
+
+        if target.is_dir():
+            summary, updated_files = processing_core.process_folder(
+                target, self.llm_config, schema_collection, force=force, dry_run=dry_run,
+                prompt_template=prompt_template, kb_content=kb_content,
+            )
+            return {"ok": summary["errors"] == 0, "summary": summary, "updated_files": updated_files}
+
+        return {"ok": False, "error": f"Il percorso '{target}' non esiste."}
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    """Espone l'API locale dei job: GET /health, POST /jobs, POST /reload."""
+
+    server_version = "FrontmatterDaemon/1.0"
+
+    def address_string(self):
+        # Sui socket Unix client_address è una stringa vuota
+        if isinstance(self.client_address, tuple) and self.client_address:
+            return str(self.client_address[0])
+        return "unix"
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _is_authorized(self) -> bool:
+        return hmac.compare_digest(self.headers.get("X-Daemon-Token", ""), self.server.token)
+
+    def _reject_request(self, require_json: bool) -> bool:
+        """Invia l'errore e ritorna True se la richiesta non supera i controlli di accesso."""
+        # Sui socket Unix l'header Host non identifica l'origine e il socket è già 0600
+        if isinstance(self.client_address, tuple) and not _is_loopback(_host_name(self.headers.get("Host", ""))):
+            self._send_json(403, {"ok": False, "error": "Host non consentito."})
+            return True
+        if not self._is_authorized():
+            self._send_json(401, {"ok": False, "error": "Token non valido."})
+            return True
+        content_type = self.headers.get("Content-Type", "").split(";", 1)[0].strip().lower()
+        if require_json and content_type != "application/json":
+            self._send_json(415, {"ok": False, "error": "Content-Type deve essere application/json."})
+            return True
+        return False
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        data = json.loads(self.rfile.read(length).decode("utf-8"))
+        if not isinstance(data, dict):
+            raise ValueError("Il corpo della richiesta deve essere un oggetto JSON.")
+        return data
+
+    def do_GET(self):
+        if self._reject_request(require_json=False):
+            return
+        if self.path != "/health":
+            self._send_json(404, {"ok": False, "error": "Endpoint non trovato."})
+            return
+
+        llm_config = self.server.service.llm_config
+        self._send_json(200, {
+            "ok": True,
+            "provider": llm_config.provider,
+            "model": llm_config.model,
+            "embedding_provider": llm_config.embedding_provider,
+        })
+
+    def do_POST(self):
+        if self._reject_request(require_json=True):
+            return
+
+        service = self.server.service
+        try:
+            if self.path == "/reload":
+                service.reload()
+                self._send_json(200, {"ok": True})
+                return
+
+            if self.path != "/jobs":
+                self._send_json(404, {"ok": False, "error": "Endpoint non trovato."})
+                return
+
+            job = self._read_json()
+            if "content" in job:
+                result = service.generate_for_content(str(job["content"]))
+            elif "path" in job:
+                result = service.process_path(
+                    str(job["path"]),
+                    force=bool(job.get("force", False)),
+                    dry_run=bool(job.get("dry_run", False)),
+                )
+            else:
+                self._send_json(400, {"ok": False, "error": "Il job deve contenere 'content' o 'path'."})
+                return
+
+            self._send_json(200, result)
+        except PermissionError as e:
+            self._send_json(403, {"ok": False, "error": str(e)})
+        except (ValueError, SystemExit) as e:
+            self._send_json(400, {"ok": False, "error": str(e)})
+        except Exception as e:
+            print(f"  -> Errore imprevisto durante l'elaborazione del job: {e}")
+            self._send_json(500, {"ok": False, "error": str(e)})
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def create_server(service: FrontmatterService, token: str, host: str, port: int, socket_path: str | None = None):
+    """Crea il server HTTP su socket Unix (se indicato) o su un endpoint TCP locale."""
+    if socket_path:
+        socket_file = Path(socket_path).expanduser()
+        if socket_file.exists():
+            socket_file.unlink()
+        server = UnixHTTPServer(str(socket_file), JobRequestHandler)
+        os.chmod(socket_file, 0o600)
+    else:
+        server = ThreadingHTTPServer((host, port), JobRequestHandler)
+        server.daemon_threads = True
+    server.service = service
+    server.token = token
+    return server
+
+
+def main():
+    """Avvia il daemon che mantiene caldi modelli e indici tra un job e l'altro."""
+    sys.stdout.reconfigure(encoding='utf-8')
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Daemon locale per la generazione di frontmatter AI.")
+    parser.add_argument("--host", type=str, default=os.getenv("DAEMON_HOST", "127.0.0.1"), help="Indirizzo di ascolto (default: 127.0.0.1).")
+    parser.add_argument("--port", type=int, default=int(os.getenv("DAEMON_PORT", "8765")), help="Porta di ascolto (default: 8765).")
+    parser.add_argument("--socket", type=str, default=os.getenv("DAEMON_SOCKET"), help="Percorso di un socket Unix da usare al posto di TCP.")
+    parser.add_argument(
+        "--root",
+        action="append",
+        default=None,
+        help="Cartella entro cui sono ammessi i job su percorso (ripetibile; default: DAEMON_ROOTS o la cartella corrente).",
+    )
+    args = parser.parse_args()
+
+    if not args.socket and not _is_loopback(args.host):
+        parser.error("--host deve essere un indirizzo di loopback (127.0.0.1, ::1 o localhost).")
+    roots = args.root or [root for root in os.getenv("DAEMON_ROOTS", "").split(os.pathsep) if root] or [os.getcwd()]
+
+    print("--- Avvio del daemon ---")
+    token = os.getenv("DAEMON_TOKEN") or secrets.token_urlsafe(32)
+    token_path = daemon_client.get_token_path()
+    write_token_file(token, token_path)
+    print(f"[+] Token di accesso scritto in '{token_path}'.")
+
+    print("[+] Caricamento risorse e configurazione AI...")
+    service = FrontmatterService(roots=[Path(root) for root in roots])
+    service.warm_up()
+    print(f"[+] Modello LLM selezionato: {service.llm_config.provider} ({service.llm_config.model})")
+    if service.llm_config.pool:
+        print(f"[+] Pool di generazione: {service.llm_config.pool.describe()}")
+    print(f"[+] Provider embeddings: {service.llm_config.embedding_provider}")
+    print(f"[+] Indice degli schemi: {ai_core.describe_schema_store()}")
+    print(f"[+] Cartelle servite: {', '.join(str(root) for root in service.roots)}")
+
+    server = create_server(service, token, args.host, args.port, args.socket)
+    endpoint = args.socket if args.socket else f"http://{args.host}:{args.port}"
+    print(f"[+] Daemon in ascolto su {endpoint}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n[+] Arresto del daemon...")
+    finally:
+        server.server_close()
+        if args.socket:
+            Path(args.socket).expanduser().unlink(missing_ok=True)
+        print("--- Daemon arrestato ---")
+
+
+if __name__ == "__main__":
+    main()
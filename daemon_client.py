@@ -0,0 +1,111 @@
+"""
+Client leggero per il daemon di generazione frontmatter.
+
+Usa solo la libreria standard (più PyYAML per l'output) così da avviarsi in pochi
+millisecondi: è pensato per integrazioni con editor e hook di pre-commit.
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import sys
+from pathlib import Path
+from urllib.parse import urlparse
+
+import yaml
+
+
+def get_token_path() -> Path:
+    """File con il token del daemon, scritto all'avvio con permessi 0600 (`DAEMON_TOKEN_FILE`)."""
+    return Path(os.getenv("DAEMON_TOKEN_FILE", "~/.config/frontmatter-daemon/token")).expanduser()
+
+
+def read_token() -> str | None:
+    """Token da inviare al daemon: `DAEMON_TOKEN` oppure quello del file scritto dal daemon."""
+    token = os.getenv("DAEMON_TOKEN")
+    if token:
+        return token
+    try:
+        return get_token_path().read_text(encoding="utf-8").strip() or None
+    except OSError:
+        return None
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """Connessione HTTP su socket Unix."""
+
+    def __init__(self, socket_path: str, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def send_request(method: str, endpoint: str, payload: dict | None, url: str, socket_path: str | None, timeout: float) -> tuple[int, dict]:
+    """Invia una richiesta al daemon e restituisce (status HTTP, risposta JSON)."""
+    if socket_path:
+        connection = UnixHTTPConnection(str(Path(socket_path).expanduser()), timeout)
+    else:
+        parsed = urlparse(url)
+        connection = http.client.HTTPConnection(parsed.hostname or "127.0.0.1", parsed.port or 8765, timeout=timeout)
+
+    headers = {"Content-Type": "application/json"}
+    token = read_token()
+    if token:
+        headers["X-Daemon-Token"] = token
+
+    body = json.dumps(payload).encode("utf-8") if payload is not None else None
+    try:
+        connection.request(method, endpoint, body=body, headers=headers)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read().decode("utf-8") or "{}")
+    finally:
+        connection.close()
+
+
+def main():
+    """Invia un job al daemon e stampa il risultato."""
+    sys.stdout.reconfigure(encoding='utf-8')
+
+    parser = argparse.ArgumentParser(description="Client per il daemon di generazione frontmatter.")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--path", type=str, help="File o cartella da elaborare.")
+    target.add_argument("--stdin", action="store_true", help="Legge Markdown grezzo da stdin e stampa il frontmatter YAML.")
+    target.add_argument("--health", action="store_true", help="Verifica che il daemon sia attivo.")
+    target.add_argument("--reload", action="store_true", help="Ricarica prompt master e knowledge base nel daemon.")
+    parser.add_argument("--dry-run", action="store_true", help="Genera il frontmatter senza modificare i file.")
+    parser.add_argument("--force", action="store_true", help="Sovrascrive il frontmatter esistente.")
+    parser.add_argument("--url", type=str, default=os.getenv("DAEMON_URL", "http://127.0.0.1:8765"), help="URL del daemon (default: http://127.0.0.1:8765).")
+    parser.add_argument("--socket", type=str, default=os.getenv("DAEMON_SOCKET"), help="Socket Unix del daemon.")
+    parser.add_argument("--timeout", type=float, default=600.0, help="Timeout della richiesta in secondi.")
+    args = parser.parse_args()
+
+    try:
+        if args.health:
+            status, result = send_request("GET", "/health", None, args.url, args.socket, args.timeout)
+        elif args.reload:
+            status, result = send_request("POST", "/reload", {}, args.url, args.socket, args.timeout)
+        elif args.stdin:
+            job = {"content": sys.stdin.read()}
+            status, result = send_request("POST", "/jobs", job, args.url, args.socket, args.timeout)
+        else:
+            job = {"path": str(Path(args.path).resolve()), "force": args.force, "dry_run": args.dry_run}
+            status, result = send_request("POST", "/jobs", job, args.url, args.socket, args.timeout)
+    except (OSError, http.client.HTTPException) as e:
+        print(f"Errore: Impossibile contattare il daemon: {e}", file=sys.stderr)
+        sys.exit(2)
+
+    if args.stdin and result.get("ok"):
+        print(yaml.dump(result["frontmatter"], allow_unicode=True, sort_keys=False), end="")
+    else:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+
+    sys.exit(0 if status == 200 and result.get("ok") else 1)
+
+
+if __name__ == "__main__":
+    main()
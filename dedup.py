@@ -0,0 +1,133 @@
+import copy
+import hashlib
+import re
+
+import numpy as np
+
+_FRONTMATTER_PATTERN = re.compile(r"\A---\s*\n.*?\n---\s*\n", re.DOTALL)
+_WORD_PATTERN = re.compile(r"[^\W_]+", re.UNICODE)
+_H1_PATTERN = re.compile(r"^#\s+(.+?)\s*#*\s*$", re.MULTILINE)
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+def strip_frontmatter(content: str) -> str:
+    """Rimuove un eventuale frontmatter YAML iniziale dal contenuto Markdown."""
+    return _FRONTMATTER_PATTERN.sub("", content, count=1)
+
+
+def extract_h1(content: str) -> str | None:
+    """Restituisce il primo titolo H1 del documento, se presente."""
+    match = _H1_PATTERN.search(strip_frontmatter(content))
+    return match.group(1).strip() if match else None
+
+
+def _shingle_hashes(text: str, shingle_size: int) -> np.ndarray:
+    """Calcola gli hash a 32 bit degli shingle di parole del testo."""
+    words = [word.lower() for word in _WORD_PATTERN.findall(text)]
+    if len(words) < shingle_size:
+        shingles = {" ".join(words)} if words else set()
+    else:
+        shingles = {" ".join(words[i:i + shingle_size]) for i in range(len(words) - shingle_size + 1)}
+    return np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little") for s in shingles],
+        dtype=np.uint64,
+    )
+
+
+class MinHasher:
+    """
+    Firme MinHash con permutazioni universali (a*x + b) mod p calcolate con NumPy.
+
+    Con `a`, `b` e gli hash degli shingle sotto 2^32, `a*x + b` resta sotto 2^64 e il
+    calcolo in uint64 non va mai in overflow.
+    """
+
+    def __init__(self, num_perm: int = 128, seed: int = 1):
+        generator = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self._a = generator.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._b = generator.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+
+    def signature(self, hashes: np.ndarray) -> np.ndarray:
+        if hashes.size == 0:
+            return np.full(self.num_perm, _MAX_HASH, dtype=np.uint64)
+        permuted = (np.outer(hashes, self._a) + self._b) % _MERSENNE_PRIME & _MAX_HASH
+        return permuted.min(axis=0)
+
+
+def _choose_bands(num_perm: int, threshold: float) -> int:
+    """Sceglie il numero di bande LSH la cui soglia (1/b)^(1/r) è più vicina a quella richiesta."""
+    candidates = [b for b in range(1, num_perm + 1) if num_perm % b == 0]
+    return min(candidates, key=lambda b: abs((1 / b) ** (b / num_perm) - threshold))
+
+
+def cluster_near_duplicates(documents: dict, threshold: float = 0.9, shingle_size: int = 5, num_perm: int = 128) -> list[list]:
+    """
+    Raggruppa i documenti quasi identici (similarità di Jaccard stimata >= threshold).
+
+    Args:
+        documents: dizionario {chiave: contenuto Markdown}.
+
+    Ogni documento entra in un cluster solo se è simile al rappresentante stesso, non
+    per transitività attraverso un altro membro: il rappresentante ne fornisce il frontmatter.
+
+    Ritorna:
+        list: cluster di chiavi con almeno due elementi; il primo elemento (ordine
+        delle chiavi) è il rappresentante.
+    """
+    keys = sorted(documents, key=str)
+    hasher = MinHasher(num_perm=num_perm)
+    signatures = {
+        key: hasher.signature(_shingle_hashes(strip_frontmatter(documents[key]), shingle_size))
+        for key in keys
+    }
+
+    bands = _choose_bands(num_perm, threshold)
+    rows = num_perm // bands
+    candidates = {key: set() for key in keys}
+    for band in range(bands):
+        buckets: dict[bytes, list] = {}
+        for key in keys:
+            band_signature = signatures[key][band * rows:(band + 1) * rows].tobytes()
+            buckets.setdefault(band_signature, []).append(key)
+        for bucket in buckets.values():
+            for key in bucket:
+                candidates[key].update(bucket)
+
+    # Il rappresentante è la prima chiave (nell'ordinamento) non ancora assegnata
+    assigned = set()
+    clusters = []
+    for representative in keys:
+        if representative in assigned:
+            continue
+        members = [representative]
+        for other in sorted(candidates[representative] - assigned - {representative}, key=str):
+            similarity = float(np.mean(signatures[representative] == signatures[other]))
+            if similarity >= threshold:
+                members.append(other)
+        if len(members) > 1:
+            assigned.update(members)
+            clusters.append(members)
+    return clusters
+
+
+def adapt_frontmatter(frontmatter: dict, content: str) -> dict:
+    """
+    Adatta il frontmatter del rappresentante a un documento del cluster, senza chiamate LLM.
+
+    Il titolo viene preso dall'H1 del documento e propagato a `document.title` e al
+    `name` dello schema JSON-LD.
+    """
+    adapted = copy.deepcopy(frontmatter)
+    title = extract_h1(content)
+    if not title:
+        return adapted
+
+    document = adapted.get("document")
+    if isinstance(document, dict):
+        document["title"] = title
+    schema = adapted.get("schema")
+    if isinstance(schema, dict) and "name" in schema:
+        schema["name"] = title
+    return adapted
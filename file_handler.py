@@ -1,7 +1,15 @@
 import frontmatter
+import hashlib
+import threading
 from pathlib import Path
 import os
 
+import profiling
+
+# Rientrante: update_file_if_unchanged verifica l'hash e scrive sotto lo stesso lock
+_write_lock = threading.RLock()
+
+@profiling.staged("scan")
 def scan_markdown_files(root_path: Path | str) -> list[Path]:
     """Scansiona ricorsivamente una directory e restituisce una lista di file .md."""
     # --- CORREZIONE: Converte il percorso da stringa a oggetto Path se necessario ---
@@ -12,43 +20,78 @@ def scan_markdown_files(root_path: Path | str) -> list[Path]:
         raise SystemExit(f"Errore: Il percorso '{root_path}' non è una directory valida.")
     return list(root_path.glob('**/*.md'))
 
+def content_sha256(content: str) -> str:
+    """Hash SHA-256 del contenuto testuale di un file."""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+def update_file_if_unchanged(file_path: Path, expected_sha256: str, new_frontmatter_data: dict, force: bool = False, dry_run: bool = False) -> str:
+    """
+    Applica il frontmatter solo se il file ha ancora il contenuto da cui è stato generato.
+
+    Con `dry_run` il file non viene scritto e l'esito 'updated' diventa 'applicable'.
+
+    Ritorna:
+        str: 'updated', 'applicable', 'skipped' (file già con frontmatter) o 'stale' (file modificato o assente).
+    """
+    with _write_lock:
+        try:
+            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+                current_content = f.read()
+        except FileNotFoundError:
+            return "stale"
+        if content_sha256(current_content) != expected_sha256:
+            return "stale"
+        if dry_run:
+            return "skipped" if has_frontmatter(current_content) and not force else "applicable"
+        return "updated" if update_file_with_frontmatter(file_path, new_frontmatter_data, force) else "skipped"
+
+def has_frontmatter(content: str) -> bool:
+    """Indica se il contenuto Markdown ha già un frontmatter non vuoto."""
+    try:
+        return bool(frontmatter.loads(content).metadata)
+    except Exception:
+        return False
+
+@profiling.staged("frontmatter_dump")
 def update_file_with_frontmatter(file_path: Path, new_frontmatter_data: dict, force: bool = False):
     """
     Legge un file markdown, aggiorna il suo frontmatter e lo salva.
     """
-    try:
-        # Legge il file ignorando possibili errori di encoding
-        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-            post = frontmatter.load(f)
-
-        # Controlla se il file ha già metadati e se non si sta forzando la sovrascrittura
-        # Nota: post.metadata è sempre un dict, ma potrebbe essere vuoto {}
-        if post.metadata is not None and len(post.metadata) > 0 and not force:
-            print(f"  -> File già con frontmatter. Saltato (usa --force per sovrascrivere).")
-            return False
+    # Serializza lettura e scrittura: daemon e worker possono aggiornare file in parallelo
+    with _write_lock:
+        try:
+            # Legge il file ignorando possibili errori di encoding
+            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+                post = frontmatter.load(f)
+
+            # Controlla se il file ha già metadati e se non si sta forzando la sovrascrittura
+            # Nota: post.metadata è sempre un dict, ma potrebbe essere vuoto {}
+            if post.metadata is not None and len(post.metadata) > 0 and not force:
+                print(f"  -> File già con frontmatter. Saltato (usa --force per sovrascrivere).")
+                return False
 
-        # Unisce i vecchi metadati (se presenti) con i nuovi
-        # NOTA: update() sovrascrive i valori esistenti con quelli nuovi.
-        # Se si desidera preservare alcuni campi specifici, decommentare il codice seguente:
-        #
-        # preserved_fields = ['author', 'date', 'custom_field']  # Campi da preservare
-        # preserved_data = {k: post.metadata[k] for k in preserved_fields if k in post.metadata}
-        # post.metadata.update(new_frontmatter_data)
-        # post.metadata.update(preserved_data)  # Ripristina campi preservati
+            # Unisce i vecchi metadati (se presenti) con i nuovi
+            # NOTA: update() sovrascrive i valori esistenti con quelli nuovi.
+            # Se si desidera preservare alcuni campi specifici, decommentare il codice seguente:
+            #
+            # preserved_fields = ['author', 'date', 'custom_field']  # Campi da preservare
+            # preserved_data = {k: post.metadata[k] for k in preserved_fields if k in post.metadata}
+            # post.metadata.update(new_frontmatter_data)
+            # post.metadata.update(preserved_data)  # Ripristina campi preservati
 
-        post.metadata.update(new_frontmatter_data)
+            post.metadata.update(new_frontmatter_data)
 
-        # Convertiamo esplicitamente il post in una stringa prima di scrivere
-        # Questo ci dà pieno controllo sull'encoding e previene l'errore str/bytes.
-        new_file_content = frontmatter.dumps(post)
+            # Convertiamo esplicitamente il post in una stringa prima di scrivere
+            # Questo ci dà pieno controllo sull'encoding e previene l'errore str/bytes.
+            new_file_content = frontmatter.dumps(post)
 
-        # Scrive la stringa risultante nel file, assicurando la codifica UTF-8
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(new_file_content)
+            # Scrive la stringa risultante nel file, assicurando la codifica UTF-8
+            with open(file_path, 'w', encoding='utf-8') as f:
+                f.write(new_file_content)
             
-        return True
+            return True
 
-    except Exception as e:
-        print(f"  -> Errore durante la scrittura del file: {e}")
-        return False
+        except Exception as e:
+            print(f"  -> Errore durante la scrittura del file: {e}")
+            return False
 
@@ -5,6 +5,8 @@ import tempfile
 from github import Github
 import subprocess
 
+import profiling
+
 def validate_branch_name(branch_name: str) -> str:
     """Valida il nome del branch per prevenire command injection."""
     if not branch_name:
@@ -36,7 +38,14 @@ class GitHandler:
         if not token:
             raise ValueError("È richiesto un token GitHub.")
         self.g = Github(token)
-        self.user = self.g.get_user()
+        self._user = None
+
+    @property
+    def user(self):
+        # Caricato solo quando serve (fork e PR da fork): evita una chiamata API per ogni esecuzione
+        if self._user is None:
+            self._user = self.g.get_user()
+        return self._user
 
     def get_repo(self, repo_name):
         try:
@@ -65,6 +74,7 @@ class GitHandler:
             print(f"  -> Errore imprevisto durante la creazione del fork: {e}")
             raise e
     
+    @profiling.staged("git")
     def clone_repo(self, repo_url, path, branch):
         print(f"  -> Clonazione del branch '{branch}' da {repo_url}...")
         # Validazione input
@@ -82,6 +92,7 @@ class GitHandler:
             print(f"Errore standard:\n{e.stderr.decode('utf-8', errors='ignore')}")
             raise SystemExit("Impossibile clonare il repository.")
 
+    @profiling.staged("git")
     def setup_and_sync_repo(self, repo_path, base_branch, fork_url=None):
         print(f"  -> Sincronizzazione forzata del branch di base '{base_branch}' con 'origin'...")
         # Validazione input
@@ -128,6 +139,7 @@ class GitHandler:
             print("---------------------------------------")
             raise SystemExit("Impossibile sincronizzare il repository locale.")
 
+    @profiling.staged("git")
     def create_branch(self, repo_path, branch_name):
         print(f"  -> Creazione del branch di lavoro: '{branch_name}'")
         # Validazione input
@@ -148,6 +160,7 @@ class GitHandler:
             raise SystemExit("Impossibile creare il branch di lavoro.")
 
     # --- FUNZIONE AGGIORNATA per un commit selettivo ---
+    @profiling.staged("git")
     def commit_and_push(self, repo_path: str, branch_name: str, message: str, updated_files: list, fork_url: str = None) -> bool:
         from pathlib import Path
 
@@ -161,26 +174,7 @@ class GitHandler:
                 print("  -> Nessun file è stato modificato, nessun commit da creare.")
                 return False
 
-            repo_path_obj = Path(repo_path).resolve()
-
-            print("  -> Aggiunta selettiva dei file modificati...")
-            for file_path in updated_files:
-                # Validazione del percorso per prevenire path traversal
-                file_path_obj = Path(file_path).resolve()
-
-                # Verifica che il file sia sotto repo_path
-                try:
-                    file_path_obj.relative_to(repo_path_obj)
-                except ValueError:
-                    print(f"  -> ATTENZIONE: File {file_path} non è sotto {repo_path}, saltato")
-                    continue
-
-                # Usa percorsi relativi per git add
-                relative_path = file_path_obj.relative_to(repo_path_obj)
-                subprocess.run(
-                    ["git", "add", str(relative_path)],
-                    cwd=repo_path, check=True, capture_output=True, timeout=30
-                )
+            stage_files(repo_path, updated_files)
 
             print("  -> Esecuzione del commit...")
             subprocess.run(
@@ -239,6 +233,69 @@ class GitHandler:
         except Exception as e:
             print(f"  -> Errore durante la creazione della Pull Request: {e}")
 
+def stage_files(repo_path: str, updated_files: list) -> None:
+    """Aggiunge all'indice di git solo i file indicati che si trovano sotto repo_path."""
+    from pathlib import Path
+
+    repo_path_obj = Path(repo_path).resolve()
+
+    print("  -> Aggiunta selettiva dei file modificati...")
+    for file_path in updated_files:
+        # Validazione del percorso per prevenire path traversal
+        file_path_obj = Path(file_path).resolve()
+
+        # Verifica che il file sia sotto repo_path
+        try:
+            file_path_obj.relative_to(repo_path_obj)
+        except ValueError:
+            print(f"  -> ATTENZIONE: File {file_path} non è sotto {repo_path}, saltato")
+            continue
+
+        # Usa percorsi relativi per git add
+        relative_path = file_path_obj.relative_to(repo_path_obj)
+        subprocess.run(
+            ["git", "add", str(relative_path)],
+            cwd=repo_path, check=True, capture_output=True, timeout=30
+        )
+
+@profiling.staged("git")
+def commit_files(repo_path: str, message: str, updated_files: list) -> bool:
+    """Crea un commit locale con i soli file indicati, senza push."""
+    if not updated_files:
+        print("  -> Nessun file è stato modificato, nessun commit da creare.")
+        return False
+
+    try:
+        stage_files(repo_path, updated_files)
+        print("  -> Esecuzione del commit...")
+        subprocess.run(
+            ["git", "commit", "-m", message],
+            cwd=repo_path, check=True, capture_output=True, timeout=30
+        )
+        return True
+    except subprocess.TimeoutExpired as e:
+        print("\n--- TIMEOUT DURANTE L'ESECUZIONE DI GIT ---")
+        print(f"Comando: {' '.join(e.cmd)}")
+        print("------------------------------------")
+        return False
+    except subprocess.CalledProcessError as e:
+        print("\n--- ERRORE DURANTE L'ESECUZIONE DI GIT ---")
+        print(f"Comando fallito: {' '.join(e.cmd)}")
+        print(f"Errore standard:\n{e.stderr.decode('utf-8', errors='ignore')}")
+        print("------------------------------------")
+        return False
+
+def find_repo_root(path: str) -> str | None:
+    """Restituisce la radice del repository git che contiene path, se esiste."""
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--show-toplevel"],
+            cwd=path, check=True, capture_output=True, timeout=30
+        )
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, FileNotFoundError):
+        return None
+    return result.stdout.decode("utf-8", errors="ignore").strip() or None
+
 def setup_temp_dir():
     return tempfile.mkdtemp()
 
@@ -1,109 +1,84 @@
 import argparse
 import os
+from pathlib import Path, PurePosixPath
 from dotenv import load_dotenv
 from github import GithubException
 import ai_core
-import git_handler
+import bundle
 import file_handler
+import git_handler
+import org_scan
+import planner
+import processing_core
+import profiling
 import sys
-from pathlib import Path
 import datetime
 
-# --- FUNZIONE AGGIORNATA per tracciare i file modificati ---
-def process_folder(root_path, llm_config, schema_collection, force):
-    """
-    Scansiona una cartella, elabora ogni file Markdown e restituisce un riepilogo
-    e la lista dei percorsi dei file effettivamente aggiornati.
-    """
-    if isinstance(root_path, str):
-        root_path = Path(root_path)
-
-    markdown_files = file_handler.scan_markdown_files(root_path)
-    summary = {"processed": 0, "updated": 0, "skipped": 0, "errors": 0}
-    updated_files_paths = [] # Lista per tracciare i file modificati
+def configure_models():
+    """Configura modello generativo e indice degli schemi, stampando la configurazione scelta."""
+    print("\n[+] Caricamento risorse e avvio elaborazione file AI...")
+    llm_config, schema_collection = ai_core.configure_ai_models()
+    print(f"[+] Modello LLM selezionato: {llm_config.provider} ({llm_config.model})")
+    if llm_config.pool:
+        print(f"[+] Pool di generazione: {llm_config.pool.describe()}")
+    if llm_config.cascade:
+        fast = llm_config.cascade.fast
+        print(f"[+] Cascata attiva: modello economico {fast.provider} ({fast.model})")
+    print(f"[+] Provider embeddings: {llm_config.embedding_provider}")
+    print(f"[+] Indice degli schemi: {ai_core.describe_schema_store()}")
+    return llm_config, schema_collection
 
-    if not markdown_files:
-        print("Nessun file Markdown trovato nel percorso specificato.")
-        return summary, updated_files_paths
-
-    prompt_template, kb_content = ai_core.load_prompt_and_knowledge_base()
-
-    for file_path in markdown_files:
-        relative_path = os.path.relpath(file_path, root_path)
-        print(f"[+] Elaborazione di: {relative_path}")
-        summary["processed"] += 1
 
+def _files_to_process(processing_path, folder, changed_files, force):
+    """
+    Converte i Markdown modificati (percorsi dalla radice del repository) in percorsi
+    relativi alla cartella elaborata; senza --force esclude quelli che hanno già un
+    frontmatter, che non verrebbero comunque aggiornati. I file non più presenti nel
+    clone (eliminati dopo la scansione) vengono saltati.
+    """
+    selected = []
+    for file_name in changed_files:
+        relative_path = PurePosixPath(file_name)
+        if folder not in {"", "."}:
+            relative_path = relative_path.relative_to(PurePosixPath(folder.strip("/")))
         try:
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+            with open(Path(processing_path) / relative_path, "r", encoding="utf-8", errors="ignore") as f:
                 content = f.read()
+        except FileNotFoundError:
+            print(f"  -> {file_name}: non più presente nel branch, saltato.")
+            continue
+        if not force and file_handler.has_frontmatter(content):
+            continue
+        selected.append(relative_path.as_posix())
+    return selected
 
-            if not content.strip():
-                print("  -> File vuoto. Saltato.")
-                summary["skipped"] += 1
-                continue
-            
-            print("  -> Ricerca schemi pertinenti su ChromaDB...")
-            schema_context = ai_core.retrieve_relevant_schemas(schema_collection, content)
-            print("  -> Contesto recuperato.")
-
-            print("  -> Generazione frontmatter con AI...")
-            generated_yaml = ai_core.generate_frontmatter(
-                llm_config=llm_config,
-                prompt_template=prompt_template,
-                schema_context=schema_context,
-                kb_content=kb_content,
-                content=content,
-            )
-
-            if not generated_yaml:
-                summary["errors"] += 1
-                continue
-
-            parsed_data = ai_core.validate_and_parse_yaml(generated_yaml)
-            
-            if parsed_data:
-                if file_handler.update_file_with_frontmatter(file_path, parsed_data, force):
-                    summary["updated"] += 1
-                    updated_files_paths.append(str(file_path)) # Aggiunge il file alla lista
-                else:
-                    summary["skipped"] += 1
-            else:
-                summary["errors"] += 1
-
-        except Exception as e:
-            print(f"  -> Errore imprevisto durante l'elaborazione del file: {e}")
-            summary["errors"] += 1
-            
-    return summary, updated_files_paths
-
-def main():
-    sys.stdout.reconfigure(encoding='utf-8')
-    load_dotenv()
 
-    parser = argparse.ArgumentParser(description="Aggiunge frontmatter AI a file Markdown in un repository GitHub.")
-    parser.add_argument("--repo", type=str, required=True, help="Nome del repository GitHub (es. 'owner/repo').")
-    parser.add_argument("--branch", type=str, default=None, help="Il branch specifico su cui lavorare (default: branch principale del repo).")
-    parser.add_argument("--folder", type=str, default=".", help="La cartella specifica all'interno del repo su cui lavorare (default: root).")
-    parser.add_argument("--force", action="store_true", help="Sovrascrive il frontmatter esistente.")
-    args = parser.parse_args()
+def run_for_repo(handler, repo_name, args, models=None, branch=None, changed_files=None):
+    """
+    Elabora un repository: clone, generazione del frontmatter (o applicazione di un
+    bundle), commit, push e Pull Request.
 
-    github_token = os.getenv("GITHUB_TOKEN")
-    if not github_token:
-        raise SystemExit("Errore: La variabile d'ambiente GITHUB_TOKEN non è impostata.")
+    Con `changed_files` (Markdown modificati, dalla radice del repository) vengono
+    elaborati solo quei file. `models` è la coppia (llm_config, indice degli schemi) già
+    configurata, riusata tra più repository.
 
-    handler = git_handler.GitHandler(github_token)
+    Ritorna:
+        dict: il riepilogo dell'elaborazione.
+    """
     temp_dir = git_handler.setup_temp_dir()
-    
+
     timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
     branch_name = f"feat/add-ai-frontmatter-{timestamp}"
     commit_message = "feat: Aggiunge frontmatter generato da AI"
     pr_title = "Aggiunta Frontmatter AI"
     pr_body = "Questa PR è stata generata automaticamente per aggiungere metadati strutturati (frontmatter) ai file di documentazione."
 
+    bundle_writer = None
+
     try:
-        print(f"--- Avvio processo per il repository: {args.repo} ---")
-        upstream_repo = handler.get_repo(args.repo)
-        source_branch = args.branch if args.branch else upstream_repo.default_branch
+        print(f"--- Avvio processo per il repository: {repo_name} ---")
+        upstream_repo = handler.get_repo(repo_name)
+        source_branch = branch or args.branch or upstream_repo.default_branch
         print(f"[+] Branch target: {source_branch}")
 
         try:
@@ -111,9 +86,9 @@ def main():
             print(f"  -> Branch '{source_branch}' trovato.")
         except GithubException as e:
             if e.status == 404:
-                raise SystemExit(f"Errore: Il branch '{source_branch}' non è stato trovato nel repository '{args.repo}'.")
+                raise SystemExit(f"Errore: Il branch '{source_branch}' non è stato trovato nel repository '{repo_name}'.")
             elif e.status == 403:
-                raise SystemExit(f"Errore: Accesso negato al repository '{args.repo}'. Verifica il token GitHub e i permessi.")
+                raise SystemExit(f"Errore: Accesso negato al repository '{repo_name}'. Verifica il token GitHub e i permessi.")
             elif e.status == 401:
                 raise SystemExit(f"Errore: Token GitHub non valido o scaduto.")
             else:
@@ -137,23 +112,48 @@ def main():
 
         processing_path = os.path.join(temp_dir, args.folder) if args.folder != "." else temp_dir
 
-        print("\n[+] Caricamento risorse e avvio elaborazione file AI...")
-        llm_config, schema_collection = ai_core.configure_ai_models()
-        print(f"[+] Modello LLM selezionato: {llm_config.provider} ({llm_config.model})")
-        print(f"[+] Provider embeddings: {llm_config.embedding_provider}")
-        print(f"[+] Archivio ChromaDB: {ai_core.get_chroma_persist_directory()}")
+        only_files = None
+        if changed_files is not None:
+            only_files = _files_to_process(processing_path, args.folder, changed_files, args.force)
+            print(f"[+] File Markdown da elaborare tra quelli modificati: {len(only_files)} su {len(changed_files)}.")
+            if not only_files:
+                return {}
 
-        # --- CHIAMATA AGGIORNATA ---
-        summary, updated_files = process_folder(
-            root_path=processing_path,
-            llm_config=llm_config,
-            schema_collection=schema_collection,
-            force=args.force
+        scheduler = None
+        if args.apply:
+            # Il frontmatter è già stato generato e validato: si applica il bundle al clone
+            print(f"\n[+] Applicazione del bundle '{args.apply}'...")
+            summary, updated_files = bundle.apply_bundle(args.apply, processing_path, force=args.force)
+        else:
+            llm_config, schema_collection = models or configure_models()
+
+            # --- CHIAMATA AGGIORNATA ---
+            scheduler = planner.create_scheduler(args, llm_config)
+            if args.bundle:
+                bundle_writer = bundle.BundleWriter(args.bundle, processing_path, generator=llm_config.label)
+            summary, updated_files = processing_core.process_folder(
+                root_path=processing_path,
+                llm_config=llm_config,
+                schema_collection=schema_collection,
+                force=args.force,
+                dedup_threshold=args.dedup,
+                scheduler=scheduler,
+                bundle=bundle_writer,
+                only_files=only_files,
+            )
+        # File da ritentare alla prossima scansione dell'organizzazione (dalla radice del repository)
+        summary["retry_files"] = sorted(
+            Path(os.path.relpath(path, temp_dir)).as_posix()
+            for path in summary.get("failed_files", []) + summary.get("deferred_files", [])
         )
+        print("\n--- Riepilogo elaborazione ---")
+        processing_core.print_summary(summary)
+        if scheduler is not None:
+            scheduler.print_report(processing_path)
 
         if summary['updated'] == 0:
             print("\n[!] Nessun file è stato aggiornato. Il processo termina qui.")
-            return
+            return summary
 
         print("\n[+] Finalizzazione delle modifiche su Git...")
         # --- CHIAMATA AGGIORNATA ---
@@ -169,15 +169,110 @@ def main():
             print(f"[!] Le modifiche sono state applicate localmente in: {temp_dir}")
             print("[!] Puoi tentare di risolvere manualmente o rieseguire il processo.")
             raise SystemExit("Processo terminato con errori durante il commit/push.")
+        return summary
 
+    finally:
+        if bundle_writer is not None:
+            bundle_writer.close()
+            print(f"[+] Bundle '{args.bundle}': {bundle_writer.count} frontmatter registrati.")
+        git_handler.cleanup_temp_dir(temp_dir)
+
+
+def run_for_organization(handler, github_token, args):
+    """
+    Scansione di un'organizzazione: elabora solo i repository con nuove modifiche Markdown
+    dall'ultimo commit elaborato, rilevate con richieste condizionali (ETag) in cache.
+    """
+    client = org_scan.ConditionalGitHubClient(github_token)
+    state = org_scan.load_state()
+
+    print(f"--- Scansione dell'organizzazione: {args.org} ---")
+    try:
+        changed = org_scan.scan_organization(client, args.org, state, folder=args.folder, branch=args.branch)
+    finally:
+        client.save_cache()
+        org_scan.save_state(state)
+    print(
+        f"[+] Repository da elaborare: {len(changed)}. Richieste API: {client.requests_made} "
+        f"({client.not_modified} non modificate, rate limit residuo: {client.rate_remaining})."
+    )
+
+    models = None
+    failed = []
+    for entry in changed:
+        print()
+        try:
+            if models is None:
+                models = configure_models()
+            summary = run_for_repo(handler, entry["repo"], args, models=models, branch=entry["branch"], changed_files=entry["files"])
+        except SystemExit as e:
+            print(f"\nERRORE CRITICO ({entry['repo']}): {e}")
+            failed.append(entry["repo"])
+            continue
+        except Exception as e:
+            print(f"\nERRORE IMPREVISTO ({entry['repo']}): {e}")
+            failed.append(entry["repo"])
+            continue
+        # Solo un'elaborazione completata avanza il commit di riferimento; i file falliti o
+        # rinviati restano nello stato e vengono ritentati alla prossima scansione
+        retry_files = summary.get("retry_files", [])
+        if retry_files:
+            print(f"[!] {entry['repo']}: {len(retry_files)} file falliti o rinviati, ritentati alla prossima scansione.")
+        org_scan.record_processed(state, entry["repo"], entry["branch"], entry["sha"], retry_files)
+        org_scan.save_state(state)
+
+    print(f"\n[+] Repository elaborati: {len(changed) - len(failed)} su {len(changed)}.")
+    if failed:
+        print(f"[!] Repository con errori (ritentati alla prossima scansione): {', '.join(failed)}")
+
+
+def main():
+    sys.stdout.reconfigure(encoding='utf-8')
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Aggiunge frontmatter AI a file Markdown in un repository GitHub.")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--repo", type=str, help="Nome del repository GitHub (es. 'owner/repo').")
+    target.add_argument("--org", type=str, help="Elabora i repository dell'organizzazione con nuove modifiche Markdown.")
+    parser.add_argument("--branch", type=str, default=None, help="Il branch specifico su cui lavorare (default: branch principale del repo).")
+    parser.add_argument("--folder", type=str, default=".", help="La cartella specifica all'interno del repo su cui lavorare (default: root).")
+    parser.add_argument("--force", action="store_true", help="Sovrascrive il frontmatter esistente.")
+    parser.add_argument(
+        "--dedup",
+        type=float,
+        nargs="?",
+        const=0.9,
+        default=None,
+        metavar="SOGLIA",
+        help="Riusa il frontmatter tra documenti quasi identici (similarità stimata >= SOGLIA, default 0.9).",
+    )
+    parser.add_argument("--bundle", type=str, default=None, metavar="FILE", help="Registra anche il frontmatter validato in un bundle JSONL locale.")
+    parser.add_argument("--apply", type=str, default=None, metavar="FILE", help="Crea la PR applicando un bundle già generato, senza chiamare il modello.")
+    parser.add_argument("--profile", action="store_true", help="Profila CPU e memoria per stage (incluse le operazioni git) e scrive i report in PROFILE_DIR.")
+    planner.add_scheduling_arguments(parser)
+    args = parser.parse_args()
+
+    if args.org and (args.bundle or args.apply):
+        parser.error("--bundle e --apply si riferiscono a un singolo repository e non sono disponibili con --org.")
+
+    github_token = os.getenv("GITHUB_TOKEN")
+    if not github_token:
+        raise SystemExit("Errore: La variabile d'ambiente GITHUB_TOKEN non è impostata.")
+
+    handler = git_handler.GitHandler(github_token)
+
+    try:
+        with profiling.profile_run("github", enabled=args.profile):
+            if args.org:
+                run_for_organization(handler, github_token, args)
+            else:
+                run_for_repo(handler, args.repo, args)
     except SystemExit as e:
         print(f"\nERRORE CRITICO: {e}")
     except Exception as e:
         print(f"\nERRORE IMPREVISTO: {e}")
     finally:
-        git_handler.cleanup_temp_dir(temp_dir)
         print("\n--- Processo GitHub completato ---")
 
 if __name__ == "__main__":
     main()
-
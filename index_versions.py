@@ -0,0 +1,134 @@
+import datetime
+import hashlib
+import json
+import os
+from pathlib import Path
+
+ALIAS_FILE_NAME = "index_aliases.json"
+
+# Nomi alternativi dello stesso provider di embedding
+_PROVIDER_ALIASES = {
+    "gemini": "google",
+    "sentence_transformers": "sentence-transformers",
+    "local": "sentence-transformers",
+}
+
+
+def canonical_embedding_provider(provider: str) -> str:
+    provider = provider.strip().lower()
+    return _PROVIDER_ALIASES.get(provider, provider)
+
+
+def source_hash(ids: list[str], documents: list[str], metadatas: list[dict]) -> str:
+    """Hash SHA-256 dei documenti da indicizzare (id, testo e metadati)."""
+    digest = hashlib.sha256()
+    for record in zip(ids, documents, metadatas):
+        digest.update(json.dumps(record, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def make_tag(embedding_provider: str, embedding_model: str, source_sha256: str) -> dict:
+    """Etichetta di una versione dell'indice: cosa è stato indicizzato e con quali embeddings."""
+    return {
+        "embedding_provider": canonical_embedding_provider(embedding_provider),
+        "embedding_model": embedding_model,
+        "source_sha256": source_sha256,
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+    }
+
+
+def same_build(tag: dict, other: dict) -> bool:
+    """Indica se due etichette descrivono lo stesso indice (a meno della data di creazione)."""
+    keys = ("embedding_provider", "embedding_model", "source_sha256")
+    return all(tag.get(key) == other.get(key) for key in keys)
+
+
+def version_name(collection_name: str, tag: dict) -> str:
+    """
+    Nome della collection versionata, es. `schema_embeddings-v20260101120000-1a2b3c4d`.
+
+    Il timestamp rende i nomi ordinabili per data; l'hash distingue provider, modello
+    e sorgente. Il nome resta entro i 63 caratteri ammessi da ChromaDB.
+    """
+    timestamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%d%H%M%S")
+    fingerprint = "|".join((tag["embedding_provider"], tag["embedding_model"], tag["source_sha256"]))
+    return f"{collection_name}-v{timestamp}-{hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()[:8]}"
+
+
+# --- Alias: collection logica -> versione attiva ---
+def _alias_path(store_dir: str | Path) -> Path:
+    return Path(store_dir) / ALIAS_FILE_NAME
+
+
+def read_aliases(store_dir: str | Path) -> dict:
+    path = _alias_path(store_dir)
+    if not path.is_file():
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def get_alias(store_dir: str | Path, collection_name: str) -> dict | None:
+    """Restituisce `{"version": ..., "tag": {...}}` della versione attiva, se presente."""
+    return read_aliases(store_dir).get(collection_name)
+
+
+def set_alias(store_dir: str | Path, collection_name: str, version: str, tag: dict) -> None:
+    """Punta la collection logica alla nuova versione, sostituendo il file degli alias in modo atomico."""
+    path = _alias_path(store_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    aliases = read_aliases(store_dir)
+    aliases[collection_name] = {"version": version, "tag": tag}
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(aliases, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def resolve_version(store_dir: str | Path, collection_name: str, embedding_provider: str, embedding_model: str) -> str:
+    """
+    Restituisce la versione attiva di una collection, verificando che sia stata costruita
+    con gli stessi embeddings della configurazione corrente.
+
+    Senza alias (indici costruiti prima del versionamento) viene usata la collection
+    con il nome logico.
+    """
+    alias = get_alias(store_dir, collection_name)
+    if alias is None:
+        return collection_name
+
+    tag = alias.get("tag", {})
+    expected = (canonical_embedding_provider(embedding_provider), embedding_model)
+    built_with = (tag.get("embedding_provider"), tag.get("embedding_model"))
+    if built_with != expected:
+        raise SystemExit(
+            f"Errore: L'indice '{collection_name}' (versione {alias['version']}) è stato costruito con gli embeddings "
+            f"{built_with[0]} ({built_with[1]}), ma la configurazione corrente usa {expected[0]} ({expected[1]}). "
+            "Rieseguire 'python indexer.py'."
+        )
+    return alias["version"]
+
+
+# --- Garbage collection delle versioni ---
+def get_keep_versions() -> int:
+    """Versioni da conservare per ogni collection, inclusa quella attiva (`INDEX_KEEP_VERSIONS`, default 2)."""
+    try:
+        keep = int(os.getenv("INDEX_KEEP_VERSIONS", "2"))
+    except ValueError:
+        raise SystemExit("Errore: INDEX_KEEP_VERSIONS deve essere un numero intero.")
+    return max(keep, 1)
+
+
+def stale_versions(names: list[str], collection_name: str, current: str, keep: int) -> list[str]:
+    """
+    Versioni da eliminare: tutte tranne quella attiva e le più recenti fino a `keep`.
+
+    La collection non versionata (nome logico) conta come la versione più vecchia. La
+    precedente viene conservata di default perché le elaborazioni già avviate possono
+    ancora leggerla.
+    """
+    versions = [name for name in names if name == collection_name or name.startswith(f"{collection_name}-v")]
+    versions.sort(key=lambda name: (name != collection_name, name), reverse=True)
+    kept = [current] + [name for name in versions if name != current][:keep - 1]
+    return [name for name in versions if name not in kept]
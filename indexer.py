@@ -1,3 +1,6 @@
+import argparse
+import os
+import shutil
 from pathlib import Path
 
 import chromadb
@@ -6,7 +9,14 @@ from dotenv import load_dotenv
 from rdflib.namespace import RDFS, RDF
 
 import ai_core
+import index_versions
+import kb_retrieval
+import lexical_index
+import profiling
+import schema_hierarchy
+import vector_index
 
+@profiling.staged("rdf_parse")
 def parse_schema_org_rdf(file_path: Path) -> dict:
     """
     Legge un file RDF di schema.org, lo analizza e lo trasforma
@@ -56,9 +66,27 @@ def parse_schema_org_rdf(file_path: Path) -> dict:
             
         schemas[class_name] = {
             "description": str(row["comment"]),
-            "properties": {} # Verrà popolato dopo
+            "properties": {}, # Verrà popolato dopo
+            "parents": [], # Superclassi dirette (rdfs:subClassOf)
         }
 
+    # Query SPARQL per la gerarchia dei tipi (superclassi dirette)
+    query_parents = """
+        PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+        SELECT ?class ?parent
+        WHERE {
+            ?class rdfs:subClassOf ?parent .
+            FILTER(STRSTARTS(STR(?class), "https://schema.org/"))
+            FILTER(STRSTARTS(STR(?parent), "https://schema.org/"))
+        }
+    """
+
+    for row in g.query(query_parents):
+        class_name = str(row["class"]).replace("https://schema.org/", "")
+        parent_name = str(row["parent"]).replace("https://schema.org/", "")
+        if class_name in schemas and parent_name not in schemas[class_name]["parents"]:
+            schemas[class_name]["parents"].append(parent_name)
+
     # Query SPARQL per trovare tutte le Proprietà
     query_properties = """
         PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
@@ -84,65 +112,231 @@ def parse_schema_org_rdf(file_path: Path) -> dict:
     return schemas
 
 
-def main():
-    """
-    Script per leggere la knowledge base, generare embeddings e indicizzarli su ChromaDB.
-    """
-    load_dotenv()
-
-    print("Configurazione della funzione di embedding...")
-    embedding_provider = ai_core.resolve_embedding_provider()
-    embedding_function = ai_core.configure_embedding_function(embedding_provider)
-
-    client = chromadb.PersistentClient(path=ai_core.get_chroma_persist_directory())
-    collection = client.get_or_create_collection(
-        name="schema_embeddings",
-        embedding_function=embedding_function,
-    )
-    print(f"Collection 'schema_embeddings' pronta su ChromaDB (provider embedding: {embedding_provider}).")
-
-    # Lettura e parsing del file RDF di schema.org
-    kb_path = Path("knowledge_base")
-    # Cerca un file che contenga 'schemaorg' con estensioni .jsonld o .rdf
-    schema_file = None
+def find_schema_file(kb_path: Path) -> Path:
+    """Cerca un file che contenga 'schemaorg' con estensioni .jsonld o .rdf."""
     for ext in ['.jsonld', '.rdf']:
         file = next(kb_path.glob(f'*schemaorg*{ext}'), None)
         if file:
-            schema_file = file
-            break
-            
-    if not schema_file:
-        raise SystemExit("Errore: Nessun file schema.org ('*.jsonld' o '*.rdf') trovato in knowledge_base/")
-
-    schema_data = parse_schema_org_rdf(schema_file)
+            return file
+    raise SystemExit("Errore: Nessun file schema.org ('*.jsonld' o '*.rdf') trovato in knowledge_base/")
 
-    if not schema_data:
-        raise SystemExit("Errore: Nessuno schema è stato estratto dal file RDF.")
 
-    print(f"Inizio l'indicizzazione di {len(schema_data)} schemi...")
+def build_schema_documents(schema_data: dict) -> tuple[list[str], list[str], list[str]]:
+    """
+    Prepara id, documenti e testi per l'indice lessicale a partire dagli schemi estratti.
 
-    # Generazione embeddings e caricamento
+    Nel testo lessicale il nome dello schema è ripetuto per pesare di più rispetto
+    alla descrizione.
+    """
+    ids = []
+    documents = []
+    lexical_texts = []
     for schema_name, schema_info in schema_data.items():
-        # Prepara il testo da indicizzare
         description = schema_info.get("description", "")
-        properties = ", ".join(schema_info.get("properties", {}).keys())
-        content_to_embed = f"Schema: {schema_name}. Descrizione: {description}. Proprietà: {properties}."
+        property_names = list(schema_info.get("properties", {}).keys())
+        properties = ", ".join(property_names)
+        ids.append(schema_name)
+        documents.append(f"Schema: {schema_name}. Descrizione: {description}. Proprietà: {properties}.")
+        lexical_texts.append(f"{schema_name} {schema_name} {schema_name} {description} {' '.join(property_names)}")
+    return ids, documents, lexical_texts
+
 
-        print(f"  - Indicizzazione di '{schema_name}'...")
+@profiling.staged("embedding")
+def index_vector_collection(collection, ids: list[str], documents: list[str], metadatas: list[dict]) -> None:
+    """Genera gli embeddings e carica i documenti nella collection a batch."""
+    # La funzione di embedding riceve più documenti per chiamata e può sfruttare batch e processi multipli
+    try:
+        batch_size = int(os.getenv("INDEXER_BATCH_SIZE", "128"))
+    except ValueError:
+        raise SystemExit("Errore: INDEXER_BATCH_SIZE deve essere un numero intero.")
+
+    for start in range(0, len(ids), batch_size):
+        batch_ids = ids[start:start + batch_size]
+        print(f"  - Indicizzazione dei documenti {start + 1}-{start + len(batch_ids)} di {len(ids)}...")
 
         # Inserisce/aggiorna nel database vettoriale
         try:
             collection.upsert(
-                ids=[schema_name],
-                documents=[content_to_embed],
-                metadatas=[{"schema_name": schema_name}],
+                ids=batch_ids,
+                documents=documents[start:start + batch_size],
+                metadatas=metadatas[start:start + batch_size],
             )
-            print(f"    -> '{schema_name}' indicizzato con successo.")
+            print(f"    -> {len(batch_ids)} documenti indicizzati con successo.")
         except Exception as e:
-            print(f"    -> Errore durante l'inserimento di '{schema_name}': {e}")
+            print(f"    -> Errore durante l'inserimento del batch ({batch_ids[0]} ... {batch_ids[-1]}): {e}")
+
+    # Rimuove i documenti non più presenti nella sorgente (es. sezioni della knowledge base eliminate)
+    stale_ids = sorted(set(collection.get(include=[])["ids"]) - set(ids))
+    if stale_ids:
+        collection.delete(ids=stale_ids)
+        print(f"  - Rimossi {len(stale_ids)} documenti obsoleti.")
+
+
+def build_indexes(
+    collection_name: str,
+    ids: list[str],
+    documents: list[str],
+    lexical_texts: list[str],
+    metadatas: list[dict],
+    export_numpy: bool = False,
+) -> None:
+    """
+    Costruisce gli indici di una collection: sempre l'indice lessicale BM25 e, se la
+    modalità di ricerca lo richiede, la collection ChromaDB (più l'eventuale export NumPy).
+
+    L'indice vettoriale viene costruito in una nuova collection versionata e validato;
+    solo allora l'alias della collection logica passa alla nuova versione, quindi le
+    elaborazioni in corso non vedono mai un indice parziale o con embeddings diversi.
+    """
+    lexical_path = lexical_index.get_lexical_index_path(collection_name)
+    print(f"Costruzione dell'indice lessicale BM25 in '{lexical_path}'...")
+    with profiling.stage("lexical_index"):
+        lexical_index.LexicalIndex.build(ids, documents, lexical_texts).save(lexical_path)
+    print(f"Indice lessicale salvato ({len(ids)} documenti).")
+
+    if ai_core.resolve_retrieval_mode() == "lexical" and not export_numpy:
+        print("Modalità di ricerca 'lexical': indicizzazione vettoriale non necessaria.")
+        return
+
+    embedding_provider = ai_core.resolve_embedding_provider()
+    embedding_function = ai_core.configure_embedding_function(embedding_provider)
+    tag = index_versions.make_tag(
+        embedding_provider,
+        ai_core.resolve_embedding_model(embedding_provider),
+        index_versions.source_hash(ids, documents, metadatas),
+    )
+
+    chroma_directory = ai_core.get_chroma_persist_directory()
+    client = chromadb.PersistentClient(path=chroma_directory)
+    current = index_versions.get_alias(chroma_directory, collection_name)
+    collection = None
+    if current and index_versions.same_build(current["tag"], tag):
+        try:
+            collection = client.get_collection(name=current["version"], embedding_function=embedding_function)
+        except Exception:
+            collection = None
+
+    if collection is not None:
+        version = current["version"]
+        print(f"Versione '{version}' già aggiornata (stessa sorgente e stessi embeddings): nessuna reindicizzazione.")
+    else:
+        # Costruzione in una nuova collection: i lettori continuano a usare la versione attiva
+        version = index_versions.version_name(collection_name, tag)
+        collection = client.create_collection(name=version, embedding_function=embedding_function, metadata=tag)
+        print(f"Nuova versione '{version}' su ChromaDB (provider embedding: {embedding_provider}, modello: {tag['embedding_model']}).")
+
+        print(f"Inizio l'indicizzazione di {len(ids)} documenti...")
+        index_vector_collection(collection, ids, documents, metadatas)
+        try:
+            validate_collection(collection, ids, documents)
+        except SystemExit:
+            client.delete_collection(name=version)
+            raise
+        index_versions.set_alias(chroma_directory, collection_name, version, tag)
+        print(f"Alias '{collection_name}' aggiornato alla versione '{version}'.")
+
+        collection_names = [getattr(item, "name", item) for item in client.list_collections()]
+        for stale in index_versions.stale_versions(collection_names, collection_name, version, index_versions.get_keep_versions()):
+            client.delete_collection(name=stale)
+            print(f"  - Eliminata la versione obsoleta '{stale}'.")
+
+    if export_numpy or ai_core.resolve_vector_backend() == "numpy":
+        export_directory = vector_index.get_numpy_index_directory(version)
+        numpy_directory = export_directory.parent
+        if (export_directory / vector_index.SIDECAR_FILE_NAME).is_file():
+            print(f"Indice NumPy '{export_directory}' già esportato.")
+        else:
+            print(f"Esportazione dell'indice NumPy in '{export_directory}'...")
+            with profiling.stage("numpy_export"):
+                exported = vector_index.export_collection(collection, export_directory, metadata=tag)
+            print(f"Esportati {exported} vettori.")
+        index_versions.set_alias(numpy_directory, collection_name, version, tag)
+
+        directory_names = [path.name for path in numpy_directory.iterdir() if path.is_dir()]
+        for stale in index_versions.stale_versions(directory_names, collection_name, version, index_versions.get_keep_versions()):
+            shutil.rmtree(numpy_directory / stale, ignore_errors=True)
+            print(f"  - Eliminato l'indice NumPy obsoleto '{stale}'.")
+
+
+@profiling.staged("validation")
+def validate_collection(collection, ids: list[str], documents: list[str]) -> None:
+    """
+    Verifica una nuova versione prima di renderla attiva: tutti i documenti presenti e
+    alcuni documenti campione ritrovati come primo risultato della propria ricerca.
+    """
+    count = collection.count()
+    if count != len(ids):
+        raise SystemExit(f"Errore: Validazione fallita: {count} documenti indicizzati su {len(ids)}.")
+
+    samples = sorted({0, len(ids) // 2, len(ids) - 1})
+    results = collection.query(query_texts=[documents[i] for i in samples], n_results=min(3, len(ids)))
+    for sample, found_ids in zip(samples, results.get("ids") or []):
+        if ids[sample] not in found_ids:
+            raise SystemExit(f"Errore: Validazione fallita: il documento '{ids[sample]}' non è ritrovato dalla propria ricerca.")
+    print(f"Validazione superata ({count} documenti).")
+
+
+def build_all_indexes(args):
+    """Costruisce gerarchia dei tipi, indici degli schemi e indici della knowledge base."""
+    # Lettura e parsing del file RDF di schema.org
+    schema_file = find_schema_file(Path("knowledge_base"))
+    schema_data = parse_schema_org_rdf(schema_file)
+
+    if not schema_data:
+        raise SystemExit("Errore: Nessuno schema è stato estratto dal file RDF.")
+
+    # Gerarchia dei tipi con chiusura transitiva delle proprietà ereditate
+    print("\n--- Indice della gerarchia Schema.org ---")
+    hierarchy_path = schema_hierarchy.get_hierarchy_path()
+    with profiling.stage("hierarchy"):
+        schema_hierarchy.save_hierarchy(schema_hierarchy.build_hierarchy(schema_data), hierarchy_path)
+    print(f"Gerarchia di {len(schema_data)} tipi salvata in '{hierarchy_path}'.")
+
+    print("\n--- Indice degli schemi Schema.org ---")
+    ids, documents, lexical_texts = build_schema_documents(schema_data)
+    build_indexes(
+        "schema_embeddings", ids, documents, lexical_texts,
+        [{"schema_name": schema_id} for schema_id in ids],
+        export_numpy=args.export_numpy,
+    )
+
+    # Sezioni della knowledge base, recuperate per documento con KB_RETRIEVAL=true
+    print("\n--- Indice delle sezioni della knowledge base ---")
+    with profiling.stage("kb_chunking"):
+        chunks = kb_retrieval.chunk_knowledge_base()
+    if chunks:
+        build_indexes(
+            kb_retrieval.KB_COLLECTION_NAME,
+            [chunk["id"] for chunk in chunks],
+            [chunk["text"] for chunk in chunks],
+            [f"{chunk['heading']} {chunk['heading']} {chunk['text']}" for chunk in chunks],
+            [{"source": chunk["source"], "heading": chunk["heading"]} for chunk in chunks],
+            export_numpy=args.export_numpy,
+        )
+    else:
+        print("Nessun file testuale trovato nella knowledge base.")
 
     print("\nIndicizzazione completata.")
 
+
+def main():
+    """
+    Script per leggere la knowledge base, generare embeddings e indicizzarli su ChromaDB.
+    Costruisce inoltre gli indici lessicali BM25, che non richiedono embeddings.
+    """
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Indicizza le definizioni Schema.org per la ricerca semantica.")
+    parser.add_argument(
+        "--export-numpy",
+        action="store_true",
+        help="Esporta la collection nell'indice NumPy in-process (automatico con VECTOR_BACKEND=numpy).",
+    )
+    parser.add_argument("--profile", action="store_true", help="Profila CPU e memoria per stage e scrive i report in PROFILE_DIR.")
+    args = parser.parse_args()
+
+    with profiling.profile_run("indexer", enabled=args.profile):
+        build_all_indexes(args)
+
 if __name__ == "__main__":
     main()
-
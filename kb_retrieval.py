@@ -0,0 +1,144 @@
+import os
+import re
+import threading
+from pathlib import Path
+
+import ai_core
+
+KB_COLLECTION_NAME = "knowledge_base_chunks"
+_HEADING_PATTERN = re.compile(r"^#{1,3}\s+(.+?)\s*#*\s*$")
+_MARKDOWN_SUFFIXES = {".md", ".markdown"}
+
+_selector_lock = threading.Lock()
+_selectors: dict[str, "KnowledgeBaseSelector"] = {}
+
+
+def is_enabled() -> bool:
+    """Indica se la selezione per sezioni della knowledge base è attiva (`KB_RETRIEVAL`)."""
+    return (os.getenv("KB_RETRIEVAL") or "false").strip().lower() in {"1", "true", "yes", "on"}
+
+
+def get_top_k() -> int:
+    """Numero di sezioni facoltative da includere per documento (`KB_TOP_K`)."""
+    try:
+        return int(os.getenv("KB_TOP_K", "3"))
+    except ValueError:
+        raise SystemExit("Errore: KB_TOP_K deve essere un numero intero.")
+
+
+def _always_include_patterns() -> list[str]:
+    raw = os.getenv("KB_ALWAYS_INCLUDE", "blueprint")
+    return [pattern.strip().lower() for pattern in raw.split(",") if pattern.strip()]
+
+
+def _split_markdown_sections(text: str) -> list[tuple[str, str]]:
+    """Divide un file Markdown in sezioni (titolo, testo) sui titoli H1-H3, ignorando i code fence."""
+    sections = []
+    heading = ""
+    lines: list[str] = []
+    in_fence = False
+
+    for line in text.splitlines():
+        if line.lstrip().startswith("```"):
+            in_fence = not in_fence
+        match = None if in_fence else _HEADING_PATTERN.match(line)
+        if match:
+            if "\n".join(lines).strip():
+                sections.append((heading, "\n".join(lines).strip()))
+            heading = match.group(1)
+            lines = [line]
+        else:
+            lines.append(line)
+
+    if "\n".join(lines).strip():
+        sections.append((heading, "\n".join(lines).strip()))
+    return sections
+
+
+def chunk_knowledge_base(files: list[Path] | None = None) -> list[dict]:
+    """
+    Suddivide la knowledge base in chunk: una sezione per titolo nei file Markdown,
+    un chunk per file negli altri formati.
+
+    Un chunk è marcato `always` se contiene il `frontmatter_blueprint` o se il suo
+    titolo corrisponde a uno dei pattern di `KB_ALWAYS_INCLUDE`.
+    """
+    patterns = _always_include_patterns()
+    chunks = []
+    for file_path in files if files is not None else ai_core.get_knowledge_base_files():
+        with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+            text = f.read()
+
+        if file_path.suffix.lower() in _MARKDOWN_SUFFIXES:
+            sections = _split_markdown_sections(text)
+        else:
+            sections = [(file_path.stem, text.strip())] if text.strip() else []
+
+        for index, (heading, section_text) in enumerate(sections):
+            heading_lower = heading.lower()
+            chunks.append({
+                "id": f"{file_path.name}#{index}",
+                "source": file_path.name,
+                "heading": heading,
+                "text": section_text,
+                "always": "frontmatter_blueprint" in section_text
+                or any(pattern in heading_lower for pattern in patterns),
+            })
+    return chunks
+
+
+class KnowledgeBaseSelector:
+    """Seleziona per ogni documento le sezioni obbligatorie e i top-k chunk pertinenti."""
+
+    def __init__(self, chunks: list[dict], store, top_k: int):
+        self.chunks = chunks
+        self.store = store
+        self.top_k = top_k
+        self._position = {chunk["id"]: position for position, chunk in enumerate(chunks)}
+
+    def select(self, content: str) -> str:
+        selected = {chunk["id"] for chunk in self.chunks if chunk["always"]}
+        optional_count = len(self.chunks) - len(selected)
+
+        if self.top_k > 0 and optional_count > 0 and content.strip():
+            try:
+                # Si chiedono più risultati per compensare i chunk obbligatori già inclusi
+                results = self.store.query(query_texts=[content], n_results=self.top_k + len(selected))
+                retrieved = [
+                    chunk_id for chunk_id in (results.get("ids") or [[]])[0]
+                    if chunk_id in self._position and chunk_id not in selected
+                ]
+                selected.update(retrieved[:self.top_k])
+            except (Exception, SystemExit) as e:
+                print(f"  -> Errore durante la ricerca nella knowledge base ({e}). Uso dei soli chunk obbligatori.")
+
+        ordered = sorted(selected, key=self._position.get)
+        return "\n\n".join(self.chunks[self._position[chunk_id]]["text"] for chunk_id in ordered)
+
+
+def get_selector(embedding_provider: str) -> KnowledgeBaseSelector:
+    """Restituisce il selettore (creato una sola volta per provider di embedding)."""
+    with _selector_lock:
+        selector = _selectors.get(embedding_provider)
+        if selector is None:
+            store = ai_core.open_schema_store(embedding_provider, collection_name=KB_COLLECTION_NAME)
+            selector = KnowledgeBaseSelector(chunk_knowledge_base(), store, get_top_k())
+            _selectors[embedding_provider] = selector
+        return selector
+
+
+def reset_selectors() -> None:
+    """Dimentica i selettori creati, ad esempio dopo una modifica della knowledge base."""
+    with _selector_lock:
+        _selectors.clear()
+
+
+def select_knowledge_base(content: str, kb_content: str, embedding_provider: str) -> str:
+    """
+    Restituisce il contenuto della knowledge base da iniettare nel prompt per il documento.
+
+    Se `KB_RETRIEVAL` non è attivo restituisce la knowledge base completa.
+    """
+    if not is_enabled():
+        return kb_content
+    return get_selector(embedding_provider).select(content)
@@ -0,0 +1,172 @@
+import gzip
+import json
+import math
+import os
+import re
+from collections import Counter
+from pathlib import Path
+
+_TOKEN_PATTERN = re.compile(r"[^\W_]+", re.UNICODE)
+_CAMEL_CASE_PATTERN = re.compile(r"(?<=[a-z0-9])(?=[A-Z])")
+# Parole troppo comuni (inglese e italiano) per essere utili nel ranking
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has in is it of on or that the this to was with "
+    "il lo la i gli le un una di da del della dei delle e ed che per con su non si come".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    """Divide il testo in token minuscoli, separando anche i nomi in camelCase."""
+    text = _CAMEL_CASE_PATTERN.sub(" ", text or "")
+    return [
+        token
+        for token in (match.group(0).lower() for match in _TOKEN_PATTERN.finditer(text))
+        if len(token) > 1 and token not in _STOPWORDS
+    ]
+
+
+def get_lexical_index_path(collection_name: str = "schema_embeddings") -> Path:
+    """Restituisce il percorso del file dell'indice BM25 per una collection."""
+    env_path = os.getenv("LEXICAL_INDEX_PATH")
+    base_path = Path(env_path).expanduser() if env_path else Path(__file__).resolve().parent / "lexical_index"
+    return base_path / f"{collection_name}.json.gz"
+
+
+class LexicalIndex:
+    """
+    Indice invertito BM25 persistito su disco e caricato alla prima query.
+
+    Espone un metodo `query` compatibile con quello delle collection ChromaDB, così da
+    poter sostituire l'indice vettoriale senza alcuna chiamata di embedding.
+    """
+
+    def __init__(self, path: Path | None = None, k1: float = 1.5, b: float = 0.75):
+        self.path = Path(path) if path else None
+        self.k1 = k1
+        self.b = b
+        self._loaded = False
+        self.ids: list[str] = []
+        self.documents: list[str] = []
+        self.doc_lengths: list[int] = []
+        self.postings: dict[str, list[list[int]]] = {}
+
+    @classmethod
+    def build(cls, ids: list[str], documents: list[str], index_texts: list[str] | None = None, k1: float = 1.5, b: float = 0.75):
+        """
+        Costruisce l'indice in memoria.
+
+        `index_texts` permette di indicizzare un testo diverso dal documento restituito
+        (ad esempio con il nome dello schema ripetuto per aumentarne il peso).
+        """
+        index = cls(k1=k1, b=b)
+        index.ids = list(ids)
+        index.documents = list(documents)
+        for doc_index, text in enumerate(index_texts or documents):
+            term_counts = Counter(tokenize(text))
+            index.doc_lengths.append(sum(term_counts.values()))
+            for term, frequency in term_counts.items():
+                index.postings.setdefault(term, []).append([doc_index, frequency])
+        index._loaded = True
+        return index
+
+    def save(self, path: Path) -> None:
+        """Salva l'indice in formato JSON compresso, sostituendo il file in modo atomico."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        payload = {
+            "k1": self.k1,
+            "b": self.b,
+            "ids": self.ids,
+            "documents": self.documents,
+            "doc_lengths": self.doc_lengths,
+            "postings": self.postings,
+        }
+        tmp_path = path.with_name(path.name + ".tmp")
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self.path = path
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        if not self.path or not self.path.is_file():
+            raise SystemExit(f"Errore: Indice lessicale non trovato in '{self.path}'. Eseguire 'python indexer.py'.")
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            payload = json.load(f)
+        self.k1 = payload["k1"]
+        self.b = payload["b"]
+        self.ids = payload["ids"]
+        self.documents = payload["documents"]
+        self.doc_lengths = payload["doc_lengths"]
+        self.postings = payload["postings"]
+        self._loaded = True
+
+    def count(self) -> int:
+        self._ensure_loaded()
+        return len(self.ids)
+
+    def score(self, query_text: str) -> dict[int, float]:
+        """Calcola il punteggio BM25 dei documenti che contengono almeno un termine della query."""
+        self._ensure_loaded()
+        total_docs = len(self.ids)
+        if not total_docs:
+            return {}
+        average_length = sum(self.doc_lengths) / total_docs
+
+        scores: dict[int, float] = {}
+        for term in set(tokenize(query_text)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_index, frequency in postings:
+                length_norm = 1 - self.b + self.b * self.doc_lengths[doc_index] / average_length
+                scores[doc_index] = scores.get(doc_index, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+        return scores
+
+    def query(self, query_texts: list[str], n_results: int = 10, **kwargs) -> dict:
+        """Restituisce i top-k risultati BM25 per una o più query, nel formato di ChromaDB."""
+        result = {"ids": [], "documents": [], "distances": []}
+        for query_text in query_texts:
+            scores = self.score(query_text)
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:n_results]
+            result["ids"].append([self.ids[i] for i, _ in ranked])
+            result["documents"].append([self.documents[i] for i, _ in ranked])
+            # Distanza decrescente con il punteggio, per coerenza con ChromaDB
+            result["distances"].append([1.0 / (1.0 + score) for _, score in ranked])
+        return result
+
+
+class HybridRetriever:
+    """
+    Combina indice vettoriale e indice BM25 con Reciprocal Rank Fusion.
+
+    Ogni indice propone `candidates` risultati; il punteggio finale di un documento è
+    la somma di 1 / (rrf_k + posizione) sulle due classifiche.
+    """
+
+    def __init__(self, vector_store, lexical_index: LexicalIndex, candidates: int = 20, rrf_k: int = 60):
+        self.vector_store = vector_store
+        self.lexical_index = lexical_index
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+
+    def query(self, query_texts: list[str], n_results: int = 10, **kwargs) -> dict:
+        vector_results = self.vector_store.query(query_texts=query_texts, n_results=self.candidates)
+        lexical_results = self.lexical_index.query(query_texts=query_texts, n_results=self.candidates)
+
+        result = {"ids": [], "documents": [], "distances": []}
+        for row in range(len(query_texts)):
+            fused: dict[str, float] = {}
+            documents: dict[str, str] = {}
+            for ranking in (vector_results, lexical_results):
+                for position, (doc_id, document) in enumerate(zip(ranking["ids"][row], ranking["documents"][row])):
+                    fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (self.rrf_k + position + 1)
+                    documents.setdefault(doc_id, document)
+
+            ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:n_results]
+            result["ids"].append([doc_id for doc_id, _ in ranked])
+            result["documents"].append([documents[doc_id] for doc_id, _ in ranked])
+            result["distances"].append([1.0 - score for _, score in ranked])
+        return result
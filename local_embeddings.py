@@ -0,0 +1,130 @@
+import atexit
+import inspect
+import os
+
+try:
+    from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+except ImportError:  # ChromaDB non è necessario a runtime con VECTOR_BACKEND=numpy
+    Documents = Embeddings = list
+    EmbeddingFunction = object
+
+
+class LocalEmbeddingFunction(EmbeddingFunction):
+    """
+    Funzione di embedding locale basata su sentence-transformers, compatibile con ChromaDB.
+
+    Rispetto alla funzione predefinita di ChromaDB permette di controllare batch size,
+    thread, codifica multi-processo su CPU, backend ONNX, precisione (int8/float16)
+    e lunghezza massima delle sequenze.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        batch_size: int = 64,
+        device: str | None = None,
+        num_threads: int | None = None,
+        processes: int = 0,
+        backend: str = "torch",
+        precision: str = "float32",
+        onnx_file: str | None = None,
+        max_seq_length: int | None = None,
+        multiprocess_min_texts: int = 256,
+    ):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise SystemExit("Errore: Il pacchetto 'sentence-transformers' è necessario per gli embeddings locali.")
+
+        if precision not in {"float32", "float16", "int8"}:
+            raise SystemExit(f"Errore: Precisione '{precision}' non supportata. Usare 'float32', 'float16' o 'int8'.")
+
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.processes = processes
+        self.multiprocess_min_texts = multiprocess_min_texts
+        self._pool = None
+
+        if num_threads:
+            import torch
+            torch.set_num_threads(num_threads)
+
+        model_kwargs = {"device": device}
+        if backend == "onnx":
+            if "backend" not in inspect.signature(SentenceTransformer.__init__).parameters:
+                raise SystemExit(
+                    "Errore: Il backend ONNX richiede sentence-transformers>=3.2 e il pacchetto 'optimum[onnxruntime]'."
+                )
+            model_kwargs["backend"] = "onnx"
+            if precision == "int8":
+                model_kwargs["model_kwargs"] = {"file_name": onnx_file or "onnx/model_qint8_avx512_vnni.onnx"}
+            elif onnx_file:
+                model_kwargs["model_kwargs"] = {"file_name": onnx_file}
+        elif backend != "torch":
+            raise SystemExit(f"Errore: Backend di embedding locale '{backend}' non supportato. Usare 'torch' o 'onnx'.")
+
+        self._model = SentenceTransformer(model_name, **model_kwargs)
+
+        if backend == "torch" and precision == "int8":
+            import torch
+            # Quantizzazione dinamica dei layer lineari: riduce memoria e tempi su CPU
+            self._model = torch.quantization.quantize_dynamic(self._model, {torch.nn.Linear}, dtype=torch.qint8)
+        elif backend == "torch" and precision == "float16":
+            self._model = self._model.half()
+
+        if max_seq_length:
+            self._model.max_seq_length = max_seq_length
+
+    def __call__(self, input: Documents) -> Embeddings:
+        texts = list(input)
+        if not texts:
+            return []
+
+        if self.processes > 1 and len(texts) >= self.multiprocess_min_texts:
+            embeddings = self._model.encode_multi_process(texts, self._get_pool(), batch_size=self.batch_size)
+        else:
+            embeddings = self._model.encode(
+                texts,
+                batch_size=self.batch_size,
+                convert_to_numpy=True,
+                show_progress_bar=False,
+            )
+        return embeddings.tolist()
+
+    def _get_pool(self):
+        """Avvia (una sola volta) il pool di processi CPU per la codifica dei batch grandi."""
+        if self._pool is None:
+            self._pool = self._model.start_multi_process_pool(target_devices=["cpu"] * self.processes)
+            atexit.register(self.close)
+        return self._pool
+
+    def close(self):
+        """Arresta il pool di processi, se attivo."""
+        if self._pool is not None:
+            self._model.stop_multi_process_pool(self._pool)
+            self._pool = None
+
+
+def _int_env(name: str, default: int | None) -> int | None:
+    value = os.getenv(name)
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise SystemExit(f"Errore: La variabile '{name}' deve essere un numero intero (valore: '{value}').")
+
+
+def create_local_embedding_function(model_name: str) -> LocalEmbeddingFunction:
+    """Crea la funzione di embedding locale leggendo la configurazione dalle variabili d'ambiente."""
+    return LocalEmbeddingFunction(
+        model_name=model_name,
+        batch_size=_int_env("LOCAL_EMBEDDING_BATCH_SIZE", 64),
+        device=os.getenv("LOCAL_EMBEDDING_DEVICE") or None,
+        num_threads=_int_env("LOCAL_EMBEDDING_THREADS", None),
+        processes=_int_env("LOCAL_EMBEDDING_PROCESSES", 0),
+        backend=(os.getenv("LOCAL_EMBEDDING_BACKEND") or "torch").strip().lower(),
+        precision=(os.getenv("LOCAL_EMBEDDING_PRECISION") or "float32").strip().lower(),
+        onnx_file=os.getenv("LOCAL_EMBEDDING_ONNX_FILE") or None,
+        max_seq_length=_int_env("LOCAL_EMBEDDING_MAX_SEQ_LENGTH", None),
+    )
@@ -2,113 +2,224 @@ import argparse
 from pathlib import Path
 from dotenv import load_dotenv
 import ai_core
+import bundle
 import file_handler
+import planner
+import processing_core
+import profiling
+import watcher
+import work_queue
 import sys
 import os
 
-def main():
-    """Funzione principale per orchestrare il processo di generazione del frontmatter."""
-    sys.stdout.reconfigure(encoding='utf-8')
-    load_dotenv()
+def run_watch_mode(args, llm_config, schema_collection, prompt_template, kb_content, bundle_writer=None):
+    """Elabora in modo continuo i file creati o modificati riusando client e risorse già caricati."""
+    root_path = Path(args.path)
+    if not root_path.is_dir():
+        raise SystemExit(f"Errore: Il percorso '{root_path}' non è una directory valida.")
+
+    required_fields = ai_core.get_required_fields(ai_core.parse_frontmatter_blueprint(kb_content))
+    summary = processing_core.new_summary(llm_config)
+
+    def handle_changes(changed_files):
+        updated_files = []
+        for file_path in changed_files:
+            print(f"\n--- Elaborazione di: {os.path.relpath(file_path, root_path)} (modificato) ---")
+            summary["total"] += 1
+            if not args.force:
+                # Controllo prima della generazione: ogni salvataggio di una pagina già completa costerebbe una chiamata
+                try:
+                    with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+                        content = f.read()
+                except OSError:
+                    content = ""
+                if file_handler.has_frontmatter(content):
+                    print("  -> File già con frontmatter. Saltato (usa --force per sovrascrivere).")
+                    summary["skipped"] += 1
+                    continue
+            processing_core.process_file(
+                file_path, llm_config, schema_collection, prompt_template, kb_content,
+                required_fields, summary, updated_files, force=args.force, dry_run=args.dry_run,
+                bundle=bundle_writer,
+            )
+        return updated_files
+
+    watcher.MarkdownWatcher(
+        root_path,
+        handle_changes,
+        debounce=args.watch_debounce,
+        use_polling=args.watch_polling,
+    ).run()
+    return summary
+
+
+def run_plan(args):
+    """Stampa il piano della run (token e costo stimati per file) senza chiamate di rete."""
+    root_path = Path(args.path)
+    prompt_template, kb_content = ai_core.load_prompt_and_knowledge_base()
+    markdown_files = file_handler.scan_markdown_files(root_path)
+    if args.shard:
+        # Stessa partizione della run: il piano mostra solo i file dello shard
+        markdown_files = work_queue.select_shard(markdown_files, root_path, args.shard)
+    planner.print_plan(
+        root_path,
+        markdown_files,
+        prompt_template,
+        kb_content,
+        ai_core.describe_llm_config(),
+        order=args.order,
+        priorities=planner.parse_priorities(args.priority),
+        max_cost=args.max_cost,
+    )
+
+
+def run_apply(args):
+    """Applica un bundle generato in precedenza: nessuna chiamata al modello né agli indici."""
+    print(f"--- Applicazione del bundle '{args.apply}' ---")
+    if args.dry_run:
+        print("Modalità DRY-RUN: Nessun file verrà modificato.")
+    summary = {}
+    try:
+        summary, _ = bundle.apply_bundle(args.apply, Path(args.path), force=args.force, dry_run=args.dry_run)
+    except SystemExit as e:
+        print(f"\nERRORE CRITICO: {e}")
+    finally:
+        print("\n--- Processo completato ---")
+        processing_core.print_summary(summary)
+        print("------------------------")
 
-    parser = argparse.ArgumentParser(description="Aggiunge frontmatter generato da AI ai file Markdown.")
-    parser.add_argument("--path", type=str, required=True, help="Il percorso della cartella contenente i file .md")
-    parser.add_argument("--dry-run", action="store_true", help="Esegue lo script senza modificare i file.")
-    parser.add_argument("--force", action="store_true", help="Sovrascrive il frontmatter esistente.")
-    args = parser.parse_args()
+
+def run(args):
+    """Esegue la modalità scelta dagli argomenti: piano, applicazione di un bundle o elaborazione."""
+    if args.plan:
+        run_plan(args)
+        return
+
+    if args.apply:
+        run_apply(args)
+        return
 
     print("--- Avvio del processo ---")
     if args.dry_run:
         print("Modalità DRY-RUN: Nessun file verrà modificato.")
 
-    total_files = files_processed = files_updated = files_skipped = files_failed = 0
-    markdown_files = []
+    summary = {}
+    bundle_writer = None
 
     try:
         print("[+] Caricamento risorse e configurazione AI...")
         prompt_template, kb_content = ai_core.load_prompt_and_knowledge_base()
         llm_config, schema_collection = ai_core.configure_ai_models()
         print(f"[+] Modello LLM selezionato: {llm_config.provider} ({llm_config.model})")
+        if llm_config.pool:
+            print(f"[+] Pool di generazione: {llm_config.pool.describe()}")
+        if llm_config.cascade:
+            fast = llm_config.cascade.fast
+            print(f"[+] Cascata attiva: modello economico {fast.provider} ({fast.model})")
         print(f"[+] Provider embeddings: {llm_config.embedding_provider}")
-        print(f"[+] Archivio ChromaDB: {ai_core.get_chroma_persist_directory()}")
+        print(f"[+] Indice degli schemi: {ai_core.describe_schema_store()}")
         print("[+] Risorse caricate con successo.")
 
-        markdown_files = file_handler.scan_markdown_files(Path(args.path))
-        total_files = len(markdown_files)
-        print(f"[+] Trovati {total_files} file Markdown da elaborare.")
-
-        files_processed = 0
-        files_updated = 0
-        files_skipped = 0
-        files_failed = 0
-
-        for i, file_path in enumerate(markdown_files):
-            relative_path = os.path.relpath(file_path, args.path)
-            print(f"\n--- Elaborazione di: {relative_path} ({i+1}/{total_files}) ---")
-            files_processed += 1
-            
-            try:
-                with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-                    content = f.read()
-
-                if not content.strip():
-                    print("  -> File vuoto. Saltato.")
-                    files_skipped += 1
-                    continue
-
-                print("  -> Ricerca schemi pertinenti su ChromaDB...")
-                schema_context = ai_core.retrieve_relevant_schemas(schema_collection, content)
-                print("  -> Contesto recuperato. Generazione frontmatter in corso...")
-
-                generated_yaml_str = ai_core.generate_frontmatter(
-                    llm_config, prompt_template, schema_context, kb_content, content
-                )
-
-                if not generated_yaml_str:
-                    print("  -> Errore: L'AI non ha restituito un output.")
-                    files_failed += 1
-                    continue
-                
-                validated_frontmatter = ai_core.validate_and_parse_yaml(generated_yaml_str)
-
-                if validated_frontmatter:
-                    if not args.dry_run:
-                        was_updated = file_handler.update_file_with_frontmatter(
-                            file_path, validated_frontmatter, args.force
-                        )
-                        if was_updated:
-                            print("  -> File aggiornato con successo.")
-                            files_updated += 1
-                        else:
-                            # La funzione ora ritorna False sia per errore che per file saltato,
-                            # la logica di stampa è già dentro la funzione.
-                            files_skipped += 1
-                    else:
-                        print("  -> DRY-RUN: Frontmatter generato e valido.")
-                        # print("--- INIZIO DRY-RUN OUTPUT ---")
-                        # print(generated_yaml_str)
-                        # print("--- FINE DRY-RUN OUTPUT ---")
-                else:
-                    print("  -> Errore: L'output dell'AI non è un YAML valido.")
-                    files_failed += 1
-            
-            except Exception as e:
-                print(f"  -> Errore imprevisto durante l'elaborazione del file: {e}")
-                files_failed += 1
+        if args.bundle:
+            bundle_writer = bundle.BundleWriter(args.bundle, Path(args.path), generator=llm_config.label)
+            print(f"[+] Il frontmatter validato verrà registrato nel bundle '{args.bundle}'.")
+
+        if args.watch:
+            summary = run_watch_mode(args, llm_config, schema_collection, prompt_template, kb_content, bundle_writer)
+        elif args.queue:
+            summary = work_queue.run_worker(
+                work_queue.WorkQueue(args.queue),
+                Path(args.path),
+                llm_config,
+                schema_collection,
+                prompt_template,
+                kb_content,
+                force=args.force,
+                worker_id=args.worker_id,
+            )
+        else:
+            scheduler = planner.create_scheduler(args, llm_config)
+            summary, _ = processing_core.process_folder(
+                root_path=Path(args.path),
+                llm_config=llm_config,
+                schema_collection=schema_collection,
+                force=args.force,
+                dry_run=args.dry_run,
+                prompt_template=prompt_template,
+                kb_content=kb_content,
+                dedup_threshold=args.dedup,
+                scheduler=scheduler,
+                shard=args.shard,
+                bundle=bundle_writer,
+            )
+            if scheduler is not None:
+                scheduler.print_report(Path(args.path))
 
     except SystemExit as e:
         print(f"\nERRORE CRITICO: {e}")
     except Exception as e:
         print(f"\nERRORE IMPREVISTO: {e}")
     finally:
+        if bundle_writer is not None:
+            bundle_writer.close()
+            print(f"\n[+] Bundle '{args.bundle}': {bundle_writer.count} frontmatter registrati.")
         print("\n--- Processo completato ---")
-        print(f"File totali: {total_files}")
-        print(f"File elaborati: {files_processed}")
-        print(f"File aggiornati: {files_updated}")
-        print(f"File saltati (o già con frontmatter): {files_skipped}")
-        print(f"File falliti: {files_failed}")
+        processing_core.print_summary(summary)
         print("------------------------")
 
+
+def main():
+    """Funzione principale per orchestrare il processo di generazione del frontmatter."""
+    sys.stdout.reconfigure(encoding='utf-8')
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Aggiunge frontmatter generato da AI ai file Markdown.")
+    parser.add_argument("--path", type=str, required=True, help="Il percorso della cartella contenente i file .md")
+    parser.add_argument("--dry-run", action="store_true", help="Esegue lo script senza modificare i file.")
+    parser.add_argument("--force", action="store_true", help="Sovrascrive il frontmatter esistente.")
+    parser.add_argument(
+        "--dedup",
+        type=float,
+        nargs="?",
+        const=0.9,
+        default=None,
+        metavar="SOGLIA",
+        help="Riusa il frontmatter tra documenti quasi identici (similarità stimata >= SOGLIA, default 0.9).",
+    )
+    parser.add_argument("--watch", action="store_true", help="Monitora la cartella ed elabora i file Markdown creati o modificati.")
+    parser.add_argument("--watch-debounce", type=float, default=2.0, help="Secondi di inattività prima di elaborare un file modificato (default: 2).")
+    parser.add_argument("--watch-polling", action="store_true", help="Usa il polling al posto di inotify in modalità --watch.")
+    parser.add_argument("--plan", action="store_true", help="Stima token e costo di ogni file senza chiamare il modello.")
+    parser.add_argument("--shard", type=work_queue.parse_shard, default=None, metavar="i/N", help="Elabora solo la partizione i-esima di N dei file (hash stabile del percorso).")
+    parser.add_argument("--queue", type=str, default=None, metavar="DB", help="Lavora come worker su una coda SQLite condivisa (il merge si esegue con work_queue.py).")
+    parser.add_argument("--worker-id", type=str, default=None, help="Identificativo del worker in modalità --queue (default: host-pid).")
+    parser.add_argument("--bundle", type=str, default=None, metavar="FILE", help="Registra il frontmatter validato in un bundle JSONL (.jsonl o .jsonl.gz), da applicare con --apply.")
+    parser.add_argument("--apply", type=str, default=None, metavar="FILE", help="Applica un bundle ai file della cartella senza chiamare il modello.")
+    parser.add_argument("--profile", action="store_true", help="Profila CPU e memoria per stage e scrive i report in PROFILE_DIR.")
+    planner.add_scheduling_arguments(parser)
+    args = parser.parse_args()
+
+    if args.queue and args.bundle:
+        parser.error("--bundle non è disponibile con --queue: i risultati dei worker si applicano con 'work_queue.py merge'.")
+    if args.queue:
+        # I worker prendono i file dalla coda uno alla volta: partizione, deduplicazione e pianificazione non si applicano
+        ignored = [
+            option for option, value in (
+                ("--shard", args.shard),
+                ("--dedup", args.dedup),
+                ("--max-cost", args.max_cost),
+                ("--deadline", args.deadline),
+                ("--order", args.order),
+                ("--watch", args.watch),
+                ("--dry-run", args.dry_run),
+            ) if value not in (None, False)
+        ]
+        if ignored:
+            parser.error(f"{', '.join(ignored)} non {'disponibile' if len(ignored) == 1 else 'disponibili'} con --queue.")
+
+    with profiling.profile_run("main", enabled=args.profile):
+        run(args)
+
 if __name__ == "__main__":
     main()
 
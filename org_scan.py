@@ -0,0 +1,214 @@
+import datetime
+import json
+import os
+import re
+import threading
+from pathlib import Path, PurePosixPath
+
+import requests
+
+API_URL = "https://api.github.com"
+# Oltre questo numero di file l'API compare tronca l'elenco: il repository va rielaborato
+_COMPARE_FILE_LIMIT = 300
+_NEXT_LINK_PATTERN = re.compile(r'<([^>]+)>;\s*rel="next"')
+
+
+def get_cache_path() -> Path:
+    """Percorso della cache delle risposte GitHub (`GITHUB_CACHE_PATH`)."""
+    return Path(os.getenv("GITHUB_CACHE_PATH", "./.github_cache/responses.json")).expanduser()
+
+
+def get_state_path() -> Path:
+    """Percorso dello stato della scansione: ultimo commit elaborato per repository (`ORG_SCAN_STATE_PATH`)."""
+    return Path(os.getenv("ORG_SCAN_STATE_PATH", "./.github_cache/org_state.json")).expanduser()
+
+
+def _load_json(path: Path) -> dict:
+    if not path.is_file():
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        print(f"  -> File '{path}' non leggibile: verrà ricreato.")
+        return {}
+
+
+def _save_json(path: Path, data: dict) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+class ConditionalGitHubClient:
+    """
+    Client minimale per l'API REST di GitHub con richieste condizionali.
+
+    Ogni risposta viene salvata in cache con il suo ETag; le richieste successive
+    inviano `If-None-Match` e, se la risorsa non è cambiata, GitHub risponde 304
+    senza consumare il rate limit e si riusa il corpo in cache.
+    """
+
+    def __init__(self, token: str, cache_path: Path | None = None, session: requests.Session | None = None):
+        self.cache_path = cache_path or get_cache_path()
+        self._cache = _load_json(self.cache_path)
+        self._lock = threading.Lock()
+        self.session = session or requests.Session()
+        self.session.headers.update({
+            "Authorization": f"Bearer {token}",
+            "Accept": "application/vnd.github+json",
+            "X-GitHub-Api-Version": "2022-11-28",
+        })
+        self.requests_made = 0
+        self.not_modified = 0
+        self.rate_remaining = None
+
+    def _get(self, url: str) -> tuple[object, str | None]:
+        """Esegue una GET condizionale; ritorna (corpo JSON, URL della pagina successiva)."""
+        cached = self._cache.get(url)
+        headers = {"If-None-Match": cached["etag"]} if cached and cached.get("etag") else {}
+
+        response = self.session.get(url, headers=headers, timeout=30)
+        self.requests_made += 1
+        self.rate_remaining = response.headers.get("X-RateLimit-Remaining", self.rate_remaining)
+
+        if response.status_code == 304 and cached:
+            self.not_modified += 1
+            return cached["body"], cached.get("next")
+        if response.status_code == 404:
+            return None, None
+        if response.status_code in {401, 403} and response.headers.get("X-RateLimit-Remaining") == "0":
+            raise SystemExit("Errore: Rate limit dell'API GitHub esaurito. Riprovare dopo il reset.")
+        if response.status_code == 401:
+            raise SystemExit("Errore: Token GitHub non valido o scaduto.")
+        if response.status_code >= 400:
+            raise SystemExit(f"Errore GitHub ({response.status_code}) su {url}: {response.text[:200]}")
+
+        body = response.json()
+        match = _NEXT_LINK_PATTERN.search(response.headers.get("Link", ""))
+        next_url = match.group(1) if match else None
+        if response.headers.get("ETag"):
+            with self._lock:
+                self._cache[url] = {"etag": response.headers["ETag"], "body": body, "next": next_url}
+        return body, next_url
+
+    def get(self, path: str):
+        """GET di una singola risorsa (None se non esiste)."""
+        body, _ = self._get(f"{API_URL}{path}")
+        return body
+
+    def get_paginated(self, path: str) -> list:
+        """GET di un elenco, seguendo l'header `Link` pagina per pagina."""
+        items = []
+        url = f"{API_URL}{path}"
+        while url:
+            body, url = self._get(url)
+            items.extend(body or [])
+        return items
+
+    def save_cache(self) -> None:
+        with self._lock:
+            _save_json(self.cache_path, self._cache)
+
+
+# --- Rilevamento delle modifiche ---
+def load_state(path: Path | None = None) -> dict:
+    return _load_json(path or get_state_path())
+
+
+def save_state(state: dict, path: Path | None = None) -> None:
+    _save_json(path or get_state_path(), state)
+
+
+def record_processed(state: dict, repo_name: str, branch: str, sha: str, retry_files: list[str] | None = None) -> None:
+    """Registra il commit elaborato e i file (dalla radice del repository) da ritentare alla prossima scansione."""
+    state[repo_name] = {
+        "branch": branch,
+        "sha": sha,
+        "retry": sorted(retry_files or []),
+        "processed_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+    }
+
+
+def _in_folder(file_name: str, folder: str) -> bool:
+    if folder in {"", "."}:
+        return True
+    return PurePosixPath(file_name).is_relative_to(PurePosixPath(folder.strip("/")))
+
+
+def changed_markdown_files(client: ConditionalGitHubClient, repo_name: str, base_sha: str, head_sha: str, folder: str = ".") -> list[str] | None:
+    """
+    File Markdown aggiunti o modificati tra due commit (percorsi dalla radice del repository).
+
+    Ritorna:
+        list | None: None se il confronto non è affidabile (commit base non più presente,
+        ad esempio dopo un force-push, o elenco troncato): il repository va rielaborato.
+    """
+    comparison = client.get(f"/repos/{repo_name}/compare/{base_sha}...{head_sha}")
+    if comparison is None or comparison.get("status") in {"diverged", "behind"}:
+        return None
+    files = comparison.get("files") or []
+    if len(files) >= _COMPARE_FILE_LIMIT:
+        return None
+    return sorted(
+        entry["filename"] for entry in files
+        if entry.get("status") != "removed"
+        and entry["filename"].endswith(".md")
+        and _in_folder(entry["filename"], folder)
+    )
+
+
+def scan_organization(client: ConditionalGitHubClient, org: str, state: dict, folder: str = ".", branch: str | None = None) -> list[dict]:
+    """
+    Elenca i repository dell'organizzazione con nuove modifiche Markdown.
+
+    I file falliti o rinviati nell'elaborazione precedente (`retry` nello stato) si
+    aggiungono ai Markdown modificati, anche se il branch non ha nuovi commit.
+
+    Ritorna:
+        list: un dizionario per repository da elaborare con `repo`, `branch`, `sha` e
+        `files` (i Markdown modificati, oppure None per elaborare l'intera cartella).
+    """
+    repositories = client.get_paginated(f"/orgs/{org}/repos?per_page=100&type=all")
+    if not repositories and client.get(f"/orgs/{org}") is None:
+        raise SystemExit(f"Errore: Organizzazione '{org}' non trovata o non accessibile.")
+
+    changed = []
+    for repository in repositories:
+        repo_name = repository["full_name"]
+        if repository.get("archived") or repository.get("disabled"):
+            continue
+        repo_branch = branch or repository.get("default_branch")
+        head = client.get(f"/repos/{repo_name}/branches/{repo_branch}")
+        if head is None:
+            print(f"  -> {repo_name}: branch '{repo_branch}' non trovato, saltato.")
+            continue
+        head_sha = head["commit"]["sha"]
+
+        previous = state.get(repo_name)
+        if previous and previous.get("branch") == repo_branch:
+            retry = [file_name for file_name in previous.get("retry", []) if _in_folder(file_name, folder)]
+            if previous.get("sha") == head_sha:
+                files = []
+            else:
+                files = changed_markdown_files(client, repo_name, previous["sha"], head_sha, folder)
+            if files is not None:
+                files = sorted(set(files) | set(retry))
+            if files == []:
+                # Nessun Markdown modificato: si avanza il commit di riferimento senza clonare
+                if previous.get("sha") != head_sha:
+                    record_processed(state, repo_name, repo_branch, head_sha)
+                continue
+            reason = (
+                f"{len(files)} file Markdown modificati o da ritentare" if files
+                else "confronto non disponibile, elaborazione completa"
+            )
+        else:
+            files = None
+            reason = "mai elaborato"
+
+        print(f"  -> {repo_name} ({repo_branch}): {reason}.")
+        changed.append({"repo": repo_name, "branch": repo_branch, "sha": head_sha, "files": files})
+    return changed
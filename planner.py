@@ -0,0 +1,442 @@
+import math
+import os
+import re
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import yaml
+
+import ai_core
+import kb_retrieval
+import lexical_index
+import query_builder
+
+CHARS_PER_TOKEN = 4
+ORDER_CHOICES = ("newest", "smallest", "priority")
+# Stima del contesto Schema.org (3 snippet) quando l'indice BM25 locale non è disponibile
+_FALLBACK_SCHEMA_CONTEXT_CHARS = 3 * 1500
+# Peso dell'ultima durata nella media mobile esponenziale usata per la scadenza
+_DURATION_SMOOTHING = 0.3
+# Output atteso: il frontmatter ha la forma del blueprint con valori brevi (circa il doppio
+# dei segnaposto `required`/`optional`) più l'oggetto JSON-LD `schema`
+_BLUEPRINT_VALUE_EXPANSION = 2
+_SCHEMA_OBJECT_TOKENS = 200
+
+# Prezzi indicativi in USD per milione di token (input, output), cercati per prefisso del
+# nome del modello. Si sovrascrivono con LLM_PRICE_INPUT / LLM_PRICE_OUTPUT.
+MODEL_PRICES = {
+    "gemini-2.5-pro": (1.25, 10.00),
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.5-flash-lite": (0.10, 0.40),
+    "gemini-2.0-flash": (0.10, 0.40),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "claude-3-5-sonnet": (3.00, 15.00),
+    "claude-3-5-haiku": (0.80, 4.00),
+    "claude-3-haiku": (0.25, 1.25),
+    "claude-sonnet-4": (3.00, 15.00),
+    "claude-opus-4": (15.00, 75.00),
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """Stima locale dei token (circa 4 caratteri per token)."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def resolve_prices(model: str) -> tuple[float, float] | None:
+    """Restituisce i prezzi (input, output) in USD per milione di token, o None se sconosciuti."""
+    env_input, env_output = os.getenv("LLM_PRICE_INPUT"), os.getenv("LLM_PRICE_OUTPUT")
+    if env_input or env_output:
+        try:
+            return float(env_input or 0), float(env_output or 0)
+        except ValueError:
+            raise SystemExit("Errore: LLM_PRICE_INPUT e LLM_PRICE_OUTPUT devono essere numeri (USD per milione di token).")
+
+    # I modelli OpenRouter hanno il prefisso del fornitore (es. 'openai/gpt-4o-mini')
+    name = model.rsplit("/", 1)[-1].lower()
+    matches = [prefix for prefix in MODEL_PRICES if name.startswith(prefix)]
+    if not matches:
+        return None
+    return MODEL_PRICES[max(matches, key=len)]
+
+
+@dataclass
+class FilePlan:
+    path: Path
+    size: int
+    modified: float
+    input_tokens: int
+    output_tokens: int
+    cost: float | None
+    max_output_tokens: int
+    max_cost: float | None
+
+
+@dataclass
+class BackendEstimate:
+    """Prezzi e token in uscita attesi per un backend di generazione."""
+    label: str
+    weight: float
+    prices: tuple[float, float] | None
+    output_tokens: int
+    max_output_tokens: int
+
+    def cost(self, input_tokens: int, output_tokens: int) -> float | None:
+        if self.prices is None:
+            return None
+        return (input_tokens * self.prices[0] + output_tokens * self.prices[1]) / 1_000_000
+
+
+class PromptEstimator:
+    """
+    Assembla localmente il prompt di ogni file per stimarne i token, senza chiamate di rete.
+
+    Il contesto Schema.org (e le sezioni della knowledge base con `KB_RETRIEVAL=true`)
+    viene recuperato dagli indici BM25 su disco, se presenti; altrimenti si usa una
+    stima fissa per gli schemi e la knowledge base completa.
+
+    I token in uscita attesi si stimano dalla dimensione del blueprint; il limite di
+    output configurato resta come caso peggiore.
+
+    Il costo segue la configurazione della run: con un pool si usa la media dei backend
+    pesata come in `LLM_POOL`; con la cascata i file entro le soglie sono stimati al
+    prezzo del livello economico e il caso peggiore aggiunge l'escalation al principale.
+    """
+
+    def __init__(self, prompt_template: str, kb_content: str, llm_config):
+        self.prompt_template = prompt_template
+        self.kb_content = kb_content
+        self.embedding_provider = llm_config.embedding_provider
+        self.cascade = llm_config.cascade
+        members = [(m.config, m.weight) for m in llm_config.pool.members] if llm_config.pool else [(llm_config, 1.0)]
+        self.primary = [_estimate_backend(config, weight, kb_content) for config, weight in members]
+        self.fast = [_estimate_backend(self.cascade.fast, 1.0, kb_content)] if self.cascade else []
+
+        self.schema_store = _open_local_index("schema_embeddings")
+        self.kb_selector = None
+        if kb_retrieval.is_enabled():
+            kb_store = _open_local_index(kb_retrieval.KB_COLLECTION_NAME)
+            if kb_store is not None:
+                self.kb_selector = kb_retrieval.KnowledgeBaseSelector(
+                    kb_retrieval.chunk_knowledge_base(), kb_store, kb_retrieval.get_top_k()
+                )
+
+    @property
+    def backends(self) -> list[BackendEstimate]:
+        return self.fast + self.primary
+
+    @property
+    def unpriced_models(self) -> list[str]:
+        """Backend senza prezzo noto: con almeno uno di questi il costo non è stimabile."""
+        return [backend.label for backend in self.backends if backend.prices is None]
+
+    def estimate(self, content: str) -> int:
+        """Ritorna i token in ingresso stimati per il contenuto."""
+        query_text = query_builder.build_retrieval_query(content, self.embedding_provider)
+        if self.schema_store is not None:
+            schema_context = ai_core.retrieve_relevant_schemas(self.schema_store, query_text)
+        else:
+            schema_context = "x" * _FALLBACK_SCHEMA_CONTEXT_CHARS
+        kb_content = self.kb_selector.select(query_text) if self.kb_selector else self.kb_content
+        prompt = ai_core.build_prompt(self.prompt_template, schema_context, kb_content, content)
+        return estimate_tokens(prompt)
+
+    def plan(self, file_path: Path, content: str) -> FilePlan:
+        """Stima token e costo del file secondo il livello (economico o principale) che lo elaborerà."""
+        input_tokens = self.estimate(content)
+        primary = _tier_estimate(self.primary, input_tokens)
+        if self.cascade and not ai_core.exceeds_cascade_threshold(content, self.cascade):
+            fast = _tier_estimate(self.fast, input_tokens)
+            # Atteso: il livello economico; caso peggiore: escalation al modello principale
+            output_tokens, cost = fast[0], fast[1]
+            max_output_tokens = fast[2] + primary[2]
+            max_cost = None if fast[3] is None or primary[3] is None else fast[3] + primary[3]
+        else:
+            output_tokens, cost, max_output_tokens, max_cost = primary
+
+        stat = Path(file_path).stat()
+        return FilePlan(
+            path=Path(file_path),
+            size=stat.st_size,
+            modified=stat.st_mtime,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            cost=cost,
+            max_output_tokens=max_output_tokens,
+            max_cost=max_cost,
+        )
+
+
+def _estimate_backend(config, weight: float, kb_content: str) -> BackendEstimate:
+    max_output_tokens = ai_core.get_output_token_limit(config.provider, kb_content)
+    output_tokens = min(_expected_output_tokens(kb_content), max_output_tokens)
+    if ai_core.use_structured_output(config.provider):
+        # Il JSON richiede più token dell'equivalente YAML (virgolette e parentesi)
+        output_tokens += output_tokens // 4
+        max_output_tokens += max_output_tokens // 4
+    return BackendEstimate(config.label, weight, resolve_prices(config.model), output_tokens, max_output_tokens)
+
+
+def _tier_estimate(backends: list[BackendEstimate], input_tokens: int) -> tuple[int, float | None, int, float | None]:
+    """
+    Ritorna (token in uscita, costo, token in uscita massimi, costo massimo) di un livello:
+    media pesata dei backend per i valori attesi, backend più caro per il caso peggiore.
+    """
+    total_weight = sum(backend.weight for backend in backends)
+    output_tokens = round(sum(backend.weight * backend.output_tokens for backend in backends) / total_weight)
+    max_output_tokens = max(backend.max_output_tokens for backend in backends)
+    if any(backend.prices is None for backend in backends):
+        return output_tokens, None, max_output_tokens, None
+    cost = sum(backend.weight * backend.cost(input_tokens, backend.output_tokens) for backend in backends) / total_weight
+    max_cost = max(backend.cost(input_tokens, backend.max_output_tokens) for backend in backends)
+    return output_tokens, cost, max_output_tokens, max_cost
+
+
+def _expected_output_tokens(kb_content: str) -> int:
+    """Token attesi per un frontmatter completo, dalla dimensione del blueprint serializzato."""
+    blueprint = ai_core.parse_frontmatter_blueprint(kb_content)
+    blueprint_tokens = estimate_tokens(yaml.safe_dump(blueprint, allow_unicode=True)) if blueprint else 0
+    return blueprint_tokens * _BLUEPRINT_VALUE_EXPANSION + _SCHEMA_OBJECT_TOKENS
+
+
+def _open_local_index(collection_name: str) -> lexical_index.LexicalIndex | None:
+    path = lexical_index.get_lexical_index_path(collection_name)
+    return lexical_index.LexicalIndex(path) if path.is_file() else None
+
+
+def build_plans(markdown_files: list[Path], estimator: PromptEstimator) -> list[FilePlan]:
+    """Stima token e costo di ogni file non vuoto."""
+    plans = []
+    for file_path in markdown_files:
+        with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+            content = f.read()
+        if not content.strip():
+            continue
+        plans.append(estimator.plan(file_path, content))
+    return plans
+
+
+def _directory_rank(path: Path, root_path: Path, priorities: list[str]) -> int:
+    relative = Path(os.path.relpath(path, root_path)).as_posix()
+    for rank, prefix in enumerate(priorities):
+        prefix = prefix.strip().strip("/")
+        if relative == prefix or relative.startswith(f"{prefix}/"):
+            return rank
+    return len(priorities)
+
+
+def order_files(markdown_files: list[Path], plans: dict, order: str | None, root_path: Path, priorities: list[str] | None = None) -> list[Path]:
+    """
+    Ordina i file secondo la strategia richiesta.
+
+    - `newest`: prima i file modificati più di recente;
+    - `smallest`: prima i file con meno token stimati in ingresso;
+    - `priority`: prima i file nelle directory elencate in `priorities`, nell'ordine dato.
+    """
+    if not order:
+        return list(markdown_files)
+    if order == "newest":
+        return sorted(markdown_files, key=lambda p: -(plans[p].modified if p in plans else _modified_time(p)))
+    if order == "smallest":
+        return sorted(markdown_files, key=lambda p: plans[p].input_tokens if p in plans else 0)
+    if order == "priority":
+        return sorted(markdown_files, key=lambda p: (_directory_rank(p, root_path, priorities or []), str(p)))
+    raise SystemExit(f"Errore: Ordinamento '{order}' non supportato. Usare {', '.join(ORDER_CHOICES)}.")
+
+
+def _modified_time(file_path: Path) -> float:
+    try:
+        return Path(file_path).stat().st_mtime
+    except OSError:
+        return 0.0
+
+
+def parse_deadline(value: str, now: datetime | None = None) -> float:
+    """
+    Converte la scadenza in un timestamp.
+
+    Accetta una durata (`45m`, `2h`, `90s`), un orario (`06:30`, il giorno dopo se già
+    passato) o una data ISO 8601 (`2025-01-31T06:00`).
+    """
+    now = now or datetime.now()
+    text = value.strip().lower()
+
+    duration = re.fullmatch(r"(\d+(?:\.\d+)?)\s*([smh])", text)
+    if duration:
+        seconds = float(duration.group(1)) * {"s": 1, "m": 60, "h": 3600}[duration.group(2)]
+        return (now + timedelta(seconds=seconds)).timestamp()
+
+    clock = re.fullmatch(r"(\d{1,2}):(\d{2})", text)
+    if clock:
+        target = now.replace(hour=int(clock.group(1)), minute=int(clock.group(2)), second=0, microsecond=0)
+        if target <= now:
+            target += timedelta(days=1)
+        return target.timestamp()
+
+    try:
+        return datetime.fromisoformat(value.strip()).timestamp()
+    except ValueError:
+        raise SystemExit(f"Errore: Scadenza non valida: '{value}'. Usare una durata (es. 45m), un orario (HH:MM) o una data ISO.")
+
+
+class BudgetScheduler:
+    """
+    Ordina i file e li ammette all'elaborazione finché costo stimato e scadenza lo consentono.
+
+    Il costo di ogni file è quello stimato dal piano; per la scadenza si usa la media
+    mobile delle durate già osservate, così da fermarsi prima di iniziare un file che
+    non terminerebbe in tempo. Una volta raggiunto un limite, tutti i file restanti
+    vengono rinviati.
+    """
+
+    def __init__(self, llm_config, max_cost: float | None = None, deadline: str | None = None,
+                 order: str | None = None, priorities: list[str] | None = None):
+        self.llm_config = llm_config
+        self.max_cost = max_cost
+        self.deadline = parse_deadline(deadline) if deadline else None
+        self.order = order
+        self.priorities = priorities or []
+        self.plans: dict[Path, FilePlan] = {}
+        self.spent = 0.0
+        self.deferred: list[Path] = []
+        self.stop_reason: str | None = None
+        self._average_duration: float | None = None
+        self._started_at: float | None = None
+
+    def prepare(self, markdown_files: list[Path], root_path: Path, prompt_template: str, kb_content: str) -> list[Path]:
+        """
+        Restituisce l'ordine di elaborazione, stimando i file solo se servono i costi
+        (`max_cost`) o i token in ingresso (`order="smallest"`).
+        """
+        if self.max_cost is None and self.order != "smallest":
+            return order_files(markdown_files, self.plans, self.order, root_path, self.priorities)
+
+        estimator = PromptEstimator(prompt_template, kb_content, self.llm_config)
+        if self.max_cost is not None and estimator.unpriced_models:
+            raise SystemExit(
+                f"Errore: Prezzo sconosciuto per {', '.join(estimator.unpriced_models)}: impostare LLM_PRICE_INPUT e LLM_PRICE_OUTPUT per usare --max-cost."
+            )
+        self.plans = {plan.path: plan for plan in build_plans(markdown_files, estimator)}
+        return order_files(markdown_files, self.plans, self.order, root_path, self.priorities)
+
+    def admit(self, file_path: Path) -> bool:
+        """Indica se il file può essere elaborato; registra il costo stimato se ammesso."""
+        if self.stop_reason:
+            return False
+
+        if self.deadline is not None and time.time() + (self._average_duration or 0.0) > self.deadline:
+            self.stop_reason = "scadenza raggiunta"
+            return False
+
+        plan = self.plans.get(Path(file_path))
+        cost = (plan.cost or 0.0) if plan else 0.0
+        if self.max_cost is not None and self.spent + cost > self.max_cost:
+            self.stop_reason = f"budget di {self.max_cost:g} USD raggiunto"
+            return False
+
+        self.spent += cost
+        self._started_at = time.monotonic()
+        return True
+
+    def done(self) -> None:
+        """Aggiorna la durata media dopo l'elaborazione di un file ammesso."""
+        if self._started_at is None:
+            return
+        duration = time.monotonic() - self._started_at
+        if self._average_duration is None:
+            self._average_duration = duration
+        else:
+            self._average_duration += _DURATION_SMOOTHING * (duration - self._average_duration)
+        self._started_at = None
+
+    def defer(self, file_paths: list[Path]) -> None:
+        self.deferred.extend(Path(p) for p in file_paths)
+
+    def print_report(self, root_path: Path) -> None:
+        """Stampa costo stimato, motivo dell'interruzione e file rinviati."""
+        if self.plans:
+            print(f"Costo stimato dei file elaborati: {format_cost(self.spent)}")
+        if not self.deferred:
+            return
+        print(f"Elaborazione interrotta ({self.stop_reason}): {len(self.deferred)} file rinviati.")
+        for file_path in self.deferred:
+            print(f"  - {os.path.relpath(file_path, root_path)}")
+
+
+def format_cost(cost: float | None) -> str:
+    return "n/d" if cost is None else f"{cost:.4f} USD"
+
+
+def print_plan(root_path: Path, markdown_files: list[Path], prompt_template: str, kb_content: str, llm_config,
+               order: str | None = None, priorities: list[str] | None = None, max_cost: float | None = None) -> None:
+    """Stampa la stima per file e i totali della run, senza chiamate di rete."""
+    estimator = PromptEstimator(prompt_template, kb_content, llm_config)
+    plans = {plan.path: plan for plan in build_plans(markdown_files, estimator)}
+    ordered = [path for path in order_files(markdown_files, plans, order, root_path, priorities) if path in plans]
+
+    print(f"[+] Piano per {len(ordered)} file con {llm_config.provider} ({llm_config.model})")
+    if estimator.cascade:
+        print(f"[+] Cascata: i file entro le soglie sono stimati con {estimator.cascade.fast.label}")
+    for position, backend in enumerate(estimator.backends):
+        weight = f" (peso {backend.weight:g})" if llm_config.pool and position >= len(estimator.fast) else ""
+        if backend.prices is None:
+            print(f"[!] Prezzo di {backend.label} sconosciuto: impostare LLM_PRICE_INPUT e LLM_PRICE_OUTPUT per stimare il costo.")
+        else:
+            print(f"[+] Prezzi {backend.label}{weight}: {backend.prices[0]} USD input / {backend.prices[1]} USD output per milione di token")
+    if estimator.schema_store is None:
+        print("[!] Indice BM25 non trovato: contesto Schema.org stimato con una dimensione fissa.")
+
+    print(f"\n{'Input':>8} {'Output':>8} {'Costo':>12} {'Out max':>8} {'Costo max':>12}  File")
+    cumulative = 0.0
+    within_budget = len(ordered)
+    for position, path in enumerate(ordered):
+        plan = plans[path]
+        cumulative += plan.cost or 0.0
+        if max_cost is not None and cumulative > max_cost and within_budget == len(ordered):
+            within_budget = position
+            print(f"--- limite --max-cost di {max_cost:g} USD: i file seguenti verrebbero rinviati ---")
+        print(
+            f"{plan.input_tokens:>8} {plan.output_tokens:>8} {format_cost(plan.cost):>12} "
+            f"{plan.max_output_tokens:>8} {format_cost(plan.max_cost):>12}  {os.path.relpath(path, root_path)}"
+        )
+
+    total_input = sum(plans[p].input_tokens for p in ordered)
+    total_output = sum(plans[p].output_tokens for p in ordered)
+    total_max_output = sum(plans[p].max_output_tokens for p in ordered)
+    total_cost = None if estimator.unpriced_models else sum(plans[p].cost for p in ordered)
+    total_max_cost = None if estimator.unpriced_models else sum(plans[p].max_cost for p in ordered)
+    print(f"\nToken stimati: {total_input} in ingresso, {total_output} in uscita (al massimo {total_max_output})")
+    print(f"Costo stimato: {format_cost(total_cost)} (caso peggiore: {format_cost(total_max_cost)})")
+    if max_cost is not None:
+        print(f"File entro il budget: {within_budget} su {len(ordered)}")
+
+
+def add_scheduling_arguments(parser) -> None:
+    """Aggiunge al parser le opzioni di pianificazione condivise dagli entrypoint."""
+    parser.add_argument("--max-cost", type=float, default=None, metavar="USD", help="Interrompe l'elaborazione al raggiungimento del costo stimato indicato.")
+    parser.add_argument("--deadline", type=str, default=None, help="Scadenza della run: durata (45m, 2h), orario (HH:MM) o data ISO.")
+    parser.add_argument("--order", choices=ORDER_CHOICES, default=None, help="Ordine di elaborazione dei file.")
+    parser.add_argument("--priority", type=str, default="", help="Directory prioritarie per --order priority, separate da virgola.")
+
+
+def create_scheduler(args, llm_config) -> BudgetScheduler | None:
+    """Crea lo scheduler dalle opzioni di riga di comando, se almeno una è impostata."""
+    if args.max_cost is None and not args.deadline and not args.order:
+        return None
+    return BudgetScheduler(
+        llm_config,
+        max_cost=args.max_cost,
+        deadline=args.deadline,
+        order=args.order,
+        priorities=parse_priorities(args.priority),
+    )
+
+
+def parse_priorities(value: str) -> list[str]:
+    return [item.strip() for item in (value or "").split(",") if item.strip()]
@@ -1,14 +1,310 @@
 import os
 
 import ai_core
+import dedup
 import file_handler
+import kb_retrieval
+import profiling
+import query_builder
+import schema_hierarchy
+import work_queue
 
 
-def process_folder(root_path, llm_config, schema_collection, force=False, dry_run=False):
+def _generate_and_parse(llm_config, prompt_template, schema_context, kb_content, content, summary=None):
+    """
+    Chiama il modello indicato (o il pool di backend) e restituisce il frontmatter validato.
+
+    Se lo YAML non è valido, invece di scartare la generazione si invia al modello solo
+    l'output e l'errore del parser per una correzione mirata.
+
+    Ritorna:
+        tuple: (frontmatter validato o None, backend che ha prodotto l'output)
+    """
+    generated_yaml_str, backend = ai_core.run_generation(
+        llm_config, prompt_template, schema_context, kb_content, content
+    )
+
+    if not generated_yaml_str:
+        print(f"  -> Errore: L'AI non ha restituito un output ({backend.model}).")
+        return None, backend.label
+    if llm_config.pool is not None:
+        print(f"  -> Output generato da {backend.label}.")
+
+    validated_frontmatter, parser_error = ai_core.parse_yaml_with_error(generated_yaml_str)
+    if not validated_frontmatter:
+        print(f"  -> YAML non valido ({backend.model}): correzione mirata in corso...")
+        repaired_yaml_str = ai_core.repair_yaml(backend, generated_yaml_str, parser_error)
+        validated_frontmatter = ai_core.validate_and_parse_yaml(repaired_yaml_str) if repaired_yaml_str else None
+        if not validated_frontmatter:
+            print(f"  -> Errore: L'output dell'AI non è un YAML valido ({backend.model}).")
+            return None, backend.label
+        print("  -> YAML corretto.")
+        if summary is not None:
+            summary["repaired"] += 1
+    return check_schema_object(validated_frontmatter, backend, summary), backend.label
+
+
+def check_schema_object(frontmatter, llm_config, summary=None):
+    """
+    Valida `@type` e nomi delle proprietà dell'oggetto `schema` con l'indice della gerarchia.
+
+    Solo se vengono trovati problemi si chiede al modello una correzione mirata del solo
+    oggetto JSON-LD; se la correzione non è valida si rimuovono le proprietà non ammesse.
+    """
+    hierarchy = schema_hierarchy.get_hierarchy()
+    schema_obj = frontmatter.get("schema")
+    if hierarchy is None or not isinstance(schema_obj, dict) or not schema_hierarchy.is_validation_enabled():
+        return frontmatter
+
+    issues = hierarchy.validate(schema_obj)
+    if not issues:
+        return frontmatter
+
+    print(f"  -> Schema JSON-LD non conforme ({len(issues)} problemi): correzione mirata in corso...")
+    repaired = ai_core.repair_schema_object(llm_config, schema_obj, issues, hierarchy)
+    if repaired is not None and not hierarchy.validate(repaired):
+        print("  -> Schema JSON-LD corretto.")
+        frontmatter["schema"] = repaired
+        if summary is not None:
+            summary["repaired"] += 1
+        return frontmatter
+
+    removed = hierarchy.remove_invalid_properties(schema_obj)
+    if removed:
+        print(f"  -> Correzione non riuscita: rimosse le proprietà non valide ({', '.join(removed)}).")
+    else:
+        print("  -> Correzione non riuscita: schema mantenuto invariato.")
+    return frontmatter
+
+
+def generate_validated_frontmatter(content, llm_config, schema_collection, prompt_template, kb_content, required_fields, summary=None):
+    """
+    Recupera il contesto Schema.org e genera il frontmatter per un singolo documento.
+
+    Se è configurata una cascata, il livello economico elabora il documento per primo
+    e si passa al modello principale solo se l'output non è valido, se mancano campi
+    obbligatori del blueprint o se il documento supera le soglie di complessità.
+
+    Le correzioni mirate vengono conteggiate in `summary["repaired"]`, se fornito.
+
+    Ritorna:
+        tuple: (frontmatter validato o None, livello usato: 'fast' o 'primary',
+                backend che ha prodotto l'output nel formato 'provider:modello')
+    """
+    print("  -> Ricerca schemi pertinenti...")
+    with profiling.stage("retrieval"):
+        query_text = query_builder.build_retrieval_query(content, llm_config.embedding_provider)
+        schema_context = ai_core.retrieve_relevant_schemas(schema_collection, query_text)
+        kb_content = kb_retrieval.select_knowledge_base(query_text, kb_content, llm_config.embedding_provider)
+    print("  -> Contesto recuperato. Generazione frontmatter in corso...")
+
+    cascade = llm_config.cascade
+    if cascade:
+        if ai_core.exceeds_cascade_threshold(content, cascade):
+            print("  -> Documento complesso: uso diretto del modello principale.")
+        else:
+            validated_frontmatter, backend = _generate_and_parse(
+                cascade.fast, prompt_template, schema_context, kb_content, content, summary
+            )
+            if validated_frontmatter:
+                missing_fields = ai_core.find_missing_required_fields(validated_frontmatter, required_fields)
+                if not missing_fields:
+                    return validated_frontmatter, "fast", backend
+                print(f"  -> Campi obbligatori mancanti: {', '.join(missing_fields)}.")
+            print(f"  -> Escalation al modello principale ({llm_config.model})...")
+
+    validated_frontmatter, backend = _generate_and_parse(
+        llm_config, prompt_template, schema_context, kb_content, content, summary
+    )
+    if validated_frontmatter:
+        # Un output interrotto in anticipo non deve mai arrivare su disco senza i campi obbligatori
+        missing_fields = ai_core.find_missing_required_fields(validated_frontmatter, required_fields)
+        if missing_fields:
+            print(f"  -> ERRORE: Campi obbligatori mancanti nell'output del modello principale: {', '.join(missing_fields)}.")
+            return None, "primary", backend
+    return validated_frontmatter, "primary", backend
+
+
+def new_summary(llm_config, total_files=0):
+    """Crea il dizionario di riepilogo condiviso da tutte le modalità di elaborazione."""
+    return {
+        "total": total_files,
+        "processed": 0,
+        "updated": 0,
+        "skipped": 0,
+        "errors": 0,  # Allineato con github_main.py che usa 'errors' invece di 'failed'
+        "tier_fast": 0,
+        "tier_primary": 0,
+        "cascade": llm_config.cascade is not None,
+        "pool": llm_config.pool is not None,
+        "backends": {},  # backend ('provider:modello') -> file generati
+        "file_backends": {},  # percorso del file -> backend che ha prodotto il frontmatter
+        "dedup_clusters": 0,
+        "dedup_reused": 0,
+        "repaired": 0,
+        "deferred": 0,
+        "failed_files": [],  # percorsi dei file falliti
+        "deferred_files": [],  # percorsi dei file rinviati da budget o scadenza
+    }
+
+
+def write_frontmatter(file_path, frontmatter, summary, updated_files_paths, force=False, dry_run=False):
+    """Scrive il frontmatter validato nel file (tranne in dry-run) e aggiorna il riepilogo."""
+    if dry_run:
+        print("  -> DRY-RUN: Frontmatter generato e valido.")
+        return
+
+    was_updated = file_handler.update_file_with_frontmatter(file_path, frontmatter, force)
+    if was_updated:
+        print("  -> File aggiornato con successo.")
+        summary["updated"] += 1
+        updated_files_paths.append(str(file_path))  # Aggiunge il file alla lista
+    else:
+        summary["skipped"] += 1
+
+
+def process_file(
+    file_path,
+    llm_config,
+    schema_collection,
+    prompt_template,
+    kb_content,
+    required_fields,
+    summary,
+    updated_files_paths,
+    force=False,
+    dry_run=False,
+    bundle=None,
+):
+    """
+    Elabora un singolo file Markdown aggiornando il riepilogo e la lista dei file modificati.
+
+    Con un `bundle` (vedi `bundle.BundleWriter`) il frontmatter validato viene anche
+    registrato nel bundle, insieme all'hash del contenuto da cui è stato generato.
+
+    Ritorna:
+        dict | None: il frontmatter validato, se generato.
+    """
+    summary["processed"] += 1
+
+    try:
+        with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+            content = f.read()
+
+        if not content.strip():
+            print("  -> File vuoto. Saltato.")
+            summary["skipped"] += 1
+            return None
+
+        validated_frontmatter, tier, backend = generate_validated_frontmatter(
+            content, llm_config, schema_collection, prompt_template, kb_content, required_fields, summary
+        )
+        summary[f"tier_{tier}"] += 1
+        if validated_frontmatter:
+            summary["backends"][backend] = summary["backends"].get(backend, 0) + 1
+            summary["file_backends"][str(file_path)] = backend
+            if bundle is not None:
+                bundle.add(file_path, content, validated_frontmatter, tier, backend)
+
+        if validated_frontmatter:
+            write_frontmatter(file_path, validated_frontmatter, summary, updated_files_paths, force, dry_run)
+        else:
+            summary["errors"] += 1
+            summary["failed_files"].append(str(file_path))
+
+        return validated_frontmatter
+
+    except Exception as e:
+        print(f"  -> Errore imprevisto durante l'elaborazione del file: {e}")
+        summary["errors"] += 1
+        summary["failed_files"].append(str(file_path))
+        return None
+
+
+def reuse_cluster_frontmatter(file_path, representative_frontmatter, summary, updated_files_paths, force=False, dry_run=False, bundle=None):
+    """Applica a un quasi-duplicato il frontmatter del rappresentante del cluster, senza chiamate LLM."""
+    summary["processed"] += 1
+    try:
+        with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+            content = f.read()
+        print("  -> Quasi-duplicato: riuso del frontmatter del rappresentante del cluster.")
+        frontmatter = dedup.adapt_frontmatter(representative_frontmatter, content)
+        if bundle is not None:
+            bundle.add(file_path, content, frontmatter, tier="dedup")
+        write_frontmatter(file_path, frontmatter, summary, updated_files_paths, force, dry_run)
+        summary["dedup_reused"] += 1
+    except Exception as e:
+        print(f"  -> Errore imprevisto durante l'elaborazione del file: {e}")
+        summary["errors"] += 1
+        summary["failed_files"].append(str(file_path))
+
+
+def _order_by_clusters(markdown_files, dedup_threshold):
+    """
+    Raggruppa i quasi-duplicati e restituisce l'ordine di elaborazione.
+
+    Ritorna:
+        tuple: (lista ordinata di file con i rappresentanti prima dei membri,
+                dict {membro: rappresentante}, numero di cluster)
+    """
+    contents = {}
+    for file_path in markdown_files:
+        with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+            content = f.read()
+        if content.strip():
+            contents[file_path] = content
+
+    clusters = dedup.cluster_near_duplicates(contents, threshold=dedup_threshold)
+    representative_of = {}
+    for members in clusters:
+        for member in members[1:]:
+            representative_of[member] = members[0]
+
+    # I membri vengono elaborati subito dopo il proprio rappresentante
+    ordered_files = []
+    members_of = {members[0]: members[1:] for members in clusters}
+    for file_path in markdown_files:
+        if file_path in representative_of:
+            continue
+        ordered_files.append(file_path)
+        ordered_files.extend(members_of.get(file_path, []))
+    return ordered_files, representative_of, len(clusters)
+
+
+def process_folder(
+    root_path,
+    llm_config,
+    schema_collection,
+    force=False,
+    dry_run=False,
+    prompt_template=None,
+    kb_content=None,
+    dedup_threshold=None,
+    scheduler=None,
+    shard=None,
+    bundle=None,
+    only_files=None,
+):
     """
     Logica principale per elaborare i file in una cartella locale.
     Questa funzione è riutilizzabile sia per lo script locale che per quello di GitHub.
 
+    Con `dedup_threshold` i quasi-duplicati vengono raggruppati (MinHash): il frontmatter
+    è generato una sola volta per il rappresentante e adattato agli altri membri.
+
+    Con uno `scheduler` (vedi `planner.BudgetScheduler`) i file vengono ordinati e
+    l'elaborazione si interrompe al raggiungimento del budget o della scadenza; i file
+    restanti sono conteggiati in `summary["deferred"]`.
+
+    Con `shard=(i, N)` si elabora solo la partizione i-esima dei file, assegnati agli
+    shard con un hash stabile del percorso relativo.
+
+    Con `only_files` (percorsi relativi a `root_path` in formato POSIX) si elaborano
+    solo i file indicati, ad esempio quelli modificati dall'ultima elaborazione.
+
+    Con un `bundle` ogni frontmatter validato viene registrato anche nel bundle, da
+    applicare in seguito con `bundle.apply_bundle` (anche insieme a `dry_run`).
+
     Ritorna:
         tuple: (summary dict, list di percorsi file aggiornati)
     """
@@ -18,67 +314,92 @@ def process_folder(root_path, llm_config, schema_collection, force=False, dry_ru
     if isinstance(root_path, str):
         root_path = Path(root_path)
 
-    prompt_template, kb_content = ai_core.load_prompt_and_knowledge_base()
+    if prompt_template is None or kb_content is None:
+        prompt_template, kb_content = ai_core.load_prompt_and_knowledge_base()
+    required_fields = ai_core.get_required_fields(ai_core.parse_frontmatter_blueprint(kb_content))
+
     markdown_files = file_handler.scan_markdown_files(root_path)
+    if only_files is not None:
+        selected = set(only_files)
+        markdown_files = [file_path for file_path in markdown_files if work_queue.relative_key(file_path, root_path) in selected]
+    if shard is not None:
+        scanned_files = len(markdown_files)
+        markdown_files = work_queue.select_shard(markdown_files, root_path, shard)
+        print(f"[+] Shard {shard[0]}/{shard[1]}: {len(markdown_files)} file su {scanned_files}.")
     total_files = len(markdown_files)
     print(f"[+] Trovati {total_files} file Markdown da elaborare in '{root_path}'.")
 
-    summary = {
-        "processed": 0,
-        "updated": 0,
-        "skipped": 0,
-        "errors": 0  # Allineato con github_main.py che usa 'errors' invece di 'failed'
-    }
+    summary = new_summary(llm_config, total_files)
     updated_files_paths = []  # Lista per tracciare i file modificati
 
-    for i, file_path in enumerate(markdown_files):
-        relative_path = os.path.relpath(file_path, root_path)
-        print(f"\n--- Elaborazione di: {relative_path} ({i+1}/{total_files}) ---")
-        summary["processed"] += 1
+    if scheduler is not None:
+        markdown_files = scheduler.prepare(markdown_files, root_path, prompt_template, kb_content)
 
-        try:
-            with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-                content = f.read()
+    representative_of = {}
+    if dedup_threshold is not None:
+        markdown_files, representative_of, summary["dedup_clusters"] = _order_by_clusters(markdown_files, dedup_threshold)
+        print(
+            f"[+] Quasi-duplicati: {summary['dedup_clusters']} cluster, "
+            f"{len(representative_of)} file riuseranno il frontmatter del rappresentante."
+        )
 
-            if not content.strip():
-                print("  -> File vuoto. Saltato.")
-                summary["skipped"] += 1
-                continue
+    generated = {}
+    for i, file_path in enumerate(markdown_files):
+        representative = representative_of.get(file_path)
+        reusable = representative is not None and generated.get(representative)
 
-            print("  -> Ricerca schemi pertinenti su ChromaDB...")
-            schema_context = ai_core.retrieve_relevant_schemas(schema_collection, content)
-            print("  -> Contesto recuperato. Generazione frontmatter in corso...")
+        # Il riuso tra quasi-duplicati non chiama il modello e non consuma budget
+        if scheduler is not None and not reusable and not scheduler.admit(file_path):
+            print(f"\n[!] Elaborazione interrotta: {scheduler.stop_reason}.")
+            scheduler.defer(markdown_files[i:])
+            summary["deferred"] = total_files - i
+            summary["deferred_files"] = [str(path) for path in markdown_files[i:]]
+            break
+
+        relative_path = os.path.relpath(file_path, root_path)
+        print(f"\n--- Elaborazione di: {relative_path} ({i+1}/{total_files}) ---")
 
-            generated_yaml_str = ai_core.generate_frontmatter(
-                llm_config, prompt_template, schema_context, kb_content, content
+        if reusable:
+            reuse_cluster_frontmatter(
+                file_path, generated[representative], summary, updated_files_paths,
+                force=force, dry_run=dry_run, bundle=bundle,
             )
+            continue
 
-            if not generated_yaml_str:
-                print("  -> Errore: L'AI non ha restituito un output.")
-                summary["errors"] += 1
-                continue
+        frontmatter = process_file(
+            file_path, llm_config, schema_collection, prompt_template, kb_content,
+            required_fields, summary, updated_files_paths, force=force, dry_run=dry_run, bundle=bundle,
+        )
+        if scheduler is not None:
+            scheduler.done()
+        if file_path not in representative_of:
+            generated[file_path] = frontmatter
 
-            validated_frontmatter = ai_core.validate_and_parse_yaml(generated_yaml_str)
+    return summary, updated_files_paths
 
-            if validated_frontmatter:
-                if not dry_run:
-                    was_updated = file_handler.update_file_with_frontmatter(
-                        file_path, validated_frontmatter, force
-                    )
-                    if was_updated:
-                        print("  -> File aggiornato con successo.")
-                        summary["updated"] += 1
-                        updated_files_paths.append(str(file_path))  # Aggiunge il file alla lista
-                    else:
-                        summary["skipped"] += 1
-                else:
-                    print("  -> DRY-RUN: Frontmatter generato e valido.")
-            else:
-                print("  -> Errore: L'output dell'AI non è un YAML valido.")
-                summary["errors"] += 1
-
-        except Exception as e:
-            print(f"  -> Errore imprevisto durante l'elaborazione del file: {e}")
-            summary["errors"] += 1
 
-    return summary, updated_files_paths
+def print_summary(summary):
+    """Stampa il riepilogo finale di un'elaborazione."""
+    print(f"File totali: {summary.get('total', 0)}")
+    print(f"File elaborati: {summary.get('processed', 0)}")
+    print(f"File aggiornati: {summary.get('updated', 0)}")
+    print(f"File saltati (o già con frontmatter): {summary.get('skipped', 0)}")
+    print(f"File falliti: {summary.get('errors', 0)}")
+    if summary.get("stale"):
+        print(f"File modificati dopo la generazione (non aggiornati): {summary['stale']}")
+    if summary.get("lost_leases"):
+        print(f"Risultati scartati per lease scaduto: {summary['lost_leases']}")
+    if summary.get("deferred"):
+        print(f"File rinviati (budget o scadenza): {summary['deferred']}")
+    if summary.get("repaired"):
+        print(f"Output corretti con una chiamata mirata: {summary['repaired']}")
+    if summary.get("dedup_clusters"):
+        print(f"Cluster di quasi-duplicati: {summary['dedup_clusters']}")
+        print(f"File con frontmatter riusato: {summary.get('dedup_reused', 0)}")
+    if summary.get("cascade"):
+        print(f"Generati dal modello economico: {summary['tier_fast']}")
+        print(f"Generati dal modello principale: {summary.get('tier_primary', 0)}")
+    if summary.get("pool") and summary.get("backends"):
+        print("File generati per backend:")
+        for backend, count in sorted(summary["backends"].items(), key=lambda item: -item[1]):
+            print(f"  - {backend}: {count}")
@@ -0,0 +1,255 @@
+import cProfile
+import datetime
+import functools
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+_active = None
+
+
+def get_profile_directory() -> Path:
+    """Cartella dei report di profiling (`PROFILE_DIR`, default `./profiles`)."""
+    return Path(os.getenv("PROFILE_DIR", "./profiles")).expanduser()
+
+
+def _env_number(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        raise SystemExit(f"Errore: {name} deve essere un numero.")
+
+
+class _StageStats:
+    __slots__ = ("calls", "seconds", "allocated", "peak")
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.allocated = 0
+        self.peak = 0
+
+
+class _Frame:
+    __slots__ = ("name", "started_at", "memory_at_start", "peak")
+
+    def __init__(self, name: str, memory_at_start: int):
+        self.name = name
+        self.started_at = time.perf_counter()
+        self.memory_at_start = memory_at_start
+        self.peak = memory_at_start
+
+
+class Profiler:
+    """
+    Profiling di un'intera esecuzione: CPU deterministico (cProfile) sul thread principale,
+    campionamento degli stack di tutti i thread e allocazioni (tracemalloc).
+
+    Tempo e memoria sono attribuiti agli stage della pipeline dichiarati con `stage()`
+    o `staged()`; i campioni finiscono in un file di stack compressi (formato
+    `flamegraph.pl`/speedscope) con lo stage corrente come primo frame.
+    """
+
+    def __init__(self, label: str, output_dir: Path | None = None, interval: float | None = None, top_n: int | None = None):
+        self.label = label
+        self.output_dir = output_dir or get_profile_directory()
+        self.interval = interval if interval is not None else _env_number("PROFILE_SAMPLE_INTERVAL_MS", 5) / 1000
+        self.top_n = top_n if top_n is not None else int(_env_number("PROFILE_TOP_N", 25))
+        self.stages: dict[str, _StageStats] = {}
+        self.samples: Counter = Counter()
+        self._stacks: dict[int, list[_Frame]] = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._sampler = None
+        self._cpu_profile = cProfile.Profile()
+        self._started_at = 0.0
+        self.wall_seconds = 0.0
+        self.staged_seconds = 0.0
+        self.peak_memory = 0
+
+    # --- Stage ---
+    def _fold_peak(self, stack: list[_Frame]) -> int:
+        # Il picco di tracemalloc è globale: lo si riporta su tutti gli stage aperti prima di azzerarlo
+        current, peak = tracemalloc.get_traced_memory()
+        self.peak_memory = max(self.peak_memory, peak)
+        for frame in stack:
+            frame.peak = max(frame.peak, peak)
+        tracemalloc.reset_peak()
+        return current
+
+    def enter(self, name: str) -> None:
+        with self._lock:
+            stack = self._stacks.setdefault(threading.get_ident(), [])
+            stack.append(_Frame(name, self._fold_peak(stack)))
+
+    def exit(self) -> None:
+        with self._lock:
+            stack = self._stacks.get(threading.get_ident())
+            if not stack:
+                return
+            current = self._fold_peak(stack)
+            frame = stack.pop()
+            stats = self.stages.setdefault(frame.name, _StageStats())
+            elapsed = time.perf_counter() - frame.started_at
+            stats.calls += 1
+            stats.seconds += elapsed
+            if not stack:
+                self.staged_seconds += elapsed
+            stats.allocated += current - frame.memory_at_start
+            stats.peak = max(stats.peak, frame.peak - frame.memory_at_start)
+
+    def _current_stage(self, thread_id: int) -> str:
+        stack = self._stacks.get(thread_id)
+        return stack[-1].name if stack else "-"
+
+    # --- Campionamento ---
+    def _sample_loop(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    # I wrapper degli stage non aggiungono informazione agli stack
+                    if code.co_filename != __file__:
+                        names.append(f"{Path(code.co_filename).stem}:{code.co_name}")
+                    frame = frame.f_back
+                names.append(f"[{self._current_stage(thread_id)}]")
+                self.samples[";".join(reversed(names))] += 1
+
+    # --- Avvio e report ---
+    def start(self) -> None:
+        global _active
+        tracemalloc.start()
+        self._started_at = time.perf_counter()
+        self._sampler = threading.Thread(target=self._sample_loop, name="profiling-sampler", daemon=True)
+        self._sampler.start()
+        _active = self
+        self._cpu_profile.enable()
+
+    def stop(self) -> None:
+        global _active
+        self._cpu_profile.disable()
+        _active = None
+        self._stop_event.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        self.wall_seconds = time.perf_counter() - self._started_at
+        self._snapshot = tracemalloc.take_snapshot()
+        self.peak_memory = max(self.peak_memory, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    def _stage_lines(self) -> list[str]:
+        lines = [f"{'Stage':<20} {'Chiamate':>9} {'Tempo (s)':>10} {'%':>6} {'Allocati (MB)':>14} {'Picco (MB)':>11}"]
+        for name, stats in sorted(self.stages.items(), key=lambda item: -item[1].seconds):
+            share = stats.seconds / self.wall_seconds * 100 if self.wall_seconds else 0.0
+            lines.append(
+                f"{name:<20} {stats.calls:>9} {stats.seconds:>10.3f} {share:>6.1f} "
+                f"{stats.allocated / 2**20:>14.2f} {stats.peak / 2**20:>11.2f}"
+            )
+        return lines
+
+    def _self_sample_lines(self) -> list[str]:
+        leaves = Counter()
+        for stack, count in self.samples.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        total = sum(leaves.values()) or 1
+        return [f"{count:>8} {count / total * 100:>6.1f}%  {frame}" for frame, count in leaves.most_common(self.top_n)]
+
+    def write_report(self) -> list[Path]:
+        """Scrive report testuale, stack compressi e statistiche cProfile; ritorna i percorsi."""
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        base = self.output_dir / f"{self.label}-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}"
+        report_path = base.with_suffix(".txt")
+        collapsed_path = base.with_suffix(".collapsed")
+        pstats_path = base.with_suffix(".prof")
+
+        with open(collapsed_path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        self._cpu_profile.dump_stats(str(pstats_path))
+
+        cpu_output = io.StringIO()
+        pstats.Stats(self._cpu_profile, stream=cpu_output).sort_stats("cumulative").print_stats(self.top_n)
+
+        allocations = self._snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ]).statistics("lineno")[:self.top_n]
+
+        lines = [
+            f"Profiling di '{self.label}'",
+            f"Durata: {self.wall_seconds:.3f} s, campioni: {sum(self.samples.values())} (ogni {self.interval * 1000:g} ms), "
+            f"picco di memoria tracciata: {self.peak_memory / 2**20:.2f} MB",
+            "",
+            "--- Stage della pipeline (tempi inclusivi) ---",
+            *self._stage_lines(),
+            f"Tempo negli stage (esclusi quelli annidati): {self.staged_seconds:.3f} s su {self.wall_seconds:.3f} s",
+            "",
+            f"--- Funzioni più campionate (top {self.top_n}, tutti i thread) ---",
+            *self._self_sample_lines(),
+            "",
+            f"--- CPU deterministico, thread principale (top {self.top_n} per tempo cumulativo) ---",
+            cpu_output.getvalue().strip(),
+            "",
+            f"--- Allocazioni ancora in memoria a fine esecuzione (top {self.top_n}) ---",
+            *(str(statistic) for statistic in allocations),
+        ]
+        with open(report_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        return [report_path, collapsed_path, pstats_path]
+
+
+@contextmanager
+def stage(name: str):
+    """Attribuisce il blocco allo stage indicato; senza profiling attivo non fa nulla."""
+    profiler = _active
+    if profiler is None:
+        yield
+        return
+    profiler.enter(name)
+    try:
+        yield
+    finally:
+        profiler.exit()
+
+
+def staged(name: str):
+    """Decoratore equivalente a `stage()` per attribuire un'intera funzione a uno stage."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _active is None:
+                return function(*args, **kwargs)
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def profile_run(label: str, enabled: bool = True):
+    """Esegue il blocco sotto profiling (se `enabled`) e scrive i report in `PROFILE_DIR`."""
+    if not enabled:
+        yield None
+        return
+
+    profiler = Profiler(label)
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        paths = profiler.write_report()
+        print(f"\n[+] Report di profiling: {paths[0]}")
+        print(f"[+] Stack compressi (flamegraph): {paths[1]}, statistiche cProfile: {paths[2]}")
+        print("\n".join(profiler._stage_lines()))
@@ -0,0 +1,136 @@
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable
+
+# Peso delle ultime osservazioni nelle medie mobili di latenza e tasso di errore
+_SMOOTHING = 0.3
+_MAX_COOLDOWN = 600.0
+
+
+def parse_pool_spec(spec: str) -> list[tuple[str, str | None, float]]:
+    """
+    Interpreta `LLM_POOL`: voci `provider[:modello[:peso]]` separate da virgola.
+
+    Il peso è l'ultimo segmento solo se numerico, così i modelli OpenRouter con ':'
+    nel nome (es. `openrouter:meta-llama/llama-3.1-8b-instruct:free`) restano validi.
+    """
+    entries = []
+    for raw_entry in spec.split(","):
+        raw_entry = raw_entry.strip()
+        if not raw_entry:
+            continue
+        provider, _, rest = raw_entry.partition(":")
+        weight = 1.0
+        if rest:
+            head, _, tail = rest.rpartition(":")
+            try:
+                weight = float(tail)
+                rest = head
+            except ValueError:
+                pass
+        if weight <= 0:
+            raise SystemExit(f"Errore: Peso non valido per '{raw_entry}' in LLM_POOL (deve essere positivo).")
+        entries.append((provider.strip().lower(), rest.strip() or None, weight))
+    return entries
+
+
+@dataclass
+class PoolMember:
+    config: Any
+    label: str
+    weight: float
+    latency: float | None = None
+    error_rate: float = 0.0
+    consecutive_failures: int = 0
+    cooldown_until: float = 0.0
+    requests: int = 0
+    failures: int = 0
+
+
+class ProviderPool:
+    """
+    Distribuisce le generazioni tra più backend LLM con failover automatico.
+
+    Ogni richiesta sceglie il primo backend a caso, in proporzione al peso effettivo
+    (peso configurato, corretto per latenza relativa e tasso di errore osservati); se
+    fallisce si passa agli altri in ordine di peso effettivo. Dopo errori consecutivi
+    un backend resta escluso per un intervallo crescente (`cooldown`).
+    """
+
+    def __init__(self, members: list[PoolMember], cooldown: float = 30.0, rng: random.Random | None = None):
+        if not members:
+            raise ValueError("Il pool deve contenere almeno un backend.")
+        self.members = members
+        self.cooldown = cooldown
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+
+    def _effective_weight(self, member: PoolMember, fastest: float | None) -> float:
+        latency_factor = fastest / member.latency if fastest and member.latency else 1.0
+        return member.weight * latency_factor * (1.0 - member.error_rate) ** 2
+
+    def ordered_members(self) -> list[PoolMember]:
+        """Restituisce i backend nell'ordine in cui tentarli per la prossima richiesta."""
+        with self._lock:
+            now = time.monotonic()
+            available = [m for m in self.members if m.cooldown_until <= now]
+            cooling = sorted((m for m in self.members if m.cooldown_until > now), key=lambda m: m.cooldown_until)
+            if not available:
+                # Tutti in pausa: si riprova comunque, dal primo che tornerebbe disponibile
+                return cooling
+
+            observed = [m.latency for m in available if m.latency]
+            fastest = min(observed) if observed else None
+            weights = [max(self._effective_weight(m, fastest), 1e-6) for m in available]
+            first = self._rng.choices(available, weights=weights, k=1)[0]
+            rest = sorted(
+                (m for m in available if m is not first),
+                key=lambda m: self._effective_weight(m, fastest),
+                reverse=True,
+            )
+            return [first] + rest + cooling
+
+    def record_success(self, member: PoolMember, latency: float) -> None:
+        with self._lock:
+            member.requests += 1
+            member.latency = latency if member.latency is None else member.latency + _SMOOTHING * (latency - member.latency)
+            member.error_rate -= _SMOOTHING * member.error_rate
+            member.consecutive_failures = 0
+            member.cooldown_until = 0.0
+
+    def record_failure(self, member: PoolMember) -> None:
+        with self._lock:
+            member.requests += 1
+            member.failures += 1
+            member.error_rate += _SMOOTHING * (1.0 - member.error_rate)
+            member.consecutive_failures += 1
+            if member.consecutive_failures >= 2:
+                pause = min(self.cooldown * 2 ** (member.consecutive_failures - 2), _MAX_COOLDOWN)
+                member.cooldown_until = time.monotonic() + pause
+
+    def run(self, call: Callable[[Any], Any]) -> tuple[Any, PoolMember]:
+        """
+        Esegue `call(config)` sui backend finché uno restituisce un risultato non vuoto.
+
+        Ritorna:
+            tuple: (risultato o None se tutti falliscono, ultimo backend tentato)
+        """
+        member = None
+        for member in self.ordered_members():
+            started_at = time.monotonic()
+            try:
+                result = call(member.config)
+            except Exception as e:
+                print(f"  -> Errore del backend {member.label}: {e}")
+                result = None
+            if result:
+                self.record_success(member, time.monotonic() - started_at)
+                return result, member
+            self.record_failure(member)
+            print(f"  -> Backend {member.label} non disponibile: failover al successivo.")
+        return None, member
+
+    def describe(self) -> str:
+        return ", ".join(f"{m.label} (peso {m.weight:g})" for m in self.members)
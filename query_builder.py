@@ -0,0 +1,110 @@
+import os
+import re
+from collections import Counter
+
+import ai_core
+import dedup
+import lexical_index
+
+QUERY_MODES = ("full", "compact")
+
+_FENCE_PATTERN = re.compile(r"^(```|~~~).*?^\1\s*$", re.DOTALL | re.MULTILINE)
+_HTML_TAG_PATTERN = re.compile(r"<[^>]+>")
+_IMAGE_PATTERN = re.compile(r"!\[([^\]]*)\]\([^)]*\)")
+_LINK_PATTERN = re.compile(r"\[([^\]]+)\]\([^)]*\)")
+_HEADING_PATTERN = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+_INLINE_CODE_PATTERN = re.compile(r"`([^`\n]+)`")
+_EMPHASIS_PATTERN = re.compile(r"[*_]{1,3}([^*_\n]+)[*_]{1,3}")
+_MAX_HEADINGS = 12
+_MAX_KEY_TERMS = 12
+
+
+def _strip_markup(text: str) -> str:
+    text = _IMAGE_PATTERN.sub(r"\1", text)
+    text = _LINK_PATTERN.sub(r"\1", text)
+    text = _INLINE_CODE_PATTERN.sub(r"\1", text)
+    text = _EMPHASIS_PATTERN.sub(r"\1", text)
+    return _HTML_TAG_PATTERN.sub(" ", text)
+
+
+def build_compact_query(content: str, max_chars: int = 1000) -> str:
+    """
+    Riduce il documento a una query compatta: titolo, titoli delle sezioni, primo
+    paragrafo e termini chiave.
+
+    Frontmatter, blocchi di codice, tabelle e markup HTML vengono esclusi.
+    """
+    body = _FENCE_PATTERN.sub("", dedup.strip_frontmatter(content))
+
+    title = None
+    headings = []
+    paragraphs = []
+    current: list[str] = []
+    for line in body.splitlines():
+        stripped = line.strip()
+        heading = _HEADING_PATTERN.match(stripped)
+        if heading:
+            text = _strip_markup(heading.group(2)).strip()
+            if heading.group(1) == "#" and title is None:
+                title = text
+            elif len(heading.group(1)) <= 3:
+                headings.append(text)
+        # Tabelle, citazioni e righe vuote chiudono il paragrafo corrente
+        if heading or not stripped or stripped.startswith(("|", ">")):
+            if current:
+                paragraphs.append(" ".join(current))
+                current = []
+            continue
+        current.append(stripped.lstrip("-*+ ").strip())
+    if current:
+        paragraphs.append(" ".join(current))
+
+    plain_text = _strip_markup(" ".join(paragraphs))
+    term_counts = Counter(token for token in lexical_index.tokenize(plain_text) if len(token) > 2 and not token.isdigit())
+    key_terms = [term for term, _ in term_counts.most_common(_MAX_KEY_TERMS)]
+
+    parts = []
+    if title:
+        parts.append(f"Titolo: {title}")
+    if headings:
+        parts.append(f"Sezioni: {'; '.join(headings[:_MAX_HEADINGS])}")
+    if paragraphs:
+        parts.append(f"Introduzione: {_strip_markup(paragraphs[0]).strip()}")
+    if key_terms:
+        parts.append(f"Termini chiave: {', '.join(key_terms)}")
+
+    query = "\n".join(parts) or body.strip()
+    return query[:max_chars]
+
+
+def resolve_query_mode(embedding_provider: str) -> str:
+    """
+    Restituisce la modalità della query di ricerca per il provider di embedding.
+
+    `RETRIEVAL_QUERY_MODE_<PROVIDER>` (es. `RETRIEVAL_QUERY_MODE_OPENAI`) ha la precedenza
+    su `RETRIEVAL_QUERY_MODE`. Con `auto` (default) la query è compatta quando
+    interviene un modello di embedding e completa in modalità 'lexical', dove BM25
+    non ha costi né limiti di lunghezza.
+    """
+    provider_key = re.sub(r"[^A-Z0-9]", "_", embedding_provider.upper())
+    mode = (os.getenv(f"RETRIEVAL_QUERY_MODE_{provider_key}") or os.getenv("RETRIEVAL_QUERY_MODE") or "auto").strip().lower()
+    if mode == "auto":
+        return "full" if ai_core.resolve_retrieval_mode() == "lexical" else "compact"
+    if mode not in QUERY_MODES:
+        raise SystemExit(f"Errore: RETRIEVAL_QUERY_MODE non valido: '{mode}'. Usare 'auto', 'full' o 'compact'.")
+    return mode
+
+
+def _max_query_chars() -> int:
+    try:
+        return int(os.getenv("RETRIEVAL_QUERY_MAX_CHARS", "1000"))
+    except ValueError:
+        raise SystemExit("Errore: RETRIEVAL_QUERY_MAX_CHARS deve essere un numero intero.")
+
+
+def build_retrieval_query(content: str, embedding_provider: str, mode: str | None = None) -> str:
+    """Costruisce il testo della query per la ricerca di schemi e sezioni della knowledge base."""
+    mode = mode or resolve_query_mode(embedding_provider)
+    if mode == "full":
+        return content
+    return build_compact_query(content, _max_query_chars())
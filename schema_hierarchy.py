@@ -0,0 +1,196 @@
+import json
+import os
+import threading
+from pathlib import Path
+
+SCHEMA_PREFIXES = ("https://schema.org/", "http://schema.org/", "schema:")
+
+_hierarchy_lock = threading.Lock()
+_hierarchy_cache: dict[Path, "SchemaHierarchy | None"] = {}
+
+
+def get_hierarchy_path() -> Path:
+    """Restituisce il percorso dell'indice della gerarchia Schema.org."""
+    env_path = os.getenv("SCHEMA_HIERARCHY_PATH")
+    if env_path:
+        return Path(env_path).expanduser()
+    return Path(__file__).resolve().parent / "schema_index" / "schema_hierarchy.json"
+
+
+def _env_flag(name: str, default: str) -> bool:
+    return (os.getenv(name) or default).strip().lower() in {"1", "true", "yes", "on"}
+
+
+def is_validation_enabled() -> bool:
+    """Indica se validare l'oggetto `schema` generato (`SCHEMA_VALIDATION`, attivo di default)."""
+    return _env_flag("SCHEMA_VALIDATION", "true")
+
+
+def is_inheritance_enabled() -> bool:
+    """Indica se aggiungere le proprietà ereditate agli snippet recuperati (`SCHEMA_INHERITED_PROPERTIES`)."""
+    return _env_flag("SCHEMA_INHERITED_PROPERTIES", "true")
+
+
+def build_hierarchy(schema_data: dict) -> dict:
+    """
+    Costruisce l'indice compatto della gerarchia dei tipi.
+
+    Per ogni tipo memorizza le superclassi dirette, tutti gli antenati (chiusura
+    transitiva di rdfs:subClassOf, dal più vicino al più lontano) e le proprietà
+    dichiarate direttamente.
+    """
+    ancestors_cache: dict[str, list[str]] = {}
+
+    def ancestors_of(type_name: str, visiting: frozenset = frozenset()) -> list[str]:
+        if type_name in ancestors_cache:
+            return ancestors_cache[type_name]
+        ordered: list[str] = []
+        for parent in schema_data.get(type_name, {}).get("parents", []):
+            if parent not in schema_data or parent in visiting:
+                continue
+            for ancestor in [parent] + ancestors_of(parent, visiting | {type_name}):
+                if ancestor not in ordered:
+                    ordered.append(ancestor)
+        ancestors_cache[type_name] = ordered
+        return ordered
+
+    types = {}
+    for type_name, info in schema_data.items():
+        types[type_name] = {
+            "parents": [parent for parent in info.get("parents", []) if parent in schema_data],
+            "ancestors": ancestors_of(type_name),
+            "properties": sorted(info.get("properties", {}).keys()),
+        }
+    return {"types": types}
+
+
+def save_hierarchy(hierarchy: dict, path: Path) -> None:
+    """Salva l'indice su disco sostituendo il file in modo atomico."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(hierarchy, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def normalize_type_name(value) -> str:
+    """Rimuove i prefissi Schema.org da un valore di `@type`."""
+    name = str(value).strip()
+    for prefix in SCHEMA_PREFIXES:
+        if name.startswith(prefix):
+            return name[len(prefix):]
+    return name
+
+
+class SchemaHierarchy:
+    """Gerarchia dei tipi con insiemi di proprietà (dirette + ereditate) precalcolati per lookup O(1)."""
+
+    def __init__(self, hierarchy: dict):
+        self.types: dict[str, dict] = hierarchy.get("types", {})
+        self._all_properties: dict[str, frozenset[str]] = {
+            type_name: frozenset(
+                prop
+                for owner in [type_name] + info["ancestors"]
+                for prop in self.types.get(owner, {}).get("properties", [])
+            )
+            for type_name, info in self.types.items()
+        }
+
+    @classmethod
+    def load(cls, path: Path) -> "SchemaHierarchy":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def is_type(self, type_name: str) -> bool:
+        return type_name in self.types
+
+    def all_properties(self, type_name: str) -> frozenset[str]:
+        return self._all_properties.get(type_name, frozenset())
+
+    def inherited_properties_by_ancestor(self, type_name: str) -> list[tuple[str, list[str]]]:
+        """Restituisce le proprietà ereditate raggruppate per antenato."""
+        info = self.types.get(type_name)
+        if not info:
+            return []
+        return [
+            (ancestor, self.types[ancestor]["properties"])
+            for ancestor in info["ancestors"]
+            if self.types.get(ancestor, {}).get("properties")
+        ]
+
+    def _allowed_properties(self, node: dict) -> tuple[list[str], list[str], frozenset[str] | None]:
+        """Restituisce (tipi noti, tipi sconosciuti, proprietà ammesse) per i `@type` del nodo."""
+        declared = node.get("@type")
+        if declared is None:
+            declared = []
+        elif not isinstance(declared, list):
+            declared = [declared]
+        type_names = [normalize_type_name(t) for t in declared]
+        known = [t for t in type_names if self.is_type(t)]
+        unknown = [t for t in type_names if not self.is_type(t)]
+        allowed = frozenset().union(*(self.all_properties(t) for t in known)) if known else None
+        return known, unknown, allowed
+
+    def validate(self, node, path: str = "schema") -> list[str]:
+        """
+        Controlla ricorsivamente `@type` e nomi delle proprietà di un oggetto JSON-LD.
+
+        Ritorna:
+            list: descrizioni dei problemi trovati (vuota se l'oggetto è valido).
+        """
+        issues = []
+        if isinstance(node, list):
+            for index, item in enumerate(node):
+                issues.extend(self.validate(item, f"{path}[{index}]"))
+            return issues
+        if not isinstance(node, dict):
+            return issues
+
+        known, unknown, allowed = self._allowed_properties(node)
+        for type_name in unknown:
+            issues.append(f"{path}: '@type: {type_name}' non esiste in Schema.org")
+
+        for key, value in node.items():
+            if key.startswith("@"):
+                continue
+            if allowed is not None and normalize_type_name(key) not in allowed:
+                issues.append(f"{path}.{key}: proprietà non valida per {', '.join(known)}")
+            issues.extend(self.validate(value, f"{path}.{key}"))
+        return issues
+
+    def remove_invalid_properties(self, node) -> list[str]:
+        """Rimuove ricorsivamente le proprietà non ammesse dai tipi dichiarati; ritorna quelle rimosse."""
+        removed = []
+        if isinstance(node, list):
+            for item in node:
+                removed.extend(self.remove_invalid_properties(item))
+            return removed
+        if not isinstance(node, dict):
+            return removed
+
+        _, _, allowed = self._allowed_properties(node)
+        for key in list(node):
+            if key.startswith("@"):
+                continue
+            if allowed is not None and normalize_type_name(key) not in allowed:
+                removed.append(key)
+                del node[key]
+            else:
+                removed.extend(self.remove_invalid_properties(node[key]))
+        return removed
+
+
+def get_hierarchy() -> SchemaHierarchy | None:
+    """Carica (una sola volta) l'indice della gerarchia; None se non è stato generato."""
+    path = get_hierarchy_path()
+    with _hierarchy_lock:
+        if path not in _hierarchy_cache:
+            _hierarchy_cache[path] = SchemaHierarchy.load(path) if path.is_file() else None
+        return _hierarchy_cache[path]
+
+
+def reset_hierarchy() -> None:
+    """Dimentica l'indice caricato, ad esempio dopo una nuova indicizzazione."""
+    with _hierarchy_lock:
+        _hierarchy_cache.clear()
@@ -0,0 +1,70 @@
+import json
+
+import ai_core
+
+
+def _feed(terminator, text, chunk_size=7):
+    for start in range(0, len(text), chunk_size):
+        if terminator.feed(text[start:start + chunk_size]):
+            return True
+    return False
+
+
+def test_yaml_terminator_stops_after_schema_block():
+    terminator = ai_core.YamlBlockTerminator({"document", "schema"})
+    output = "document:\n  title: Guida\nschema:\n  '@type': TechArticle\n  name: Guida\nCommento finale del modello\n"
+
+    assert _feed(terminator, output)
+    assert terminator.result() == "document:\n  title: Guida\nschema:\n  '@type': TechArticle\n  name: Guida"
+
+
+def test_yaml_terminator_waits_for_required_keys_after_schema():
+    terminator = ai_core.YamlBlockTerminator({"document", "schema"})
+    output = "schema:\n  '@type': TechArticle\ndocument:\n  title: Guida\n"
+
+    assert not _feed(terminator, output)
+    assert "document:\n  title: Guida" in terminator.result()
+
+
+def test_yaml_terminator_ignores_top_level_lines_inside_open_flow_style():
+    terminator = ai_core.YamlBlockTerminator()
+    output = 'schema: {"@type": "TechArticle",\n"name": "a}b"\n}\naltro: testo\n'
+
+    assert _feed(terminator, output)
+    assert terminator.result() == 'schema: {"@type": "TechArticle",\n"name": "a}b"\n}'
+
+
+def test_yaml_terminator_stops_at_closing_code_fence():
+    terminator = ai_core.YamlBlockTerminator()
+
+    assert _feed(terminator, "```yaml\ndocument:\n  title: Guida\n```\nSpiegazione\n")
+    assert terminator.result() == "document:\n  title: Guida"
+
+
+def test_json_terminator_stops_when_top_level_object_closes():
+    terminator = ai_core.JsonObjectTerminator()
+    output = '{"document": {"title": "a } b \\" {"}, "tags": [1, {}]} testo successivo'
+
+    assert _feed(terminator, output, chunk_size=5)
+    assert json.loads(terminator.result()) == {"document": {"title": 'a } b " {'}, "tags": [1, {}]}
+
+
+def test_decode_structured_output_restores_schema_and_drops_nulls():
+    raw_output = json.dumps({
+        "document": {"title": "Guida", "summary": None},
+        "schema": json.dumps({"@type": "TechArticle", "name": "Guida"}),
+    })
+
+    data, error = ai_core.parse_yaml_with_error(ai_core._decode_structured_output(raw_output))
+
+    assert error is None
+    assert data == {"document": {"title": "Guida"}, "schema": {"@type": "TechArticle", "name": "Guida"}}
+
+
+def test_decode_structured_output_with_invalid_schema_string_is_a_parse_error():
+    raw_output = json.dumps({"document": {"title": "Guida"}, "schema": "{non è JSON"})
+
+    data, error = ai_core.parse_yaml_with_error(ai_core._decode_structured_output(raw_output))
+
+    assert data is None
+    assert "schema" in error
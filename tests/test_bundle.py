@@ -0,0 +1,56 @@
+import pytest
+
+import bundle
+import file_handler
+
+
+@pytest.mark.parametrize("relative_path", ["", "/etc/passwd", "../fuori.md", "docs/../../fuori.md", "C:\\fuori.md"])
+def test_unsafe_entry_paths_are_rejected(tmp_path, relative_path):
+    assert bundle._is_unsafe_entry_path(relative_path, tmp_path)
+
+
+def test_symlink_leaving_the_root_is_rejected(tmp_path):
+    root = tmp_path / "root"
+    outside = tmp_path / "outside"
+    root.mkdir()
+    outside.mkdir()
+    (root / "link").symlink_to(outside, target_is_directory=True)
+
+    assert bundle._is_unsafe_entry_path("link/file.md", root)
+    assert not bundle._is_unsafe_entry_path("docs/file.md", root)
+
+
+def test_apply_skips_files_changed_or_removed_after_generation(tmp_path):
+    contents = {"a.md": "# A\n\nTesto A.\n", "b.md": "# B\n\nTesto B.\n", "c.md": "# C\n\nTesto C.\n"}
+    for name, content in contents.items():
+        (tmp_path / name).write_text(content, encoding="utf-8")
+
+    bundle_path = tmp_path / "out" / "bundle.jsonl.gz"
+    with bundle.BundleWriter(bundle_path, tmp_path, generator="test") as writer:
+        for name, content in contents.items():
+            writer.add(tmp_path / name, content, {"document": {"title": name}}, tier="primary", backend="test:model")
+
+    (tmp_path / "b.md").write_text("# B\n\nTesto modificato.\n", encoding="utf-8")
+    (tmp_path / "c.md").unlink()
+
+    summary, updated_files = bundle.apply_bundle(bundle_path, tmp_path)
+
+    assert summary["updated"] == 1
+    assert summary["stale"] == 2
+    assert updated_files == [str(tmp_path / "a.md")]
+    assert file_handler.has_frontmatter((tmp_path / "a.md").read_text(encoding="utf-8"))
+    assert not file_handler.has_frontmatter((tmp_path / "b.md").read_text(encoding="utf-8"))
+
+
+def test_apply_rejects_bundle_with_paths_outside_the_root(tmp_path):
+    content = "# A\n"
+    (tmp_path / "a.md").write_text(content, encoding="utf-8")
+    bundle_path = tmp_path / "bundle.jsonl"
+    with bundle.BundleWriter(bundle_path, tmp_path) as writer:
+        writer.add(tmp_path / "a.md", content, {"document": {"title": "A"}})
+    with open(bundle_path, "a", encoding="utf-8") as f:
+        f.write('{"path": "../fuori.md", "content_sha256": "x", "frontmatter": {}}\n')
+
+    with pytest.raises(SystemExit):
+        bundle.apply_bundle(bundle_path, tmp_path)
+    assert not file_handler.has_frontmatter((tmp_path / "a.md").read_text(encoding="utf-8"))
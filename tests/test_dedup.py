@@ -0,0 +1,55 @@
+import numpy as np
+
+import dedup
+
+
+def _words(prefix, count):
+    return [f"{prefix}{index}" for index in range(count)]
+
+
+def test_identical_documents_form_one_cluster_with_first_key_as_representative():
+    text = " ".join(_words("w", 200))
+    clusters = dedup.cluster_near_duplicates({"b.md": text, "a.md": text, "c.md": " ".join(_words("z", 200))})
+
+    assert clusters == [["a.md", "b.md"]]
+
+
+def test_members_must_reach_the_threshold_against_the_representative():
+    base = _words("w", 400)
+    documents = {
+        "a.md": " ".join(base),
+        # Simile ad a.md e a c.md, ma c.md non è simile ad a.md: niente fusione transitiva
+        "b.md": " ".join(base[:370] + _words("x", 30)),
+        "c.md": " ".join(base[:340] + _words("x", 30) + _words("y", 30)),
+    }
+
+    clusters = dedup.cluster_near_duplicates(documents, threshold=0.8)
+
+    assert clusters == [["a.md", "b.md"]]
+
+
+def test_documents_below_threshold_are_not_clustered():
+    base = _words("w", 200)
+    documents = {"a.md": " ".join(base), "b.md": " ".join(base[:100] + _words("x", 100))}
+
+    assert dedup.cluster_near_duplicates(documents, threshold=0.9) == []
+
+
+def test_existing_frontmatter_is_ignored():
+    text = " ".join(_words("w", 200))
+    documents = {"a.md": text, "b.md": "---\ntitle: Altro\n---\n" + text}
+
+    assert dedup.cluster_near_duplicates(documents) == [["a.md", "b.md"]]
+
+
+def test_minhash_signature_matches_modular_arithmetic():
+    hasher = dedup.MinHasher(num_perm=16)
+    hashes = np.array([(1 << 32) - 1, 12345, 0], dtype=np.uint64)
+    prime = (1 << 61) - 1
+
+    expected = [
+        min(((int(a) * int(x) + int(b)) % prime) & 0xFFFFFFFF for x in hashes)
+        for a, b in zip(hasher._a, hasher._b)
+    ]
+
+    assert hasher.signature(hashes).tolist() == expected
@@ -0,0 +1,92 @@
+import time
+from pathlib import Path
+
+import pytest
+
+import work_queue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return work_queue.WorkQueue(tmp_path / "queue.db", lease_seconds=0.2, max_attempts=2)
+
+
+def test_enqueue_is_idempotent(queue):
+    assert queue.enqueue([("a.md", "1"), ("b.md", "2")]) == 2
+    assert queue.enqueue([("a.md", "1"), ("c.md", "3")]) == 1
+
+
+def test_expired_lease_is_handed_to_another_worker(queue):
+    queue.enqueue([("a.md", "1")])
+    assert queue.lease("w1") == "a.md"
+    assert queue.lease("w2") is None
+
+    time.sleep(0.3)
+
+    assert queue.lease("w2") == "a.md"
+    # Il primo worker ha perso il lease: heartbeat e risultato vengono rifiutati
+    assert not queue.heartbeat("a.md", "w1")
+    assert not queue.complete("a.md", "w1", {"document": {}}, "1", "primary", "test:model")
+    assert queue.complete("a.md", "w2", {"document": {}}, "1", "primary", "test:model")
+    assert queue.counts() == {"done": 1}
+
+
+def test_heartbeat_keeps_the_lease(queue):
+    queue.enqueue([("a.md", "1")])
+    queue.lease("w1")
+    for _ in range(3):
+        time.sleep(0.1)
+        assert queue.heartbeat("a.md", "w1")
+
+    assert queue.lease("w2") is None
+
+
+def test_failed_file_is_retried_until_max_attempts(queue):
+    queue.enqueue([("a.md", "1")])
+
+    assert queue.lease("w1") == "a.md"
+    queue.fail("a.md", "w1", "errore")
+    assert queue.counts() == {"pending": 1}
+
+    assert queue.lease("w2") == "a.md"
+    queue.fail("a.md", "w2", "errore")
+    assert queue.counts() == {"failed": 1}
+    assert queue.lease("w3") is None
+
+
+def test_lease_expired_on_last_attempt_marks_the_file_failed(queue):
+    queue.enqueue([("a.md", "1")])
+    queue.lease("w1")
+    time.sleep(0.3)
+    queue.lease("w2")
+    time.sleep(0.3)
+
+    assert queue.lease("w3") is None
+    assert queue.counts() == {"failed": 1}
+
+
+@pytest.mark.parametrize("value, expected", [("1/1", (1, 1)), ("2/4", (2, 4)), ("4/4", (4, 4))])
+def test_parse_shard(value, expected):
+    assert work_queue.parse_shard(value) == expected
+
+
+@pytest.mark.parametrize("value", ["0/4", "5/4", "1/0", "2", "a/b"])
+def test_parse_shard_rejects_invalid_values(value):
+    with pytest.raises(SystemExit):
+        work_queue.parse_shard(value)
+
+
+def test_shard_assignment_is_stable_and_partitions_the_files(tmp_path):
+    files = [tmp_path / "docs" / f"file{index}.md" for index in range(50)]
+
+    # Valori fissi: l'assegnazione non deve dipendere da processo, macchina o PYTHONHASHSEED
+    assert [work_queue.shard_of(f"docs/file{index}.md", 3) for index in range(8)] == [2, 2, 2, 3, 1, 1, 1, 3]
+
+    shards = [work_queue.select_shard(files, tmp_path, (index, 3)) for index in range(1, 4)]
+    assert sorted(path for shard in shards for path in shard) == sorted(files)
+    assert sum(len(shard) for shard in shards) == len(files)
+
+
+def test_relative_key_is_posix(tmp_path):
+    assert work_queue.relative_key(tmp_path / "docs" / "a.md", tmp_path) == "docs/a.md"
+    assert work_queue.relative_key(Path("docs") / "b.md", Path(".")) == "docs/b.md"
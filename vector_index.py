@@ -0,0 +1,114 @@
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+MATRIX_FILE_NAME = "embeddings.f32"
+SIDECAR_FILE_NAME = "index.json"
+
+
+def get_numpy_index_directory(collection_name: str = "schema_embeddings") -> Path:
+    """Restituisce la cartella dell'indice NumPy per una collection."""
+    env_path = os.getenv("NUMPY_INDEX_PATH")
+    base_path = Path(env_path).expanduser() if env_path else Path(__file__).resolve().parent / "vector_index"
+    return base_path / collection_name
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def export_collection(collection, directory: Path, metadata: dict | None = None) -> int:
+    """
+    Esporta una collection ChromaDB in una matrice float32 normalizzata (memory-mapped
+    in lettura) più un file JSON con id e documenti.
+
+    Ritorna:
+        int: numero di vettori esportati.
+    """
+    data = collection.get(include=["embeddings", "documents"])
+    ids = list(data.get("ids") or [])
+    embeddings = data.get("embeddings")
+    if not ids or embeddings is None or len(embeddings) == 0:
+        raise SystemExit("Errore: La collection da esportare è vuota.")
+
+    matrix = _normalize_rows(np.asarray(embeddings, dtype=np.float32))
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    sidecar = {
+        "ids": ids,
+        "documents": list(data.get("documents") or [""] * len(ids)),
+        "count": int(matrix.shape[0]),
+        "dimension": int(matrix.shape[1]),
+        "metadata": metadata or {},
+    }
+
+    # Scrittura su file temporanei e sostituzione: i lettori non vedono mai file parziali
+    matrix_tmp = directory / f"{MATRIX_FILE_NAME}.tmp"
+    sidecar_tmp = directory / f"{SIDECAR_FILE_NAME}.tmp"
+    matrix.tofile(matrix_tmp)
+    with open(sidecar_tmp, "w", encoding="utf-8") as f:
+        json.dump(sidecar, f, ensure_ascii=False)
+    os.replace(matrix_tmp, directory / MATRIX_FILE_NAME)
+    os.replace(sidecar_tmp, directory / SIDECAR_FILE_NAME)
+
+    return sidecar["count"]
+
+
+class NumpyVectorIndex:
+    """
+    Indice vettoriale in-process con similarità coseno vettorializzata.
+
+    Espone un metodo `query` compatibile con quello delle collection ChromaDB, così da
+    poter essere usato al posto della collection in `retrieve_relevant_schemas`.
+    """
+
+    def __init__(self, directory: Path, embedding_function):
+        directory = Path(directory)
+        sidecar_path = directory / SIDECAR_FILE_NAME
+        if not sidecar_path.is_file():
+            raise SystemExit(
+                f"Errore: Indice NumPy non trovato in '{directory}'. Eseguire 'python indexer.py --export-numpy'."
+            )
+
+        with open(sidecar_path, "r", encoding="utf-8") as f:
+            sidecar = json.load(f)
+
+        self.directory = directory
+        self.ids: list[str] = sidecar["ids"]
+        self.documents: list[str] = sidecar["documents"]
+        self.metadata: dict = sidecar.get("metadata", {})
+        self.embedding_function = embedding_function
+        self.matrix = np.memmap(
+            directory / MATRIX_FILE_NAME,
+            dtype=np.float32,
+            mode="r",
+            shape=(sidecar["count"], sidecar["dimension"]),
+        )
+
+    def count(self) -> int:
+        return len(self.ids)
+
+    def query(self, query_texts: list[str], n_results: int = 10, **kwargs) -> dict:
+        """Restituisce i top-k risultati per una o più query, nel formato di ChromaDB."""
+        query_vectors = _normalize_rows(np.asarray(self.embedding_function(list(query_texts)), dtype=np.float32))
+        if query_vectors.shape[1] != self.matrix.shape[1]:
+            raise ValueError(
+                f"Dimensione degli embeddings ({query_vectors.shape[1]}) diversa da quella dell'indice ({self.matrix.shape[1]})."
+            )
+
+        scores = query_vectors @ self.matrix.T
+        k = min(n_results, scores.shape[1])
+        top_indices = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+
+        result = {"ids": [], "documents": [], "distances": []}
+        for row, candidates in enumerate(top_indices):
+            ordered = candidates[np.argsort(-scores[row, candidates])]
+            result["ids"].append([self.ids[i] for i in ordered])
+            result["documents"].append([self.documents[i] for i in ordered])
+            result["distances"].append([float(1.0 - scores[row, i]) for i in ordered])
+        return result
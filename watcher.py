@@ -0,0 +1,148 @@
+import hashlib
+import threading
+import time
+from pathlib import Path
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # watchdog è opzionale: senza di esso si usa il polling
+    FileSystemEventHandler = object
+    Observer = None
+
+
+def file_digest(file_path: Path) -> str | None:
+    """Restituisce l'hash SHA-256 del contenuto del file (None se non leggibile)."""
+    try:
+        return hashlib.sha256(Path(file_path).read_bytes()).hexdigest()
+    except OSError:
+        return None
+
+
+class _MarkdownEventHandler(FileSystemEventHandler):
+    """Inoltra al watcher gli eventi inotify relativi ai file Markdown."""
+
+    def __init__(self, watcher):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.watcher.notify(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.watcher.notify(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.watcher.notify(event.dest_path)
+
+
+class MarkdownWatcher:
+    """
+    Monitora una cartella e passa al callback i file Markdown creati o modificati.
+
+    Usa inotify tramite `watchdog` quando disponibile, altrimenti un polling periodico
+    delle date di modifica. Le raffiche di salvataggi vengono raggruppate (debounce)
+    e le scritture fatte dal callback stesso vengono ignorate confrontando l'hash
+    del contenuto registrato subito dopo la scrittura.
+    """
+
+    def __init__(self, root_path, on_change, debounce: float = 2.0, poll_interval: float = 1.0, use_polling: bool = False):
+        self.root_path = Path(root_path).resolve()
+        self.on_change = on_change
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.use_polling = use_polling or Observer is None
+        self._pending: dict[Path, float] = {}
+        self._own_writes: dict[Path, str] = {}
+        self._lock = threading.Lock()
+
+    def notify(self, path):
+        """Registra un evento su un file; i file non Markdown vengono ignorati."""
+        file_path = Path(path).resolve()
+        if file_path.suffix.lower() != ".md":
+            return
+        with self._lock:
+            self._pending[file_path] = time.monotonic()
+
+    def _take_ready(self) -> list[Path]:
+        """Estrae i file per cui è trascorso il tempo di debounce dall'ultimo evento."""
+        now = time.monotonic()
+        with self._lock:
+            ready = [path for path, last_event in self._pending.items() if now - last_event >= self.debounce]
+            for path in ready:
+                del self._pending[path]
+
+        changed = []
+        for path in ready:
+            if not path.is_file():
+                continue
+            digest = file_digest(path)
+            if digest is not None and self._own_writes.get(path) == digest:
+                # Evento generato dalla nostra scrittura del frontmatter
+                continue
+            self._own_writes.pop(path, None)
+            changed.append(path)
+        return sorted(changed)
+
+    def _snapshot(self) -> dict[Path, tuple[int, int]]:
+        snapshot = {}
+        for path in self.root_path.glob("**/*.md"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            snapshot[path.resolve()] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def _start_observer(self):
+        """Avvia l'observer inotify; ritorna None se non disponibile (es. limite di watch raggiunto)."""
+        if self.use_polling:
+            return None
+        observer = Observer()
+        try:
+            observer.schedule(_MarkdownEventHandler(self), str(self.root_path), recursive=True)
+            observer.start()
+        except OSError as e:
+            print(f"[!] Monitoraggio inotify non disponibile ({e}). Passaggio al polling.")
+            return None
+        return observer
+
+    def run(self):
+        """Esegue il ciclo di monitoraggio fino a KeyboardInterrupt."""
+        observer = self._start_observer()
+        snapshot = self._snapshot() if observer is None else {}
+        mode = "polling" if observer is None else "inotify"
+        print(f"[+] Monitoraggio di '{self.root_path}' avviato ({mode}, debounce {self.debounce:.1f}s). Ctrl+C per terminare.")
+
+        last_poll = time.monotonic()
+        try:
+            while True:
+                time.sleep(min(0.25, self.poll_interval))
+
+                if observer is None and time.monotonic() - last_poll >= self.poll_interval:
+                    last_poll = time.monotonic()
+                    current = self._snapshot()
+                    for path, signature in current.items():
+                        if snapshot.get(path) != signature:
+                            self.notify(path)
+                    snapshot = current
+
+                changed = self._take_ready()
+                if not changed:
+                    continue
+
+                written_files = self.on_change(changed) or []
+                for written in written_files:
+                    written_path = Path(written).resolve()
+                    digest = file_digest(written_path)
+                    if digest is not None:
+                        self._own_writes[written_path] = digest
+        except KeyboardInterrupt:
+            print("\n[+] Monitoraggio interrotto.")
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
@@ -0,0 +1,424 @@
+import argparse
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+import file_handler
+import profiling
+
+DEFAULT_LEASE_SECONDS = 300.0
+DEFAULT_MAX_ATTEMPTS = 3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    path TEXT PRIMARY KEY,
+    content_sha256 TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    frontmatter TEXT,
+    tier TEXT,
+    backend TEXT,
+    error TEXT,
+    applied INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+"""
+
+
+# --- Partizionamento statico ---
+def parse_shard(value: str) -> tuple[int, int]:
+    """Interpreta `--shard i/N` (i da 1 a N)."""
+    try:
+        index, count = (int(part) for part in value.split("/", 1))
+    except ValueError:
+        raise SystemExit(f"Errore: Shard non valido: '{value}'. Usare il formato i/N (es. 2/4).")
+    if count < 1 or not 1 <= index <= count:
+        raise SystemExit(f"Errore: Shard non valido: '{value}'. L'indice deve essere compreso tra 1 e N.")
+    return index, count
+
+
+def relative_key(file_path: Path, root_path: Path) -> str:
+    """Percorso relativo in formato POSIX, identico su ogni macchina e sistema operativo."""
+    return Path(os.path.relpath(file_path, root_path)).as_posix()
+
+
+def shard_of(key: str, count: int) -> int:
+    """Shard (da 1 a count) assegnato a un percorso tramite hash stabile."""
+    digest = hashlib.sha1(key.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count + 1
+
+
+def select_shard(markdown_files: list[Path], root_path: Path, shard: tuple[int, int]) -> list[Path]:
+    """Restituisce i file assegnati allo shard: ogni file appartiene a uno e un solo shard."""
+    index, count = shard
+    return [file_path for file_path in markdown_files if shard_of(relative_key(file_path, root_path), count) == index]
+
+
+# --- Coda di lavoro su SQLite ---
+class WorkQueue:
+    """
+    Coda di file condivisa tra worker, su un database SQLite.
+
+    I worker prendono in lease un file alla volta; il lease va rinnovato con
+    `heartbeat` e, se scade (worker terminato), il file torna disponibile. I risultati
+    (frontmatter, livello, backend) restano nel database fino al passo di merge.
+    """
+
+    def __init__(self, db_path: str | Path, lease_seconds: float = DEFAULT_LEASE_SECONDS, max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+        self.db_path = str(db_path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        with self._connect() as connection:
+            connection.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # Una connessione per thread: il thread di heartbeat usa la propria
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            # Journal di rollback: il WAL richiede memoria condivisa e non funziona su filesystem di rete
+            connection.execute("PRAGMA journal_mode=DELETE")
+            connection.execute("PRAGMA busy_timeout=30000")
+            self._local.connection = connection
+        return connection
+
+    def _transaction(self):
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        return connection
+
+    def enqueue(self, entries: list[tuple[str, str]]) -> int:
+        """Aggiunge i file (percorso relativo, hash) non ancora presenti; ritorna quanti sono nuovi."""
+        connection = self._transaction()
+        try:
+            before = connection.total_changes
+            connection.executemany(
+                "INSERT OR IGNORE INTO jobs (path, content_sha256, updated_at) VALUES (?, ?, ?)",
+                [(path, sha, time.time()) for path, sha in entries],
+            )
+            added = connection.total_changes - before
+            connection.execute("COMMIT")
+            return added
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def lease(self, worker: str) -> str | None:
+        """
+        Prende in lease il prossimo file disponibile (nuovo o con lease scaduto).
+
+        I lease scaduti che hanno già esaurito `max_attempts` (worker terminato durante
+        l'ultimo tentativo) vengono segnati come falliti, così il merge non li attende.
+        """
+        now = time.time()
+        connection = self._transaction()
+        try:
+            connection.execute(
+                """
+                UPDATE jobs SET status = 'failed', lease_until = NULL, updated_at = ?,
+                    error = 'Lease scaduto all''ultimo tentativo (worker ' || COALESCE(worker, '?') || ' terminato?)'
+                WHERE status = 'leased' AND lease_until < ? AND attempts >= ?
+                """,
+                (now, now, self.max_attempts),
+            )
+            row = connection.execute(
+                """
+                SELECT path FROM jobs
+                WHERE (status = 'pending' OR (status = 'leased' AND lease_until < ?))
+                  AND attempts < ?
+                ORDER BY attempts, path
+                LIMIT 1
+                """,
+                (now, self.max_attempts),
+            ).fetchone()
+            if row is None:
+                connection.execute("COMMIT")
+                return None
+            connection.execute(
+                """
+                UPDATE jobs SET status = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1, updated_at = ?
+                WHERE path = ?
+                """,
+                (worker, now + self.lease_seconds, now, row["path"]),
+            )
+            connection.execute("COMMIT")
+            return row["path"]
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def heartbeat(self, path: str, worker: str) -> bool:
+        """Rinnova il lease; False se il file è stato riassegnato a un altro worker."""
+        now = time.time()
+        cursor = self._connect().execute(
+            "UPDATE jobs SET lease_until = ?, updated_at = ? WHERE path = ? AND worker = ? AND status = 'leased'",
+            (now + self.lease_seconds, now, path, worker),
+        )
+        return cursor.rowcount > 0
+
+    def _finish(self, path: str, worker: str, status: str, **fields) -> bool:
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        cursor = self._connect().execute(
+            f"UPDATE jobs SET status = ?, lease_until = NULL, updated_at = ?{', ' + assignments if assignments else ''} "
+            "WHERE path = ? AND worker = ? AND status = 'leased'",
+            (status, time.time(), *fields.values(), path, worker),
+        )
+        return cursor.rowcount > 0
+
+    def complete(self, path: str, worker: str, frontmatter: dict, sha: str, tier: str, backend: str) -> bool:
+        return self._finish(
+            path, worker, "done",
+            frontmatter=json.dumps(frontmatter, ensure_ascii=False, default=str),
+            content_sha256=sha, tier=tier, backend=backend, error=None,
+        )
+
+    def skip(self, path: str, worker: str, reason: str) -> bool:
+        return self._finish(path, worker, "skipped", error=reason)
+
+    def fail(self, path: str, worker: str, error: str) -> bool:
+        """Registra un errore: il file torna in coda finché non supera `max_attempts`."""
+        connection = self._connect()
+        row = connection.execute("SELECT attempts FROM jobs WHERE path = ?", (path,)).fetchone()
+        status = "failed" if row is None or row["attempts"] >= self.max_attempts else "pending"
+        return self._finish(path, worker, status, error=error)
+
+    def counts(self) -> dict[str, int]:
+        rows = self._connect().execute("SELECT status, COUNT(*) AS total FROM jobs GROUP BY status").fetchall()
+        return {row["status"]: row["total"] for row in rows}
+
+    def results(self) -> list[sqlite3.Row]:
+        return self._connect().execute("SELECT * FROM jobs ORDER BY path").fetchall()
+
+    def mark_applied(self, path: str) -> None:
+        self._connect().execute("UPDATE jobs SET applied = 1 WHERE path = ?", (path,))
+
+
+class LeaseHeartbeat:
+    """Rinnova il lease in un thread separato mentre il file è in elaborazione."""
+
+    def __init__(self, queue: WorkQueue, path: str, worker: str):
+        self.queue = queue
+        self.path = path
+        self.worker = worker
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        interval = max(self.queue.lease_seconds / 3, 1.0)
+        while not self._stop.wait(interval):
+            if not self.queue.heartbeat(self.path, self.worker):
+                self.lost = True
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def run_worker(queue: WorkQueue, root_path: Path, llm_config, schema_collection, prompt_template, kb_content,
+               force: bool = False, worker_id: str | None = None) -> dict:
+    """
+    Accoda i file della cartella (se non già presenti) ed elabora la coda fino a esaurimento.
+
+    I worker non modificano i file: il frontmatter viene salvato nel database e
+    applicato una sola volta dal passo di merge.
+    """
+    import ai_core
+    import processing_core
+
+    worker_id = worker_id or default_worker_id()
+    root_path = Path(root_path)
+
+    entries = []
+    for file_path in file_handler.scan_markdown_files(root_path):
+        with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+            entries.append((relative_key(file_path, root_path), file_handler.content_sha256(f.read())))
+    added = queue.enqueue(entries)
+    print(f"[+] Coda '{queue.db_path}': {added} nuovi file accodati, worker '{worker_id}'.")
+
+    required_fields = ai_core.get_required_fields(ai_core.parse_frontmatter_blueprint(kb_content))
+    summary = processing_core.new_summary(llm_config, total_files=len(entries))
+    summary["lost_leases"] = 0
+
+    while True:
+        key = queue.lease(worker_id)
+        if key is None:
+            break
+
+        print(f"\n--- Elaborazione di: {key} (worker {worker_id}) ---")
+        summary["processed"] += 1
+        file_path = root_path / key
+        try:
+            with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+                content = f.read()
+            if not content.strip():
+                queue.skip(key, worker_id, "File vuoto.")
+                summary["skipped"] += 1
+                continue
+            if file_handler.has_frontmatter(content) and not force:
+                queue.skip(key, worker_id, "File già con frontmatter.")
+                summary["skipped"] += 1
+                continue
+
+            with LeaseHeartbeat(queue, key, worker_id) as heartbeat:
+                frontmatter, tier, backend = processing_core.generate_validated_frontmatter(
+                    content, llm_config, schema_collection, prompt_template, kb_content, required_fields, summary
+                )
+            summary[f"tier_{tier}"] += 1
+            if heartbeat.lost:
+                print("  -> Lease scaduto: il file è stato riassegnato, risultato scartato.")
+                summary["lost_leases"] += 1
+                continue
+
+            if frontmatter:
+                queue.complete(key, worker_id, frontmatter, file_handler.content_sha256(content), tier, backend)
+                summary["backends"][backend] = summary["backends"].get(backend, 0) + 1
+                print("  -> Frontmatter salvato nella coda.")
+            else:
+                queue.fail(key, worker_id, "Generazione del frontmatter non riuscita.")
+                summary["errors"] += 1
+        except Exception as e:
+            print(f"  -> Errore imprevisto durante l'elaborazione del file: {e}")
+            queue.fail(key, worker_id, str(e))
+            summary["errors"] += 1
+
+    return summary
+
+
+def merge_results(queue: WorkQueue, root_path: Path, force: bool = False, commit: bool = False,
+                  message: str = "feat: Aggiunge frontmatter generato da AI") -> tuple[dict, list[str]]:
+    """
+    Applica ai file il frontmatter raccolto da tutti i worker e produce il riepilogo complessivo.
+
+    I file modificati dopo la generazione (hash diverso) non vengono toccati. Con
+    `commit` si crea un unico commit git locale con tutti i file aggiornati.
+    """
+    root_path = Path(root_path)
+    rows = queue.results()
+    summary = {
+        "total": len(rows),
+        "processed": 0,
+        "updated": 0,
+        "skipped": 0,
+        "errors": 0,
+        "tier_fast": 0,
+        "tier_primary": 0,
+        "cascade": False,
+        "pool": False,
+        "backends": {},
+        "stale": 0,
+        "pending": 0,
+    }
+    updated_files = []
+
+    for row in rows:
+        status = row["status"]
+        if status in {"pending", "leased"}:
+            summary["pending"] += 1
+            continue
+        summary["processed"] += 1
+        if status == "skipped":
+            summary["skipped"] += 1
+            continue
+        if status == "failed":
+            summary["errors"] += 1
+            continue
+
+        summary[f"tier_{row['tier']}"] = summary.get(f"tier_{row['tier']}", 0) + 1
+        if row["tier"] == "fast":
+            summary["cascade"] = True
+        summary["backends"][row["backend"]] = summary["backends"].get(row["backend"], 0) + 1
+        if row["applied"]:
+            summary["skipped"] += 1
+            continue
+
+        file_path = root_path / row["path"]
+        outcome = file_handler.update_file_if_unchanged(file_path, row["content_sha256"], json.loads(row["frontmatter"]), force)
+        if outcome == "stale":
+            print(f"  -> {row['path']}: file modificato dopo la generazione, non aggiornato.")
+            summary["stale"] += 1
+        elif outcome == "updated":
+            queue.mark_applied(row["path"])
+            summary["updated"] += 1
+            updated_files.append(str(file_path))
+        else:
+            summary["skipped"] += 1
+
+    summary["pool"] = len(summary["backends"]) > 1
+
+    if commit and updated_files:
+        import git_handler
+
+        repo_root = git_handler.find_repo_root(str(root_path))
+        if repo_root is None:
+            raise SystemExit(f"Errore: '{root_path}' non è all'interno di un repository git.")
+        if git_handler.commit_files(repo_root, message, updated_files):
+            print(f"[+] Commit creato con {len(updated_files)} file aggiornati.")
+
+    return summary, updated_files
+
+
+def main():
+    """Gestione della coda condivisa: stato dei job e merge dei risultati."""
+    sys.stdout.reconfigure(encoding='utf-8')
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Gestisce la coda di lavoro condivisa tra i worker.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    status_parser = subparsers.add_parser("status", help="Mostra lo stato dei file in coda.")
+    status_parser.add_argument("--db", required=True, help="Percorso del database SQLite della coda.")
+
+    merge_parser = subparsers.add_parser("merge", help="Applica i risultati dei worker e crea un unico commit.")
+    merge_parser.add_argument("--db", required=True, help="Percorso del database SQLite della coda.")
+    merge_parser.add_argument("--path", required=True, help="Cartella dei file Markdown (la stessa usata dai worker).")
+    merge_parser.add_argument("--force", action="store_true", help="Sovrascrive il frontmatter esistente.")
+    merge_parser.add_argument("--commit", action="store_true", help="Crea un commit git locale con i file aggiornati.")
+    merge_parser.add_argument("--message", default="feat: Aggiunge frontmatter generato da AI", help="Messaggio del commit.")
+    merge_parser.add_argument("--profile", action="store_true", help="Profila CPU e memoria per stage (incluso il commit git) e scrive i report in PROFILE_DIR.")
+    args = parser.parse_args()
+
+    if not Path(args.db).is_file():
+        raise SystemExit(f"Errore: Database della coda '{args.db}' non trovato.")
+    queue = WorkQueue(args.db)
+
+    if args.command == "status":
+        for status, total in sorted(queue.counts().items()):
+            print(f"{status}: {total}")
+        return
+
+    import processing_core
+
+    print(f"--- Merge dei risultati da '{args.db}' ---")
+    with profiling.profile_run("merge", enabled=args.profile):
+        summary, _ = merge_results(queue, Path(args.path), force=args.force, commit=args.commit, message=args.message)
+    print("\n--- Riepilogo complessivo ---")
+    processing_core.print_summary(summary)
+    if summary["pending"]:
+        print(f"File ancora in coda o in elaborazione: {summary['pending']}")
+
+
+if __name__ == "__main__":
+    main()